@@ -18,8 +18,8 @@ import warnings
 import numpy as np
 import PIL
 import pylink
+from experiment.audio import ScheduledTone
 from psychos.core.keys import _id_to_symbol
-from psychos.sound import FlatEnvelope, Sine
 from psychos.visual import Circle, RawImage, Text
 from pyglet.window.key import \
     KeyStateHandler  # used to emulate psychopy.event.get_key()
@@ -30,15 +30,12 @@ def create_puretone(frequency, duration=0.2, amplitude=1):
     Create a puretone sound stimulus.
     :param frequency: Frequency of the puretone in Hz.
     :param duration: Duration of the puretone in seconds.
-    :return: A Sine object representing the puretone.
+    :return: A ScheduledTone, played by the session audio engine.
     """
-    envelope = FlatEnvelope(
-        amplitude=amplitude,
-    )
-    puretone = Sine(
-        duration=duration,
+    puretone = ScheduledTone(
         frequency=int(frequency),
-        envelope=envelope,
+        duration=duration,
+        amplitude=amplitude,
     )
     return puretone
 
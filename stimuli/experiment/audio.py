@@ -0,0 +1,237 @@
+"""
+Session-wide audio engine and tone playback scheduled on the flips.
+
+One pyglet Player is started at startup (start_audio_engine) and plays an endless MixerSource until the
+end of the session: the pyglet audio thread pulls samples from it, and the mixer adds the scheduled
+buffers (tones rendered once with numpy, same waveform as the psychos Sine) at their position in the
+stream. No device is opened or warmed up per tone, and a tone scheduled with play_at(onset) is heard at
+onset (the predicted time of a flip, see frames.next_flip_time) as long as it is scheduled before the
+driver has pulled that part of the stream (AUDIO_PARAMS["buffer_length"] ahead, at least 32768 bytes
+in pyglet). Later schedules start as soon as possible and are counted as late.
+
+Stream positions are converted to perf_counter times with the player clock (the position being heard),
+plus AUDIO_PARAMS["hardware_latency"] (sound card and speakers). No driver reports that part, so it is a
+manual setting to calibrate on each rig, e.g. with a photodiode and a microphone recorded by the EEG.
+The hardware latency used and whether it was calibrated are stored with the tone onsets of every trial.
+"""
+import atexit
+import logging
+import threading
+from time import perf_counter
+
+import numpy as np
+import pyglet
+from pyglet.media import Player
+from pyglet.media.codecs.base import AudioData, AudioFormat, Source
+from pyglet.media.drivers.base import AbstractAudioPlayer
+
+from experiment.constants import AUDIO_PARAMS
+
+ENGINE = None # Global audio engine, started on first use
+
+
+def render_tone(frequency, duration, amplitude=1, sample_rate=AUDIO_PARAMS["sample_rate"]):
+    """16-bit samples of a pure tone with a flat envelope."""
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    samples = amplitude * np.sin(2 * np.pi * frequency * t)
+    return (np.clip(samples, -1, 1) * 0x7fff).astype(np.int16)
+
+
+def hardware_latency():
+    """Latency of the sound card and speakers (s), 0 if AUDIO_PARAMS["hardware_latency"] is not calibrated."""
+    return AUDIO_PARAMS["hardware_latency"] or 0.0
+
+
+def latency_calibrated():
+    return AUDIO_PARAMS["hardware_latency"] is not None
+
+
+def _pump():
+    """Let pyglet process the play request right away (as the psychos sounds do)."""
+    pyglet.clock.tick()
+    pyglet.app.platform_event_loop.dispatch_posted_events()
+
+
+class MixerSource(Source):
+    """
+    Endless source mixing the scheduled buffers. get_audio_data is called by the pyglet audio thread;
+    an underrun is counted when the samples written fall behind real time (the device played silence).
+    """
+    def __init__(self, sample_rate):
+        self.audio_format = AudioFormat(channels=1, sample_size=16, sample_rate=sample_rate)
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.scheduled = [] # [stream position, samples]
+        self.written = 0 # samples given to the driver
+        self.underruns = 0
+        self._origin = None # perf_counter time of stream position 0, if played without interruption
+
+    def is_precise(self):
+        return True
+
+    def schedule(self, samples, position):
+        """Mix samples from stream position on (or as soon as possible). Returns the position used."""
+        with self.lock:
+            position = max(position, self.written)
+            self.scheduled.append([position, samples])
+        return position
+
+    def get_audio_data(self, num_bytes, compensation_time=0.0):
+        now = perf_counter()
+        if self._origin is None:
+            self._origin = now
+        elif self.written < (now - self._origin) * self.sample_rate:
+            self.underruns += 1
+            self._origin = now - self.written / self.sample_rate
+
+        n = num_bytes // 2
+        start, end = self.written, self.written + n
+        mix = np.zeros(n, dtype=np.int32)
+        with self.lock:
+            remaining = []
+            for item in self.scheduled:
+                position, samples = item
+                if position < end:
+                    first = max(position, start)
+                    segment = samples[first - position:end - position]
+                    mix[first - start:first - start + segment.size] += segment
+                if position + samples.size > end:
+                    remaining.append(item)
+            self.scheduled = remaining
+            self.written = end
+        data = np.clip(mix, -0x8000, 0x7fff).astype(np.int16).tobytes()
+        return AudioData(data, len(data))
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.scheduled)
+
+
+class AudioEngine:
+    """One output stream kept running for the whole session."""
+    def __init__(self, sample_rate=AUDIO_PARAMS["sample_rate"]):
+        self.sample_rate = sample_rate
+        self.source = MixerSource(sample_rate)
+        self.late = 0 # schedules that could not start at their onset
+        AbstractAudioPlayer.audio_buffer_length = AUDIO_PARAMS["buffer_length"] # pyglet default 0.9 s
+        self.player = Player()
+        self.player.queue(self.source)
+        self.player.play()
+        _pump()
+
+    def stream_time(self):
+        """Position of the stream being heard (s), from the player clock."""
+        return self.player.time or 0.0
+
+    def schedule(self, samples, onset=None):
+        """
+        Play samples from onset (perf_counter time), or as soon as possible if onset is None.
+        Returns the estimated onset.
+        """
+        now = perf_counter()
+        heard = self.stream_time()
+        hardware = hardware_latency()
+        if onset is None:
+            position = self.source.schedule(samples, 0)
+        else:
+            target = int(round((heard + onset - now - hardware) * self.sample_rate))
+            position = self.source.schedule(samples, target)
+            self.late += position > target
+        return now + position / self.sample_rate - heard + hardware
+
+    def latency(self):
+        """Time between the samples being mixed and heard (s): the driver buffer plus hardware latency."""
+        return self.source.written / self.sample_rate - self.stream_time() + hardware_latency()
+
+    def stats(self):
+        return {
+            "queue_depth": self.source.queue_depth(),
+            "underruns": self.source.underruns,
+            "late_schedules": self.late,
+            "latency_ms": round(self.latency() * 1000, 2),
+        }
+
+    def close(self):
+        self.player.delete()
+
+
+def get_audio_engine():
+    """Get the audio engine, starting the output stream on first use."""
+    global ENGINE
+    if ENGINE is None:
+        ENGINE = AudioEngine()
+        atexit.register(ENGINE.close)
+    return ENGINE
+
+
+def start_audio_engine(settle_time=0.5):
+    """Start the output stream at startup and report its latency once the driver buffer is filled."""
+    engine = get_audio_engine()
+    start = perf_counter()
+    while perf_counter() - start < settle_time:
+        _pump()
+    stats = engine.stats()
+    hardware = f"{hardware_latency() * 1000:.1f} ms" if latency_calibrated() else "not calibrated"
+    print(f"Audio engine running: latency {stats['latency_ms']:.1f} ms (hardware {hardware}), {stats['underruns']} underruns")
+    logging.info(f"Audio engine running: {stats}, hardware latency {hardware}")
+    return engine
+
+
+def print_audio_stats(phase, block):
+    if ENGINE is None:
+        return
+    stats = ENGINE.stats()
+    print(f"Audio {phase} block {block}: latency {stats['latency_ms']:.1f} ms, {stats['underruns']} underruns, "
+          f"{stats['late_schedules']} late schedules, {stats['queue_depth']} buffers queued")
+
+
+class ScheduledTone:
+    """Pure tone played by the audio engine, possibly at a given time."""
+    def __init__(self, frequency, duration=0.5, amplitude=1, sample_rate=AUDIO_PARAMS["sample_rate"]):
+        self.samples = render_tone(frequency, duration, amplitude, sample_rate)
+        self.duration = duration
+        self.planned_onset = None # perf_counter times
+        self.estimated_onset = None
+
+    def play_at(self, onset):
+        """Schedule the tone to be heard at onset (perf_counter time). Returns the estimated onset."""
+        self.planned_onset = onset
+        self.estimated_onset = get_audio_engine().schedule(self.samples, onset)
+        return self.estimated_onset
+
+    def play(self):
+        """Play the tone as soon as possible."""
+        self.planned_onset = None
+        self.estimated_onset = get_audio_engine().schedule(self.samples)
+        return self.estimated_onset
+
+
+class ToneSequence(ScheduledTone):
+    """Tones at fixed intervals rendered into one buffer, played as a single stream from the first onset."""
+    def __init__(self, frequencies, amplitudes, tone_duration, interval, sample_rate=AUDIO_PARAMS["sample_rate"]):
+        n_tone = int(tone_duration * sample_rate)
+        offsets = [int(round(k * interval * sample_rate)) for k in range(len(frequencies))] # from the first onset
+        self.samples = np.zeros(offsets[-1] + n_tone, dtype=np.int16)
+        for offset, frequency, amplitude in zip(offsets, frequencies, amplitudes):
+            if amplitude:
+                self.samples[offset:offset + n_tone] = render_tone(frequency, tone_duration, amplitude, sample_rate)
+        self.duration = self.samples.size / sample_rate
+        self.planned_onset = None
+        self.estimated_onset = None
+
+
+def tone_onsets(label, tone, clock, flip):
+    """
+    Planned and estimated onsets of a tone relative to the clock (a psychos Clock), and the
+    estimated audio-visual offset to the flip (time relative to the same clock), for the trial records.
+    The estimates include the hardware latency only if it was calibrated (audio_latency_calibrated).
+    """
+    if tone.planned_onset is None:
+        return {}
+    return {
+        f"{label}_tone_planned": tone.planned_onset - clock.start_time,
+        f"{label}_tone_estimated": tone.estimated_onset - clock.start_time,
+        f"{label}_av_offset_ms": round((tone.estimated_onset - clock.start_time - flip) * 1000, 3),
+        "audio_hardware_latency_ms": round(hardware_latency() * 1000, 3),
+        "audio_latency_calibrated": latency_calibrated(),
+    }
@@ -0,0 +1,149 @@
+"""
+Benchmark of the per-trial overhead of the phase loops.
+
+Runs one block of each phase against the stub window of the simulation mode (virtual time, so only
+the CPU work of the experiment code is measured) and times every call of the stages below.
+The results can be saved as a baseline and compared with it later, to see whether a change (e.g. in
+presentation.py or triggers.py) made a stage slower or faster.
+
+Usage (from the stimuli folder):
+    python -m experiment.benchmark --save-baseline   # store the current timings
+    python -m experiment.benchmark                   # compare with the stored baseline
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime
+
+import numpy as np
+import pyglet
+
+pyglet.options["headless"] = True # no display needed, set before psychos imports pyglet.gl
+
+import experiment.phases as phases
+import experiment.responses as responses
+import experiment.timeline as timeline
+from experiment.frames import monitor_frames
+from experiment.io_worker import drain
+from experiment.records import BlockRecorder
+from experiment.simulation import Simulation
+from experiment.triggers import get_tracker
+
+BASELINE_FILE = "benchmark_baseline.json"
+REGRESSION_THRESHOLD = 0.10 # relative change of the median flagged as a regression or improvement
+MIN_SAMPLES = 20 # stages with fewer calls (e.g. one save per block) are compared but never flagged
+
+# Stage name -> (module, function name) of the functions timed in the phase loops
+STAGES = {
+    "draw_gabor": [(phases, "draw_gabor")],
+    "draw_fixation": [(phases, "draw_fixation")],
+    "create_puretone": [(phases, "create_puretone")],
+    "send_trigger": [(timeline, "send_trigger"), (responses, "send_trigger")],
+    "response": [(phases, "localizer_response"), (phases, "learning_response"), (phases, "test_response"), (phases, "explicit_response")],
+    "staircase": [(phases, "staircase"), (phases, "quest")],
+    "save_block_data": [(phases, "save_block_data")],
+}
+
+BLOCKS = [("localizer", 1), ("learning", 1), ("test", 1), ("explicit", 1)]
+
+
+def _timed(function, samples):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_benchmark(blocks=BLOCKS, seed=0):
+    """Run the blocks in the simulation and return the durations (seconds) of every call per stage."""
+    samples = {stage: [] for stage in [*STAGES, "record_append", "drain"]}
+    with Simulation(seed=seed, participant_prefix="bench") as simulation:
+        window, participant_data, _, _, full_screen, screen_info, edf_filename = simulation.setup(batch="bench")
+        get_tracker(simulation.tracker(window, edf_filename)) # inject the mock tracker in the triggers module, as main does
+        monitor_frames(window, screen_info) # the phase loops time their screens in frames, as in main
+
+        # Wrap the stage functions (after the simulation stand-ins are installed)
+        saved = []
+        for stage, targets in STAGES.items():
+            for module, name in targets:
+                saved.append((module, name, getattr(module, name)))
+                setattr(module, name, _timed(getattr(module, name), samples[stage]))
+        append = BlockRecorder.append
+        BlockRecorder.append = _timed(append, samples["record_append"])
+        try:
+            for phase, block in blocks:
+                phases.run_phase(phase, block, window, participant_data, full_screen, screen_info)
+                _timed(drain, samples["drain"])() # time until the block files are on disk
+        finally:
+            BlockRecorder.append = append
+            for module, name, original in reversed(saved):
+                setattr(module, name, original)
+    return samples
+
+
+def summarize(samples):
+    """Distribution of the durations of each stage, in ms."""
+    summary = {}
+    for stage, durations in samples.items():
+        if not durations:
+            continue
+        ms = np.array(durations) * 1000
+        summary[stage] = {
+            "n": int(ms.size),
+            "mean": round(float(ms.mean()), 4),
+            "median": round(float(np.median(ms)), 4),
+            "p95": round(float(np.percentile(ms, 95)), 4),
+            "max": round(float(ms.max()), 4),
+            "total": round(float(ms.sum()), 2),
+        }
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'stage':>16} {'n':>6} | {'mean':>8} {'median':>8} {'p95':>8} {'max':>8} | {'total':>9} (ms)" + (" | median vs baseline" if baseline else ""))
+    for stage, stats in summary.items():
+        line = (f"{stage:>16} {stats['n']:>6} | {stats['mean']:>8.3f} {stats['median']:>8.3f} {stats['p95']:>8.3f} "
+                f"{stats['max']:>8.3f} | {stats['total']:>9.1f}")
+        if baseline and stage in baseline["stages"]:
+            reference = baseline["stages"][stage]["median"]
+            change = (stats["median"] - reference) / reference if reference > 0 else 0.0
+            flag = ""
+            if stats["n"] >= MIN_SAMPLES:
+                flag = "REGRESSION" if change > REGRESSION_THRESHOLD else "improved" if change < -REGRESSION_THRESHOLD else ""
+            line += f" | {change:+7.1%} {flag}"
+        print(line)
+
+
+def machine_info():
+    return {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-trial overhead of the phase loops.")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file to compare with (or to save).")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = summarize(run_benchmark(seed=args.seed))
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print(f"Comparing with the baseline of {baseline['date']} ({baseline['machine']['platform']})")
+        if baseline["machine"] != machine_info():
+            print("Warning: the baseline was recorded on a different machine, timings are not comparable.")
+    elif not args.save_baseline:
+        print(f"No baseline found at {args.baseline}, run with --save-baseline to create one.")
+    print_summary(summary, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "machine": machine_info(), "stages": summary}, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
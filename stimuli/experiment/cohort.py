@@ -0,0 +1,150 @@
+"""
+Cohort planner: precompute the counterbalancing cells and the schedules of a whole cohort.
+
+Cells are assigned with a balanced design instead of independent random draws. Every factor of
+COUNTERBALANCING_FACTORS is binary, and the cohort cycles through the full 2^k factorial: every cell
+is assigned once per 2^k participants, so no factor is aliased with an interaction of others.
+The cells of a cycle are served in groups of 2^m rows (the smallest power of two with 2^m > k), each
+group a coset of a two-level orthogonal array (each factor is the parity of a different subset of the
+bits of the row number), so within every complete group each factor level, and each combination of
+levels of any two factors, occurs equally often. The groups and the rows within each group are
+shuffled and the level coding of each factor is randomly flipped, all from the cohort seed.
+
+The schedules are generated in parallel and written to COHORT_PLAN_FOLDER: an index.json with the
+cell and seed of every participant, and one <participant_id>.json file with the conditions.
+setup.setup uses the plan when a new participant is created.
+
+Usage (from the stimuli folder):
+    python -m experiment.cohort --participants 40
+"""
+import argparse
+import datetime
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from experiment.constants import COHORT_PLAN_FOLDER, COUNTERBALANCING_FACTORS
+from experiment.schedule import build_participant_conditions, new_seed
+
+
+def balanced_cells(n_participants, rng, factors=COUNTERBALANCING_FACTORS):
+    """
+    Counterbalancing cells for n_participants, balanced as described in the module docstring.
+    Every complete cycle of 2^k participants gets each of the 2^k cells once.
+    """
+    n_factors = len(factors)
+    n_bits = 1
+    while 2 ** n_bits <= n_factors:
+        n_bits += 1
+    group_size = 2 ** n_bits
+
+    # orthogonal array: the levels of the factors are the bits of a cell number
+    masks = range(1, n_factors + 1) # distinct non-zero bit masks, one per factor
+    array = [sum((bin(row & mask).count("1") % 2) << j for j, mask in enumerate(masks)) for row in range(group_size)]
+    # its cosets partition the 2^k cells into groups of group_size rows
+    groups = {}
+    for cell in range(2 ** n_factors):
+        groups.setdefault(min(cell ^ row for row in array), []).append(cell)
+    groups = list(groups.values())
+    flips = rng.integers(0, 2, n_factors)
+
+    rows = []
+    while len(rows) < n_participants: # one cycle through the full factorial
+        for group in rng.permutation(len(groups)).tolist():
+            rows += [groups[group][i] for i in rng.permutation(group_size).tolist()]
+    return [
+        {factor: ((row >> j) & 1) ^ int(flip) for j, (factor, flip) in enumerate(zip(factors, flips))}
+        for row in rows[:n_participants]
+    ]
+
+
+def participant_ids(n_participants, first=1):
+    return [f"sub-{i:02d}" for i in range(first, first + n_participants)]
+
+
+def _plan_participant(participant_id, seed, cell):
+    """Worker task: generate the conditions of one participant."""
+    return participant_id, build_participant_conditions(seed, cell)
+
+
+def plan_cohort(n_participants, cohort_seed=None, first=1, folder=COHORT_PLAN_FOLDER, max_workers=None):
+    """
+    Precompute the cells and schedules of n_participants (sub-<first>...) in a process pool
+    and write the indexed plan file. Returns the index.
+    """
+    if cohort_seed is None:
+        cohort_seed = new_seed()
+    seed_sequence = np.random.SeedSequence(cohort_seed)
+    rng = np.random.default_rng(seed_sequence)
+    seeds = [int(seed) for seed in seed_sequence.generate_state(n_participants, np.uint64)] # one seed per participant
+    cells = balanced_cells(n_participants, rng)
+    ids = participant_ids(n_participants, first)
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    index = {
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "cohort_seed": cohort_seed,
+        "factors": list(COUNTERBALANCING_FACTORS),
+        "participants": {},
+    }
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_plan_participant, pid, seed, cell) for pid, seed, cell in zip(ids, seeds, cells)]
+        for future, seed, cell in zip(futures, seeds, cells):
+            participant_id, conditions = future.result()
+            with open(folder / f"{participant_id}.json", "w") as f:
+                json.dump(conditions, f)
+            unsatisfied = [key for key, value in conditions.items() if key.startswith("sequence_stats_") and not value["satisfied"]]
+            if unsatisfied:
+                print(f"Warning: sequence constraints not met for {participant_id}: {unsatisfied}")
+            index["participants"][participant_id] = {"seed": seed, "cell": cell, "file": f"{participant_id}.json"}
+
+    with open(folder / "index.json", "w") as f:
+        json.dump(index, f, indent=4)
+    return index
+
+
+def load_planned_conditions(participant_id, folder=COHORT_PLAN_FOLDER):
+    """
+    Return the seed and precomputed conditions of a participant from the cohort plan,
+    or None if there is no plan or the participant is not in it.
+    """
+    index_path = os.path.join(folder, "index.json")
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as f:
+        entry = json.load(f)["participants"].get(participant_id)
+    if entry is None:
+        return None
+    with open(os.path.join(folder, entry["file"]), "r") as f:
+        conditions = json.load(f)
+    return entry["seed"], conditions
+
+
+def balance_report(index):
+    """Print how often each level of each factor, and each mapping cell, is assigned."""
+    cells = [entry["cell"] for entry in index["participants"].values()]
+    print(f"{len(cells)} participants")
+    for factor in index["factors"]:
+        counts = Counter(cell[factor] for cell in cells)
+        print(f"  {factor}: 0 -> {counts[0]}, 1 -> {counts[1]}")
+    mappings = Counter((cell["auditory_mapping"], cell["visual_mapping"]) for cell in cells)
+    print(f"  (auditory_mapping, visual_mapping): {dict(sorted(mappings.items()))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute counterbalanced schedules for a cohort.")
+    parser.add_argument("--participants", type=int, required=True, help="Number of participants to plan.")
+    parser.add_argument("--first", type=int, default=1, help="Number of the first participant (sub-XX).")
+    parser.add_argument("--seed", type=int, default=None, help="Cohort seed (random if omitted).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    index = plan_cohort(args.participants, args.seed, args.first, max_workers=args.workers)
+    print(f"Cohort plan written to {COHORT_PLAN_FOLDER} (cohort seed {index['cohort_seed']})")
+    balance_report(index)
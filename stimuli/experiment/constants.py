@@ -5,17 +5,21 @@ SCREENS = {
                 "distance_cm": 50,
                 "screen_width_cm":34.5,
                 "screen_width_px":1920 *0.8,
-                "screen_height_px":1080 *0.8,},
+                "screen_height_px":1080 *0.8,
+                "refresh_rate": 60, # nominal Hz, used if the refresh period cannot be measured (experiment/frames.py)
+                },
     "VU_experiment": {"screen_name": "VU Experiment",
                 "distance_cm": 70,
                 "screen_width_cm":52.6,
                 "screen_width_px":1920,
-                "screen_height_px":1080,},
+                "screen_height_px":1080,
+                "refresh_rate": 60,},
 
 }
 
 # constants for data storage
 DATA_FOLDER = "data"
+COHORT_PLAN_FOLDER = f"{DATA_FOLDER}/cohort_plan" # precomputed schedules, see experiment/cohort.py
 
 # Constants for the experiment setup
 PHASES = {
@@ -27,6 +31,28 @@ PHASES = {
     "explicit_blocks": 2,
 }
 
+# Binary counterbalancing factors, assigned across the cohort by the cohort planner (experiment/cohort.py)
+COUNTERBALANCING_FACTORS = [
+    "auditory_mapping", # which tone predicts which
+    "visual_mapping", # which orientation predicts which
+    "learning_key_order", # key mapping of the first learning block
+    "test_key_order", # key mapping of the first test block
+    "localizer_target_order", # order of PHASES["localizer_targets"]
+    "explicit_order", # visual or auditory explicit block first
+    "explicit_key_order", # key mapping of the first explicit block
+]
+
+TRACING = False # Record tracing spans of every block (also enabled with main.py --trace), see experiment/tracing.py
+GC_CONTROL = False # Disable the automatic garbage collection during the blocks and collect in the ITI of every trial (also enabled with main.py --gc-control), see experiment/gc_control.py
+REALTIME = False # Real-time process mode on Linux (also enabled with main.py --realtime), see experiment/realtime.py
+
+REALTIME_PARAMS = { # Requested for the presentation thread, what is granted is logged at startup
+    "policy": "fifo", # "fifo" or "rr"
+    "priority": 50, # real-time priority (1-99)
+    "nice": -10, # fallback if real-time scheduling is not permitted
+    "lock_memory": True, # mlockall
+}
+
 # This controls batch execution. Each batch will run a different set of blocks in the order specified here.
 BATCH_SEQUENCES = {
     "1": [("localizer", 1), ("learning", 1), ("learning", 2)],
@@ -51,6 +77,19 @@ STIM_INFO = {
     "target_duration": 0.5,
 }
 
+AUDIO_PARAMS = { # Output stream of the audio engine, tones are scheduled on the flips (experiment/audio.py)
+    "sample_rate": 44800, # same as the psychos Sine default
+    "buffer_length": 0.3, # s of audio buffered ahead by the driver, tones must be scheduled earlier than that
+    # Latency of the sound card and speakers (s), not seen by the player clock and not reported by the drivers.
+    # Manual setting, to calibrate on each rig: delay between the photodiode and the microphone recorded by the EEG
+    # for a tone scheduled on a flip. None means not calibrated: 0 is used, and the trial records say so.
+    "hardware_latency": None,
+}
+
+PRELOAD_PARAMS = { # Stimuli of a block preloaded while its instructions are shown (experiment/preload.py)
+    "memory_budget_mb": 256, # textures and tone buffers kept for the block, the rest is prepared trial by trial
+}
+
 INITIAL_STAIRCASE = { # Intiial values for the staircase, same for all partiicpants bu updated during the experiment
     "last_outcome": None, # Just needed to initialize the staircase
     "ori_diff": 15, # initial value of orientation difference. In the first 
@@ -66,6 +105,17 @@ STAIRCASE_PARAMS = { # Parameters to control how the staircase adapts to perform
     "max_diff": 20, # Maximum orientation difference allowed for diagonal targets. Greater than 22.5 would be closer to cardinal orientations
 }
 
+ADAPTIVE_PROCEDURE = "staircase" # "staircase" (3-down-1-up, STAIRCASE_PARAMS) or "quest" (Bayesian, QUEST_PARAMS) in the test phase
+
+QUEST_PARAMS = { # Grids and psychometric function of the quest procedure (see experiment/quest.py)
+    "ori_diff_step": 0.5, # Allowed ori_diff values go from ori_diff_step to STAIRCASE_PARAMS["max_diff"] in steps of ori_diff_step
+    "threshold_range": (0.5, 30.5, 0.5), # Grid of Weibull scale parameters (start, stop, step), in degrees
+    "slopes": [1, 1.5, 2, 3, 4, 6], # Grid of Weibull slopes
+    "guess": 0.1, # Probability of reporting a deviant when there is no visible orientation difference
+    "lapse": 0.02, # Probability of a wrong response at large orientation differences
+    "target_p": 0.5 ** (1 / 3), # The reported threshold is the ori_diff at this proportion correct (same as the 3-down-1-up staircase)
+}
+
 FIXATION_PARAMS = {
     "color": "white",
     "radius": 0.1, # in degrees
@@ -94,6 +144,20 @@ CONDITIONS_MAIN = { # Define conditions in the test and learning phases
     "a_pred_cond": ["EXP", "UEX"],
 }
 
+SEQUENCE_CONSTRAINTS = { # Constraints on the trial order of the learning and test blocks
+    "max_run": {"v_leading": 3, "a_leading": 3, "v_pred": 4, "a_pred": 4}, # Maximum number of consecutive trials with the same level
+    "min_uex_distance": {"v_pred": 2, "a_pred": 2}, # Minimum distance between two UEX trials of the same modality (2 = never adjacent)
+    "balanced_transitions": ["v_leading", "a_leading"], # First-order transitions between levels should match their expected counts
+    "transition_tolerance": 1, # Allowed deviation of each transition count from its expected count
+    "max_iterations": 20000, # Maximum number of repair steps before giving up and keeping the best order found
+}
+
+KEY_MAPPINGS = { # Two possible response key mappings per phase, counterbalanced across blocks
+    "learning": [{"Z": "frequent", "M": "infrequent", "SPACE": "neutral"}, {"Z": "infrequent", "M": "frequent", "SPACE": "neutral"}],
+    "test": [{"Z": "deviant", "M": "normal"}, {"Z": "normal", "M": "deviant"}],
+    "explicit": [{"Z": "frequent", "M": "infrequent"}, {"Z": "infrequent", "M": "frequent"}],
+}
+
 TRIGGER_MAPPING = generate_triggers(CONDITIONS_MAIN) # Generate dictionary that assigns trigger numbers to each trial type and event
 
 # Instructions for the different blocks and phases
@@ -0,0 +1,107 @@
+"""
+Deadline watchdog of the trial screens, with compensation in the next ITI.
+
+In run_trial, every screen after the first is prepared (its draw calls) while the current one is on,
+and must be flipped at a planned time (frames.next_flip_time). The watchdog checks every flip against
+that deadline. A flip later than half a frame is a miss, and its cause is recorded:
+- "prep": the preparation overran the wait (negative prep slack), with the slowest draw call;
+- "flip": the preparation was in time but the flip missed its vertical blank.
+Misses are logged as they happen, and a report is printed at the end of every block.
+
+The time lost delays the rest of the block, so it is recovered in the next ITIs: compensated_iti
+shortens the jittered ITI drawn by the phase loop, never below STIM_INFO["iti_range"][0], and what
+cannot be recovered in one ITI is carried over to the next ones.
+"""
+import logging
+
+from experiment.constants import STIM_INFO
+from experiment.frames import frame_period, last_flip_time
+
+WATCHDOG = None # Global deadline watchdog, started with the first block
+
+
+class DeadlineWatchdog:
+    """Misses of the current block and the time still to recover."""
+    def __init__(self):
+        self.start_block()
+
+    def start_block(self):
+        self.segments = 0
+        self.misses = [] # (context, label, cause, late in s)
+        self.debt = 0.0 # time lost and not recovered yet (s)
+        self.recovered = 0.0
+        self.trial = {"deadline_misses": 0, "iti_compensation_ms": 0.0}
+
+    def check(self, context, label, planned, slack, prep):
+        """Check the flip of the screen label against its planned time. prep: [(draw function, duration)]."""
+        flip, period = last_flip_time(), frame_period()
+        if flip is None or period is None:
+            return
+        self.segments += 1
+        late = flip - planned
+        if late <= period / 2:
+            return
+        if slack is not None and slack < 0:
+            function, duration = max(prep, key=lambda item: item[1], default=(None, 0.0))
+            cause = f"prep ({getattr(function, '__name__', function)} {duration * 1000:.1f} ms)"
+        else:
+            cause = "flip"
+        self.misses.append((context, label, cause, late))
+        self.debt += late
+        self.trial["deadline_misses"] += 1
+        logging.warning(f"Deadline missed: {label} screen {late * 1000:.1f} ms late in {context}, cause {cause}")
+
+    def compensate(self, iti_duration, min_iti):
+        reduction = min(self.debt, max(0.0, iti_duration - min_iti))
+        self.debt -= reduction
+        self.recovered += reduction
+        self.trial["iti_compensation_ms"] = round(reduction * 1000, 3)
+        return iti_duration - reduction
+
+    def trial_stats(self):
+        stats = self.trial
+        self.trial = {"deadline_misses": 0, "iti_compensation_ms": 0.0}
+        return stats
+
+
+def get_watchdog():
+    global WATCHDOG
+    if WATCHDOG is None:
+        WATCHDOG = DeadlineWatchdog()
+    return WATCHDOG
+
+
+def start_block_deadlines():
+    get_watchdog().start_block()
+
+
+def check_deadline(context, label, planned, slack, prep):
+    """Check the flip just made for the screen label against its planned time (see run_trial)."""
+    get_watchdog().check(context, label, planned, slack, prep)
+
+
+def compensated_iti(iti_duration, iti_range=STIM_INFO["iti_range"]):
+    """ITI shortened by the time lost on missed deadlines, within iti_range."""
+    return get_watchdog().compensate(iti_duration, iti_range[0])
+
+
+def trial_deadline_stats():
+    """Deadline misses and ITI compensation of the current trial, to be added to its record."""
+    return WATCHDOG.trial_stats() if WATCHDOG is not None else {}
+
+
+def print_deadline_report(phase, block):
+    if WATCHDOG is None:
+        return
+    watchdog = WATCHDOG
+    message = f"Deadlines {phase} block {block}: {len(watchdog.misses)} missed of {watchdog.segments}"
+    if watchdog.misses:
+        causes = {}
+        for _, label, cause, _ in watchdog.misses:
+            key = f"{label} {cause.split()[0]}"
+            causes[key] = causes.get(key, 0) + 1
+        lost = sum(late for *_, late in watchdog.misses)
+        message += (f" ({', '.join(f'{key}: {n}' for key, n in causes.items())}), {lost * 1000:.1f} ms lost, "
+                    f"{watchdog.recovered * 1000:.1f} ms recovered in the ITIs")
+    print(message)
+    logging.info(message)
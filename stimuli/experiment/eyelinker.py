@@ -6,6 +6,7 @@ import pylink as pl
 from experiment.constants import COLOR, INSTRUCTIONS_FONT_SIZE
 from psychos.visual import Circle, Text
 from experiment.PsychosCustomDisplay import PsychosCustomDisplay
+from experiment.tracing import traced
 from math import sin, cos, pi, atan, sqrt, radians, hypot
 
 RIGHT_EYE = 1
@@ -48,8 +49,9 @@ def _get_connection_failure_response(window):
     return key
 
         
-def EyeLinker(window, filename, eye):
-    connected, e = _try_connection()
+def EyeLinker(window, filename, eye, connection=None):
+    """connection: result of a first _try_connection made in the background (see startup.py), if any."""
+    connected, e = connection if connection is not None else _try_connection()
 
     if connected:
         return ConnectedEyeLinker(window, filename, eye, text_color=COLOR)
@@ -220,6 +222,7 @@ class ConnectedEyeLinker:
         self.tracker.closeDataFile()
         self.edf_open = False
 
+    @traced("eyelink.transfer_edf")
     def transfer_edf(self, new_filename=None):
         """Transfers the edf file to the computer running psychopy.
         Parameters:
@@ -269,6 +272,7 @@ class ConnectedEyeLinker:
         self.window.wait_key(['space'])
         self.window.flip()
 
+    @traced("eyelink.calibrate")
     def calibrate(self, text=None):
         """Like setup_tracker, but gives the experimenter the option to skip.
         Parameters:
@@ -290,6 +294,7 @@ class ConnectedEyeLinker:
         self.tracker.doTrackerSetup()
         
 
+    @traced("eyelink.drift_correct")
     def drift_correct(self, position=None, setup=1):
         """Enters into drift correct mode.
         Parameters:
@@ -314,6 +319,7 @@ class ConnectedEyeLinker:
             self.stop_recording()
         return wrapped_func
 
+    @traced("eyelink.start_recording")
     def start_recording(self):
         """Start the eyetracking recording.
         Requires a short delay after calling, so do not call this function during a timing
@@ -322,6 +328,7 @@ class ConnectedEyeLinker:
         self.tracker.startRecording(1, 1, 1, 1)
         time.sleep(.1)  # required
 
+    @traced("eyelink.stop_recording")
     def stop_recording(self):
         """Stops the eyetracking recording.
         Requires a short delay before calling, so do not call this function during a timing
@@ -365,10 +372,12 @@ class ConnectedEyeLinker:
         else:
             return (sample.getLeftEye().getPupilSize(), sample.getRightEye().getPupilSize())
 
+    @traced("eyelink.set_offline_mode")
     def set_offline_mode(self):
         """Sets tracker to offline mode."""
         self.tracker.setOfflineMode()
 
+    @traced("eyelink.send_command")
     def send_command(self, cmd):
         """Sends a command to the tracker.
         Mostly used internally, but available if needed. See pylink docs for available commands.
@@ -377,6 +386,7 @@ class ConnectedEyeLinker:
         """
         self.tracker.sendCommand(cmd)
 
+    @traced("eyelink.send_message")
     def send_message(self, msg):
         """Sends a message to be saved to the EDF file.
         Not to be confused with send_status. Useful for marking specific times, e.g. trial start
@@ -385,6 +395,7 @@ class ConnectedEyeLinker:
         """
         self.tracker.sendMessage(msg)
 
+    @traced("eyelink.send_status")
     def send_status(self, status):
         """Sends a status to be displayed to the experimenter.
         The status is displayed on the eyelink computer during the experiment. Useful for tracking
@@ -580,6 +591,7 @@ def check_fix(start_loc, fix_loc, acceptableDev, Dis_for_sacc, scnSize, startime
 #         return [False, False, None, None, None, None]
 
 
+@traced("eyelink.offline_mode_start")
 def offline_mode_start():
      ## force off-line mode first to prevent eyelink freeze
     pl.getEYELINK().setOfflineMode()
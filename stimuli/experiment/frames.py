@@ -0,0 +1,280 @@
+"""
+Flip timestamps, dropped-frame detection and frame-count scheduling of the stimulus screens.
+
+monitor_frames wraps window.flip so that every flip is timestamped when it returns (perf_counter,
+the time base of the psychos clocks). Two kinds of problems are detected:
+- late flips: a flip that blocks for more than LATE_FLIP_FACTOR refresh periods missed a vertical blank;
+- long screens: a labeled screen (see label_flip) stayed on for more frames than planned,
+  measured from its flip to the next one. The frames they lasted longer than planned are the dropped frames
+  of the trial (a late flip is counted there, once), except the frames added on purpose with delay_screen.
+
+Screen durations are counted in frames: wait_screen converts a duration of STIM_INFO into a number of
+refresh periods and waits until half a frame before the flip that ends the screen, so the next flip
+lands on the planned frame whatever the time spent preparing the next stimulus (which is done while
+the screen is shown). The time left between the end of the preparation and that deadline is the prep
+slack; a negative slack means the preparation made the screen one frame longer.
+The phase loops add the flip times, planned and shown frames and prep slack of every trial to the
+block records, and a summary is printed at the end of every block.
+"""
+from math import ceil
+from time import perf_counter
+
+import numpy as np
+
+from experiment.constants import STIM_INFO
+from experiment.realtime import record_wakeup
+
+FRAMES = None # Global frame monitor
+
+LATE_FLIP_FACTOR = 1.2
+MAX_FLIPS = 50000 # flips recorded per block
+
+# Intended duration of the labeled screens, when not planned with wait_screen
+SCREEN_DURATIONS = {
+    "leading": STIM_INFO["leading_duration"],
+    "isi": STIM_INFO["isi_duration"],
+    "trailing": STIM_INFO["target_duration"],
+}
+
+
+class FrameMonitor:
+    """Records the start and return time of every flip of a window."""
+    def __init__(self, window, refresh_period, max_flips=MAX_FLIPS):
+        self.period = refresh_period
+        self.flip_start = np.zeros(max_flips)
+        self.flip_end = np.zeros(max_flips)
+        self.labels = {} # flip index -> label
+        self.planned = {} # flip index -> planned frames of the screen
+        self.slack = {} # flip index -> prep slack (s) before the flip that ends the screen
+        self.extra = {} # flip index -> frames added on purpose to the screen (see delay_screen)
+        self.n = 0
+        self.trial_start = 0
+        self.last_flip = None
+        self._flip = window.flip
+        window.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        start = perf_counter()
+        result = self._flip(*args, **kwargs)
+        end = perf_counter()
+        if self.n < len(self.flip_end):
+            self.flip_start[self.n] = start
+            self.flip_end[self.n] = end
+            self.n += 1
+        self.last_flip = end
+        return result
+
+    def start_block(self):
+        self.n = 0
+        self.trial_start = 0
+        self.labels = {}
+        self.planned = {}
+        self.slack = {}
+        self.extra = {}
+
+    def start_trial(self):
+        self.trial_start = self.n
+
+    def label_last_flip(self, label):
+        if self.n:
+            self.labels[self.n - 1] = label
+
+    def frames(self, duration):
+        return int(round(duration / self.period))
+
+    def planned_frames(self, index):
+        if index in self.planned:
+            return self.planned[index]
+        label = self.labels.get(index)
+        return self.frames(SCREEN_DURATIONS[label]) if label in SCREEN_DURATIONS else None
+
+    def wait_screen(self, window, duration):
+        """
+        Wait until half a frame before the end of the current screen (shown at the last flip) after
+        duration rounded to frames. Returns the prep slack in seconds.
+        """
+        index = self.n - 1
+        n_frames = max(1, self.frames(duration))
+        deadline = self.last_flip + (n_frames - 0.5) * self.period
+        slack = deadline - perf_counter()
+        self.planned[index] = n_frames
+        self.slack[index] = slack
+        if slack > 0:
+            window.wait(slack)
+            record_wakeup(perf_counter() - deadline)
+        return slack
+
+    def delay(self, planned):
+        """Move the planned flip ending the current screen to the first frame after now. Returns the new time."""
+        late = perf_counter() - planned
+        if late <= 0:
+            return planned
+        n_frames = ceil(late / self.period)
+        self.extra[self.n - 1] = self.extra.get(self.n - 1, 0) + n_frames
+        return planned + n_frames * self.period
+
+    def dropped(self, index):
+        """Frames the screen shown at flip index lasted longer than planned (and not delayed on purpose)."""
+        planned = self.planned_frames(index)
+        if planned is None or index + 1 >= self.n:
+            return 0
+        shown = self.frames(self.flip_end[index + 1] - self.flip_end[index])
+        return max(0, shown - planned - self.extra.get(index, 0))
+
+    def late(self, start, end):
+        return (end - start) > LATE_FLIP_FACTOR * self.period
+
+    def trial_stats(self):
+        """Frame statistics of the flips since start_trial."""
+        start, end = self.flip_start[self.trial_start:self.n], self.flip_end[self.trial_start:self.n]
+        stats = {
+            "n_flips": int(end.size),
+            "late_flips": int(self.late(start, end).sum()),
+            "max_flip_ms": round(float((end - start).max()) * 1000, 3) if end.size else None,
+        }
+        # a late flip makes the screen before it last longer, so the drops are counted from the frame counts only
+        dropped = 0
+        for index in range(self.trial_start, self.n - 1):
+            label = self.labels.get(index)
+            planned = self.planned_frames(index)
+            if label is None or planned is None:
+                continue
+            shown = self.frames(self.flip_end[index + 1] - self.flip_end[index])
+            # the last screen with this label in the trial, and the smallest prep slack
+            stats[f"{label}_frames"] = shown
+            stats[f"{label}_frames_planned"] = planned
+            if index in self.slack:
+                slack_ms = round(self.slack[index] * 1000, 3)
+                stats[f"{label}_slack_ms"] = min(slack_ms, stats.get(f"{label}_slack_ms", slack_ms))
+            dropped += self.dropped(index)
+        stats["dropped_frames"] = dropped
+        return stats
+
+    def block_summary(self):
+        start, end = self.flip_start[:self.n], self.flip_end[:self.n]
+        durations = (end - start) * 1000
+        long_screens = 0
+        for index in self.labels:
+            long_screens += self.dropped(index) > 0
+        slack = np.array(list(self.slack.values())) * 1000
+        return {
+            "n_flips": int(self.n),
+            "late_flips": int(self.late(start, end).sum()),
+            "long_screens": int(long_screens),
+            "median_flip_ms": float(np.median(durations)) if self.n else None,
+            "max_flip_ms": float(durations.max()) if self.n else None,
+            "min_slack_ms": float(slack.min()) if slack.size else None,
+            "median_slack_ms": float(np.median(slack)) if slack.size else None,
+        }
+
+
+def measure_refresh_period(window, n_frames=60, nominal_rate=60):
+    """
+    Estimate the refresh period from the median interval of n_frames consecutive flips.
+    Falls back to the nominal rate if the flips are not synchronized to the screen (no vsync).
+    """
+    times = []
+    for _ in range(n_frames):
+        window.flip()
+        times.append(perf_counter())
+    period = float(np.median(np.diff(times)))
+    if period < 0.002 or period > 0.05:
+        print(f"Flips are not synchronized to the screen (median interval {period * 1000:.2f} ms), assuming {nominal_rate} Hz")
+        period = 1 / nominal_rate
+    return period
+
+
+def monitor_frames(window, screen_info, measure=True):
+    """Start timestamping the flips of the window. Returns the frame monitor."""
+    global FRAMES
+    nominal_rate = screen_info.get("refresh_rate", 60)
+    period = measure_refresh_period(window, nominal_rate=nominal_rate) if measure else 1 / nominal_rate
+    print(f"Refresh period: {period * 1000:.3f} ms ({1 / period:.2f} Hz)")
+    FRAMES = FrameMonitor(window, period)
+    return FRAMES
+
+
+def label_flip(label, clock):
+    """
+    Label the last flip (leading, isi, trailing... see SCREEN_DURATIONS) and return its time
+    relative to the clock (a psychos Clock). Without frame monitor, the current clock time is returned.
+    """
+    if FRAMES is None or FRAMES.last_flip is None:
+        return clock.time()
+    FRAMES.label_last_flip(label)
+    return FRAMES.last_flip - clock.start_time
+
+
+def frame_period():
+    """Refresh period (s), or None without frame monitor."""
+    return FRAMES.period if FRAMES is not None else None
+
+
+def last_flip_time():
+    """Time (perf_counter) of the last flip, or None without frame monitor."""
+    if FRAMES is None:
+        return None
+    return FRAMES.last_flip
+
+
+def wait_screen(window, duration):
+    """
+    Keep the current screen on for duration (rounded to frames): call it after preparing the next
+    stimulus, right before the flip. Without frame monitor, waits for duration.
+    """
+    if FRAMES is None or FRAMES.last_flip is None:
+        window.wait(duration)
+        return None
+    return FRAMES.wait_screen(window, duration)
+
+
+def screen_time(duration):
+    """Duration rounded to whole frames, as shown by wait_screen."""
+    if FRAMES is None:
+        return duration
+    return max(1, FRAMES.frames(duration)) * FRAMES.period
+
+
+def next_flip_time(duration):
+    """Predicted time (perf_counter) of the flip that ends the current screen, see wait_screen."""
+    if FRAMES is None or FRAMES.last_flip is None:
+        return perf_counter() + duration
+    return FRAMES.last_flip + max(1, FRAMES.frames(duration)) * FRAMES.period
+
+
+def delay_screen(planned):
+    """
+    Planned time of a flip delayed on purpose (a trigger sent before it, see timeline.Screen.trigger_before_flip):
+    the first frame after now. The extra frames of the current screen are not counted as dropped.
+    """
+    if FRAMES is None:
+        return planned
+    return FRAMES.delay(planned)
+
+
+def start_trial_frames():
+    if FRAMES is not None:
+        FRAMES.start_trial()
+
+
+def trial_frame_stats():
+    """Frame statistics of the current trial, to be added to its record."""
+    return FRAMES.trial_stats() if FRAMES is not None else {}
+
+
+def start_block_frames():
+    if FRAMES is not None:
+        FRAMES.start_block()
+
+
+def print_block_frame_summary(phase, block):
+    if FRAMES is None:
+        return
+    summary = FRAMES.block_summary()
+    message = (f"Frames {phase} block {block}: {summary['n_flips']} flips, {summary['late_flips']} late flips, "
+               f"{summary['long_screens']} screens longer than planned")
+    if summary["median_flip_ms"] is not None: # no flips if the block was aborted before its first screen
+        message += f", flip duration median {summary['median_flip_ms']:.2f} ms, max {summary['max_flip_ms']:.2f} ms"
+    print(message)
+    if summary["min_slack_ms"] is not None:
+        print(f"Prep slack {phase} block {block}: median {summary['median_slack_ms']:.2f} ms, min {summary['min_slack_ms']:.2f} ms")
@@ -0,0 +1,131 @@
+"""
+Garbage collection outside the timing-critical screens.
+
+Python starts a cyclic collection whenever enough container objects have been allocated, which can
+happen in the middle of a stimulus screen. In the GC control mode (GC_CONTROL in constants, or
+main.py --gc-control, off by default), the automatic collection is disabled for
+the whole block (start_block_gc): the objects alive at the start of the block (caches, participant
+data) are frozen out of the collections (gc.freeze), and run_trial collects explicitly in the ITI of
+every trial, right after the fixation flip (Screen(collect=True)), so the pause only reduces the prep
+slack of the next screen. end_block_gc restores the automatic collection, also when the block raised
+(phases.run_phase).
+
+The duration of the explicit collection, the objects allocated since the previous one (gc.get_count)
+and the automatic collections that still ran (timed with gc.callbacks) are added to the trial records,
+and a summary is printed at the end of every block.
+"""
+import gc
+import logging
+from time import perf_counter
+
+import numpy as np
+
+from experiment.constants import GC_CONTROL
+
+GC_MONITOR = None # Global GC monitor, installed with the first block
+ENABLED = GC_CONTROL # GC control mode, see enable_gc_control
+
+
+class GCMonitor:
+    """Times the explicit and automatic collections."""
+    def __init__(self):
+        self.explicit = False # inside collect
+        self.controlled = False # the automatic collection is disabled for the current block
+        self.was_enabled = True # state of the automatic collection before the block
+        self.automatic_start = None
+        self.start_block()
+        gc.callbacks.append(self.callback)
+
+    def start_block(self):
+        self.pauses = [] # explicit collections of the block (s)
+        self.automatic = [] # automatic collections of the block (s)
+        self.trial = {}
+        self.trial_automatic = 0
+
+    def callback(self, phase, info):
+        if self.explicit:
+            return
+        if phase == "start":
+            self.automatic_start = perf_counter()
+        elif self.automatic_start is not None:
+            self.automatic.append(perf_counter() - self.automatic_start)
+            self.trial_automatic += 1
+            self.automatic_start = None
+
+    def collect(self):
+        allocations = gc.get_count()[0] # container objects allocated (net) since the last collection
+        self.explicit = True
+        start = perf_counter()
+        collected = gc.collect()
+        pause = perf_counter() - start
+        self.explicit = False
+        self.pauses.append(pause)
+        self.trial = {"gc_pause_ms": round(pause * 1000, 3), "gc_allocations": allocations, "gc_collected": collected}
+
+    def trial_stats(self):
+        stats = {**self.trial, "gc_automatic": self.trial_automatic}
+        self.trial = {}
+        self.trial_automatic = 0
+        return stats
+
+    def block_summary(self):
+        pauses = np.array(self.pauses) * 1000
+        automatic = np.array(self.automatic) * 1000
+        return {
+            "collections": int(pauses.size),
+            "median_pause_ms": float(np.median(pauses)) if pauses.size else None,
+            "max_pause_ms": float(pauses.max()) if pauses.size else None,
+            "automatic": int(automatic.size),
+            "max_automatic_ms": float(automatic.max()) if automatic.size else None,
+        }
+
+
+def enable_gc_control():
+    """Turn on the GC control mode for the next blocks."""
+    global ENABLED
+    ENABLED = True
+
+
+def start_block_gc():
+    """Install the GC monitor, and in the GC control mode collect, freeze the live objects and disable the automatic collection."""
+    global GC_MONITOR
+    if GC_MONITOR is None:
+        GC_MONITOR = GCMonitor()
+    if ENABLED:
+        GC_MONITOR.was_enabled = gc.isenabled()
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+    GC_MONITOR.start_block() # after the collection above, not counted as automatic
+    GC_MONITOR.controlled = ENABLED
+
+
+def collect_garbage():
+    """Explicit collection, in the ITI (see timeline.run_trial). Only in the GC control mode."""
+    if GC_MONITOR is not None and GC_MONITOR.controlled:
+        GC_MONITOR.collect()
+
+
+def trial_gc_stats():
+    """GC statistics of the current trial, to be added to its record."""
+    return GC_MONITOR.trial_stats() if GC_MONITOR is not None else {}
+
+
+def end_block_gc(phase, block):
+    """Restore the automatic collection and print the summary of the block."""
+    if GC_MONITOR is None:
+        return
+    if GC_MONITOR.controlled:
+        gc.unfreeze()
+        if GC_MONITOR.was_enabled:
+            gc.enable()
+        GC_MONITOR.controlled = False
+    summary = GC_MONITOR.block_summary()
+    message = f"GC {phase} block {block}: {summary['automatic']} automatic collections"
+    if summary["max_automatic_ms"] is not None:
+        message += f" (max {summary['max_automatic_ms']:.2f} ms)"
+    if summary["collections"]:
+        message += (f", {summary['collections']} in the ITI, pause median {summary['median_pause_ms']:.2f} ms, "
+                    f"max {summary['max_pause_ms']:.2f} ms")
+    print(message)
+    logging.info(message)
@@ -0,0 +1,104 @@
+import atexit
+import logging
+import queue
+import threading
+
+from experiment.tracing import span
+
+WRITER = None # Global variable for lazy initialization of the I/O worker
+WRITER_LOCK = threading.Lock() # get_data_writer is called from the startup and logging threads too
+
+MAX_PENDING_WRITES = 256 # Bounded queue: the presentation thread only blocks if the disk falls this far behind
+
+
+class DataWriter:
+    """
+    Worker thread that runs all data writes (block records, participant progress, trigger logs)
+    away from the presentation thread.
+    Writes are executed in the order they were submitted. A failed write is kept and raised again
+    by drain, so a lost block save does not go unnoticed.
+    """
+    def __init__(self, max_pending=MAX_PENDING_WRITES):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.failed_writes = 0
+        self.errors = [] # exceptions of the failed writes, not raised yet
+        self.thread = threading.Thread(target=self._run, name="io-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a write. Blocks only if the queue is full."""
+        if not self.thread.is_alive(): # worker already closed (e.g. logging shutdown at exit): write directly
+            func(*args, **kwargs)
+            return
+        self._queue.put((func, args, kwargs))
+
+    def drain(self):
+        """Barrier: wait until every write submitted so far has been completed. Raises the first failed write since the last drain."""
+        if self.thread.is_alive():
+            self._queue.join()
+        if self.errors:
+            error, self.errors = self.errors[0], []
+            raise error
+
+    def close(self):
+        """Finish the pending writes and stop the worker thread."""
+        if self.thread.is_alive():
+            self._queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            func, args, kwargs = item
+            try:
+                with span("io_write", getattr(func, "__name__", None)):
+                    func(*args, **kwargs)
+            except Exception as e:
+                # Do not log from here: log records are themselves written by this thread
+                self.failed_writes += 1
+                self.errors.append(e)
+                print(f"Failed to write data in {getattr(func, '__name__', func)}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+class QueuedHandler(logging.Handler):
+    """Logging handler that hands the records to the I/O worker, which passes them to the target handler."""
+    def __init__(self, target):
+        super().__init__(level=target.level)
+        self.target = target
+
+    def emit(self, record):
+        get_data_writer().submit(self.target.handle, record)
+
+    def flush(self):
+        get_data_writer().submit(self.target.flush)
+
+    def close(self):
+        try:
+            drain()
+        except Exception as e: # at exit: the failure was already printed when the write failed
+            print(f"Data writes failed before closing the log: {e}")
+        self.target.close()
+        super().close()
+
+
+def get_data_writer():
+    """Get the I/O worker, starting it on first use."""
+    global WRITER
+    if WRITER is None:
+        with WRITER_LOCK: # only one worker, or drain would not wait for the writes queued on the other
+            if WRITER is None:
+                writer = DataWriter()
+                atexit.register(writer.close) # make sure queued data reaches the disk even if the experiment crashes
+                WRITER = writer
+    return WRITER
+
+
+def drain():
+    """Wait until all queued data writes are on disk. Raises the first write that failed since the last drain."""
+    if WRITER is not None:
+        WRITER.drain()
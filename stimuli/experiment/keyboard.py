@@ -0,0 +1,95 @@
+"""
+Event-driven keyboard input with a timestamp per key press.
+
+psychos wait_key timestamps a response when its polling loop ends, and discards the presses pending
+when it starts. The KeyCollector is pushed once on the handlers of the window: every key press
+dispatched by pyglet is appended to a queue with its perf_counter time, taken in the handler (pyglet
+does not expose the OS timestamps of the key events, the dispatch time is the earliest one available).
+The queue is read without blocking with poll, and wait_response waits for the first press of a
+response, polling every POLL_INTERVAL and sleeping in between: the presentation thread may run under
+SCHED_FIFO (realtime.py), where a busy loop would starve the other threads of its core. A press is
+thus timestamped at most POLL_INTERVAL after it was received. Its reaction time is given both from the response clock (reset after the flip returns, as
+before) and from the flip of the response screen (see frames.last_flip_time).
+"""
+from collections import deque
+from time import perf_counter, sleep
+
+from experiment.frames import last_flip_time
+from psychos.types import KeyEvent
+from pyglet.window import key
+
+KEYBOARD = None # Global key collector of the window
+
+MAX_EVENTS = 256 # key presses kept in the queue
+POLL_INTERVAL = 0.0005 # s between two polls of wait
+
+
+def key_name(symbol):
+    """Name of a pyglet key symbol, as used by psychos ("SPACE", "Z", "1")."""
+    name = key.symbol_string(symbol)
+    return name[1:] if name.startswith("_") else name
+
+
+class KeyCollector:
+    """Queue of the key presses of a window, with the time they were dispatched."""
+    def __init__(self, window, max_events=MAX_EVENTS):
+        self.window = window
+        self.events = deque(maxlen=max_events) # (key, perf_counter time), in order of arrival
+        window.push_handlers(on_key_press=self.on_key_press)
+
+    def on_key_press(self, symbol, modifiers):
+        self.events.append((key_name(symbol), perf_counter()))
+        # not handled, so the psychos wait_key handlers still receive the press
+
+    def clear(self, before=None):
+        """Drop the presses before a time (perf_counter), or all of them."""
+        while self.events and (before is None or self.events[0][1] < before):
+            self.events.popleft()
+
+    def poll(self, keys):
+        """
+        First queued press of one of keys: (key, time), or None. Does not block. The presses of
+        other keys before it are dropped.
+        """
+        self.window.dispatch_events()
+        while self.events:
+            name, timestamp = self.events.popleft()
+            if name in keys:
+                return name, timestamp
+        return None
+
+    def wait(self, keys, onset, max_wait):
+        """First press of one of keys from onset (perf_counter time) until onset + max_wait: (key, time) or (None, None)."""
+        self.clear(onset)
+        end = onset + max_wait
+        while True:
+            event = self.poll(keys)
+            if event is not None:
+                return event
+            remaining = end - perf_counter()
+            if remaining < 0:
+                return None, None
+            sleep(min(POLL_INTERVAL, remaining))
+
+
+def get_keyboard(window):
+    """Get the key collector of the window, pushing it on its handlers on first use."""
+    global KEYBOARD
+    if KEYBOARD is None or KEYBOARD.window is not window:
+        KEYBOARD = KeyCollector(window)
+    return KEYBOARD
+
+
+def wait_response(window, keys, clock, max_wait):
+    """
+    Wait for a response to the screen just flipped (clock reset after the flip).
+    Returns the KeyEvent, timestamped with the clock as psychos wait_key does, and the reaction time
+    from the flip of the response screen (None on timeout).
+    """
+    onset = last_flip_time()
+    if onset is None: # no frame monitor
+        onset = clock.start_time
+    pressed_key, timestamp = get_keyboard(window).wait(keys, onset, max_wait)
+    if pressed_key is None:
+        return KeyEvent(key=None, timestamp=clock.time(), modifiers=None, event="press"), None
+    return KeyEvent(key=pressed_key, timestamp=timestamp - clock.start_time, modifiers=None, event="press"), timestamp - onset
@@ -1,149 +1,341 @@
+import logging
 import random
-from datetime import datetime
-
-from experiment.constants import (FIXATION_PARAMS, GABOR_PARAMS,
-                                  INITIAL_STAIRCASE, INSTRUCTIONS_TEXT,
-                                  ISOTONIC_SOUNDS, PHASES, STAIRCASE_PARAMS,
-                                  STIM_INFO)
-from experiment.presentation import (create_puretone, draw_fixation,
-                                     draw_gabor, show_instructions)
-from experiment.responses import (calculate_block_performance,
-                                  explicit_response, learning_response,
-                                  load_last_staircase_data, localizer_response,
-                                  save_block_data, staircase, test_response)
-from experiment.triggers import send_trigger
-from psychos.core import Clock, Interval
+from time import perf_counter
+
+from experiment.audio import print_audio_stats
+from experiment.constants import (ADAPTIVE_PROCEDURE, AUDIO_PARAMS,
+                                  FIXATION_PARAMS, GABOR_PARAMS,
+                                  INITIAL_STAIRCASE,
+                                  INSTRUCTIONS_TEXT, ISOTONIC_SOUNDS, PHASES,
+                                  STAIRCASE_PARAMS, STIM_INFO)
+from experiment.deadlines import (compensated_iti, print_deadline_report,
+                                  start_block_deadlines)
+from experiment.frames import (print_block_frame_summary, screen_time,
+                               start_block_frames)
+from experiment.gc_control import end_block_gc, start_block_gc
+from experiment.prefetch import prefetch, print_prefetch_stats, take_prefetched
+from experiment.preload import cached, preload_block
+from experiment.presentation import (PAGES, create_gabor, create_puretone,
+                                     create_tone_sequence, draw_fixation,
+                                     draw_gabor, gabor_image,
+                                     prepare_instructions, show_instructions)
+from experiment.quest import (load_last_quest_data, new_quest, quest,
+                              quest_record, save_quest_data)
+from experiment.realtime import print_latency_stats
+from experiment.records import BlockRecorder
+from experiment.responses import (CONFIDENCE_PROMPT,
+                                  calculate_block_performance, explicit_prompt,
+                                  explicit_response, learning_prompt,
+                                  learning_response, load_last_staircase_data,
+                                  localizer_prompt, localizer_response,
+                                  prompt_screen, save_block_data, staircase,
+                                  test_prompt, test_response)
+from experiment.timeline import Screen, Trial, run_trial, trial_record
+from experiment.tracing import export_block_trace, span
+
+
+GABOR_BYTES = 2 * 256 * 256 * 4 # RGBA image kept by pyglet and its texture
+PROMPT_BYTES = 2**16 # vertices of a Text widget (the glyphs are shared by all texts)
+
+
+def localizer_stimulus(auditory_freq, target, block_modality, target_modality):
+    """Amplitude of the tone and spatial frequency of the gabor of a localizer stimulus."""
+    amplitude = ISOTONIC_SOUNDS[auditory_freq]
+    spatial_frequency = GABOR_PARAMS["spatial_frequency"] # default
+    if block_modality == "visual":
+        amplitude = 0 # No sound in visual block
+    if target == 1:
+        if block_modality == "auditory" or (block_modality == "multimodal" and target_modality == "auditory"):
+            amplitude *= 0.2 # reduce the amplitude of the sound
+        else:
+            spatial_frequency *= 0.75 # reduce the spatial frequency of the gabor
+    return amplitude, spatial_frequency
+
+
+def block_tone(frequency, duration, amplitude):
+    """Tone preloaded for the block (see preload.py), or created now."""
+    tone = cached(("tone", frequency, duration, amplitude))
+    if tone is None:
+        tone = create_puretone(frequency=frequency, duration=duration, amplitude=amplitude)
+    return tone
+
+
+def block_gabor(orientation, screen_info, spatial_frequency=None):
+    """Gabor sprite preloaded for the block, or its image computed now (the sprite is made when it is drawn)."""
+    image = cached(("gabor", orientation, spatial_frequency))
+    if image is None:
+        image = gabor_image(orientation, screen_info, spatial_frequency=spatial_frequency)
+    return image
+
+
+def block_tone_sequence(frequencies, amplitudes):
+    """Tone sequence of a localizer trial preloaded for the block, or rendered now (None if silent)."""
+    if not any(amplitudes): # visual block, no sound
+        return None
+    sequence = cached(("sequence", tuple(frequencies), tuple(amplitudes)))
+    if sequence is None:
+        sequence = create_tone_sequence(frequencies, amplitudes, STIM_INFO["leading_duration"], localizer_interval())
+    return sequence
+
+
+def localizer_interval():
+    """Onset to onset interval of the localizer stimuli, in whole frames."""
+    return screen_time(STIM_INFO["leading_duration"]) + screen_time(STIM_INFO["isi_duration"])
+
+
+def localizer_amplitudes(trial):
+    return [
+        localizer_stimulus(*stimulus)[0]
+        for stimulus in zip(trial["auditory_sequence"], trial["target_sequence"], trial["block_modality"], trial["target_modality"])
+    ]
+
+
+def localizer_gabors(trial):
+    """Orientation and spatial frequency of the gabors of a localizer trial (None in auditory blocks)."""
+    gabors = []
+    for auditory_freq, visual_ori, target, block_modality, target_modality in zip(trial["auditory_sequence"], trial["visual_sequence"], trial["target_sequence"], trial["block_modality"], trial["target_modality"]):
+        if block_modality == "auditory":
+            gabors.append(None)
+        else:
+            gabors.append((visual_ori, localizer_stimulus(auditory_freq, target, block_modality, target_modality)[1]))
+    return gabors
+
+
+def block_prompts(phase, conditions, key_mapping):
+    """Response prompts shown in a block (see responses.prompt_screen)."""
+    if phase == "localizer":
+        return list(dict.fromkeys(localizer_prompt(trial["target_modality"][-1]) for trial in conditions))
+    if phase == "learning":
+        return [learning_prompt(key_mapping)]
+    if phase == "test":
+        return [test_prompt(key_mapping)]
+    return [explicit_prompt(key_mapping), CONFIDENCE_PROMPT]
+
+
+def block_assets(phase, conditions, screen_info, window, key_mapping=None):
+    """
+    Unique stimuli and response prompts of a block, to be preloaded while the instructions are shown
+    (see preload.py): {key: (estimated bytes, build function, args)}, the keys used by block_tone,
+    block_gabor and block_tone_sequence.
+    """
+    gabors, tones, sequences = {}, {}, {}
+    for trial in conditions:
+        if phase == "localizer":
+            for gabor in localizer_gabors(trial):
+                if gabor is not None:
+                    gabors[gabor] = True
+            amplitudes = localizer_amplitudes(trial)
+            if any(amplitudes):
+                sequences[(tuple(trial["auditory_sequence"]), tuple(amplitudes))] = True
+            continue
+        modality = trial.get("modality") # only in the explicit phase
+        if modality != "visual":
+            tones[(trial["a_leading"], STIM_INFO["leading_duration"], ISOTONIC_SOUNDS[trial["a_leading"]])] = True
+            tones[(trial["a_trailing"], STIM_INFO["target_duration"], ISOTONIC_SOUNDS[trial["a_trailing"]])] = True
+        if modality != "auditory":
+            gabors[(trial["v_leading"], None)] = True
+            gabors[(trial["v_trailing"], None)] = True # targets of the test phase are rotated and made per trial
+
+    sample_bytes = 2 * AUDIO_PARAMS["sample_rate"] # 16-bit mono
+    interval = localizer_interval()
+    assets = {}
+    for orientation, spatial_frequency in gabors:
+        assets[("gabor", orientation, spatial_frequency)] = (GABOR_BYTES, create_gabor, (orientation, screen_info, spatial_frequency))
+    for frequency, duration, amplitude in tones:
+        assets[("tone", frequency, duration, amplitude)] = (int(duration * sample_bytes), create_puretone, (frequency, duration, amplitude))
+    for frequencies, amplitudes in sequences:
+        nbytes = int(((len(frequencies) - 1) * interval + STIM_INFO["leading_duration"]) * sample_bytes)
+        assets[("sequence", frequencies, amplitudes)] = (nbytes, create_tone_sequence, (frequencies, amplitudes, STIM_INFO["leading_duration"], interval))
+    for prompt in block_prompts(phase, conditions, key_mapping):
+        assets[("prompt", prompt)] = (PROMPT_BYTES * len(prompt), prompt_screen, (window, prompt))
+    return assets
+
+
+def preload_phase(phase, block, conditions, screen_info, window, key_mapping=None):
+    """Preload steps of a block, run by show_instructions."""
+    return preload_block(phase, block, block_assets(phase, conditions, screen_info, window, key_mapping))
+
+
+def prepare_localizer_trial(trial, screen_info):
+    """Gabors (None in auditory blocks) and tone sequence of a localizer trial, see prefetch.py."""
+    images = []
+    for gabor in localizer_gabors(trial):
+        images.append(None if gabor is None else block_gabor(gabor[0], screen_info, gabor[1]))
+    return {"images": images, "sequence": block_tone_sequence(trial["auditory_sequence"], localizer_amplitudes(trial))}
+
+
+def prepare_trial(trial, screen_info, trailing_image=True):
+    """
+    Tones and gabors (preloaded sprites or images) of a learning, test or explicit trial, see prefetch.py.
+    Only the modality of the explicit blocks is prepared. The trailing image is left out if it depends
+    on the response to the previous trial (targets of the test phase).
+    """
+    modality = trial.get("modality") # only in the explicit phase
+    stimuli = {}
+    if modality != "visual":
+        stimuli["leading_tone"] = block_tone(trial["a_leading"], STIM_INFO["leading_duration"], ISOTONIC_SOUNDS[trial["a_leading"]])
+        stimuli["trailing_tone"] = block_tone(trial["a_trailing"], STIM_INFO["target_duration"], ISOTONIC_SOUNDS[trial["a_trailing"]])
+    if modality != "auditory":
+        stimuli["leading_image"] = block_gabor(trial["v_leading"], screen_info)
+        if trailing_image:
+            stimuli["trailing_image"] = block_gabor(trial["v_trailing"], screen_info)
+    return stimuli
+
+
+def prefetch_trial(phase, block, conditions, i, screen_info):
+    """
+    Prepare the stimuli of trial i on the prefetch worker (during the instructions or the previous trial).
+    They are taken with take_trial(phase, block, i).
+    """
+    if i >= len(conditions):
+        return
+    trial = conditions[i]
+    if phase == "localizer":
+        prefetch(f"{phase} {block} trial {i}", prepare_localizer_trial, trial, screen_info)
+    else:
+        prefetch(f"{phase} {block} trial {i}", prepare_trial, trial, screen_info, phase != "test" or trial["target"] == 0)
+
+
+def take_trial(phase, block, conditions, i, screen_info):
+    """Stimuli of trial i, prepared now if they were not prefetched."""
+    stimuli = take_prefetched(f"{phase} {block} trial {i}")
+    if stimuli is not None:
+        return stimuli
+    if phase == "localizer":
+        return prepare_localizer_trial(conditions[i], screen_info)
+    return prepare_trial(conditions[i], screen_info, phase != "test" or conditions[i]["target"] == 0)
+
+
+def fixation_screen(fixation_color, screen_info, iti_duration, trigger):
+    """Inter trial interval: the fixation dot, with the feedback color of the previous response."""
+    return Screen("fixation", iti_duration, trigger, [(draw_fixation, (fixation_color, screen_info), {})], collect=True)
+
+
+def stimulus_screen(label, duration, trigger, screen_info, orientation=None, image=None, tone=None, tone_label=None):
+    """Gabor (if orientation is given) and fixation dot, and the tone starting with the flip."""
+    draws = []
+    if orientation is not None:
+        draws.append((draw_gabor, (orientation, screen_info), {"image": image}))
+    draws.append((draw_fixation, (FIXATION_PARAMS["color"], screen_info), {}))
+    return Screen(label, duration, trigger, draws, tone, tone_label)
+
+
+def isi_screen(trigger, screen_info, trigger_before_flip=False):
+    return Screen("isi", STIM_INFO["isi_duration"], trigger, [(draw_fixation, (FIXATION_PARAMS["color"], screen_info), {})],
+                  trigger_before_flip=trigger_before_flip)
+
+
+def compile_localizer_trial(block, i, trial, stimuli, fixation_color, iti_duration, conditions, screen_info):
+    """Fixation, then the sequence of stimuli (each followed by an ISI) and the count response."""
+    context = f"Trial {i+1}, Block {block}, localizer phase" # context for trigger logs
+    screens = [fixation_screen(fixation_color, screen_info, iti_duration, "loc_trial_start")]
+    for j, (auditory_freq, visual_ori, target, block_modality) in enumerate(zip(trial["auditory_sequence"], trial["visual_sequence"], trial["target_sequence"], trial["block_modality"])):
+        trigger_type = f"loc_{visual_ori}_{auditory_freq}"
+        if j == 0: # first stimulus in the sequence
+            trigger_type += "_first"
+        if target != 0:
+            trigger_type += "_target"
+        screens.append(stimulus_screen(
+            "leading", STIM_INFO["leading_duration"], trigger_type, screen_info,
+            orientation=visual_ori if block_modality != "auditory" else None, # the tones are in the sequence stream of the trial
+            image=stimuli["images"][j],
+            tone=stimuli["sequence"] if j == 0 else None, # the whole sequence of tones starts with the first flip
+            tone_label="sequence",
+        ))
+        screens.append(isi_screen("loc_isi", screen_info))
+    response = (localizer_response, (trial["target_modality"][-1], trial["target_count"], context))
+    return Trial(screens, response, context, prepare_next=(prefetch_trial, ("localizer", block, conditions, i + 1, screen_info)))
+
+
+def compile_trial(phase, block, i, trial, stimuli, fixation_color, iti_duration, key_mapping, conditions, screen_info, ori_diff=0):
+    """
+    Fixation, leading stimulus, ISI, trailing stimulus and response of a learning, test or explicit trial.
+    In the explicit phase only the modality of the block is presented.
+    """
+    modality = trial.get("modality") # only in the explicit phase
+    if phase == "explicit":
+        modality_name = "auditory" if modality == "auditory" else "visual"
+        if modality == "auditory":
+            trial_type = f"explicit_{trial['a_trailing']}_{trial['a_pred']}"
+        else:
+            trial_type = f"explicit_{trial['v_trailing']}_{trial['v_pred']}"
+        context = f"Trial {i+1}, Block {block} ({modality_name}), explicit phase" # context for trigger logs
+        response = (explicit_response, (key_mapping, trial, f"{trial_type}_response", f"{trial_type}_confidence", context))
+    else:
+        trial_type = f"{trial['v_trailing']}_{trial['v_pred']}_{trial['a_trailing']}_{trial['a_pred']}"
+        context = f"Trial {i+1}, Block {block}, {phase} phase" # context for trigger logs
+        response_handler = learning_response if phase == "learning" else test_response
+        response = (response_handler, (key_mapping, trial, f"{trial_type}_response", context))
+
+    visual = modality != "auditory"
+    trailing_orientation = trial["v_trailing"] + ori_diff if ori_diff else trial["v_trailing"]
+    screens = [
+        fixation_screen(fixation_color, screen_info, iti_duration, f"{trial_type}_trial_start"),
+        stimulus_screen(
+            "leading", STIM_INFO["leading_duration"], f"{trial_type}_cue_onset", screen_info,
+            orientation=trial["v_leading"] if visual else None, image=stimuli.get("leading_image"), tone=stimuli.get("leading_tone"),
+        ),
+        isi_screen(f"{trial_type}_isi", screen_info, trigger_before_flip=phase == "explicit"), # explicit: trigger before the flip, as originally
+        stimulus_screen(
+            "trailing", STIM_INFO["target_duration"], f"{trial_type}_target_onset", screen_info,
+            orientation=trailing_orientation if visual else None, image=stimuli.get("trailing_image"), tone=stimuli.get("trailing_tone"),
+        ),
+    ]
+    return Trial(screens, response, context, prepare_next=(prefetch_trial, (phase, block, conditions, i + 1, screen_info)))
+
+
+def block_instructions(phase, block, participant_data):
+    """Instructions shown at the start of a block: the text and its format arguments."""
+    if phase == "explicit":
+        if participant_data[f"conditions_explicit_{block}"][0]["modality"] == "auditory":
+            return INSTRUCTIONS_TEXT["explicit_phase"], dict(modality_task="noticed that some sounds were also paired more frequently than others.", modality_verb="hear", modality="an auditory")
+        return INSTRUCTIONS_TEXT["explicit_phase"], dict(modality_task="can remember the visual pairs that you learned at the start of the experiment.", modality_verb="see", modality="a visual")
+    if block == 1:
+        return INSTRUCTIONS_TEXT[f"{phase}_start"], {}
+    if phase == "test":
+        return INSTRUCTIONS_TEXT["test_continue"], dict(block=block)
+    return INSTRUCTIONS_TEXT[f"{phase}_continue"], {}
+
+
+def layout_instructions(blocks, participant_data, screen_info):
+    """
+    Lay out the instruction pages of the blocks to run [(phase, block)] at startup, so show_instructions
+    only draws them. The pages of test_block_end with the block performance are laid out when it is known.
+    """
+    start, cached_pages = perf_counter(), len(PAGES)
+    with span("layout_instructions"):
+        for phase, block in blocks:
+            text, kwargs = block_instructions(phase, block, participant_data)
+            prepare_instructions(text, screen_info, **kwargs)
+            if phase == "test":
+                prepare_instructions(INSTRUCTIONS_TEXT["test_block_end"], screen_info, remaining_blocks=PHASES["test_blocks"] - block)
+    message = f"Instructions: {len(PAGES) - cached_pages} pages laid out in {perf_counter() - start:.2f} s"
+    print(message)
+    logging.info(message)
 
 
 def localizer_phase(participant_data, block, window, full_screen, screen_info):
+    conditions = participant_data[f"conditions_localizer_{block}"]
+    preload = preload_phase("localizer", block, conditions, screen_info, window) # stimuli built while the instructions are read
+
     # Instructions
-    if block == 1:
-        show_instructions(window, INSTRUCTIONS_TEXT["localizer_start"], screen_info)
-    else:
-        show_instructions(window, INSTRUCTIONS_TEXT["localizer_continue"], screen_info)
+    text, kwargs = block_instructions("localizer", block, participant_data)
+    show_instructions(window, text, screen_info, preload=preload, **kwargs)
+    prefetch_trial("localizer", block, conditions, 0, screen_info)
    
-    conditions = participant_data[f"conditions_localizer_{block}"]
-    block_data = []
+    block_data = BlockRecorder("localizer", block, {**screen_info, "full_screen": full_screen}) # session-constant fields are stored once
 
     for i, trial in enumerate(conditions):
-        context = f"Trial {i+1}, Block {block}, localizer phase" # context for trigger logs
         if i == 0:
             fixation_color = FIXATION_PARAMS["color"]  # set the fixation color. In subsequent trials, the fixation color will be updated based on the response to provide feedback
         else: 
             fixation_color = response["fixation_color"]
-        
-        trial_clock = Clock()  # This allows to init a clock to measure the RT
-        trial_clock.reset()
-        timestamp_dicts = {}
-        # Time up to milliseconds (4 digits of )
-        timestamp_dicts["start_trial_absolute"] = datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S.%f"
-        )
-
-        # ====== Inter trial interval ==========
-        iti_duration = random.uniform(*STIM_INFO["iti_range"])
-        interval = Interval(duration=iti_duration)  # This allows to init a time counter of duration
-        interval.reset()  # This allows to reset the time counter
-        draw_fixation(fixation_color, screen_info)  # draw the fixation dot with feedback color
-        window.flip()
-        send_trigger("loc_trial_start", context) # send trigger for the start of the trial
-        timestamp_dicts["start_fixation"] = trial_clock.time()
-        
-        # ======= Stimuli sequence ========
-        first_stim = True # set to True before starting the trial sequence loop
-        for auditory_freq, visual_ori, target, block_modality, target_modality in zip(trial["auditory_sequence"], trial["visual_sequence"], trial["target_sequence"], trial["block_modality"], trial["target_modality"]):      
-            # pre-load stimuli
-            fixation_color =  FIXATION_PARAMS["color"] # reset the fixation color to the default color for the ISI
-            if block_modality == "multimodal":
-                # Checking for visual or audiotry target, and setting the amplitude and spatial frequency accordingly
-                if target_modality == "auditory":
-                    if target == 1:
-                        amplitude = ISOTONIC_SOUNDS[auditory_freq] * 0.2 # half the amplitude of sound
-                        spatial_frequency = GABOR_PARAMS["spatial_frequency"] # default
-                    else:
-                        amplitude = ISOTONIC_SOUNDS[auditory_freq] 
-                        spatial_frequency = GABOR_PARAMS["spatial_frequency"] # default
-                else: # target modality visual
-                    if target == 1:
-                        amplitude = ISOTONIC_SOUNDS[auditory_freq] 
-                        spatial_frequency = GABOR_PARAMS["spatial_frequency"] * 0.75 # reduce the spatial frequency of the gabor
-                    else:
-                        amplitude = ISOTONIC_SOUNDS[auditory_freq] 
-                        spatial_frequency = GABOR_PARAMS["spatial_frequency"] # default
-
-                tone = create_puretone(
-                    frequency=auditory_freq, duration=STIM_INFO["leading_duration"], amplitude=amplitude
-                )
-                draw_gabor(visual_ori, screen_info, spatial_frequency=spatial_frequency) # Preload gabor
-                draw_fixation(fixation_color, screen_info) # Preload fixation
-
-            elif block_modality == "auditory":
-                if target == 1:
-                    amplitude = ISOTONIC_SOUNDS[auditory_freq] * 0.2
-                else:
-                    amplitude = ISOTONIC_SOUNDS[auditory_freq] 
-                tone = create_puretone(
-                    frequency=auditory_freq, duration=STIM_INFO["leading_duration"], amplitude=amplitude
-                )
-                draw_fixation(fixation_color, screen_info) # Preload fixation
-
-            else: # visual
-                if target == 1:
-                    spatial_frequency = GABOR_PARAMS["spatial_frequency"] * 0.75 # reduce the spatial frequency of the gabor
-                else:
-                    spatial_frequency = GABOR_PARAMS["spatial_frequency"] # default
-                    
-                tone = create_puretone(
-                    frequency=auditory_freq, duration=STIM_INFO["leading_duration"], amplitude=0 # No sound in visual block
-                )
-                draw_gabor(visual_ori, screen_info, spatial_frequency=spatial_frequency) # Preload gabor
-                draw_fixation(fixation_color, screen_info) # Preload fixation
-
-            # define trigger type
-            if first_stim: # first stimulus in the sequence
-                first_stim = False # set to False after the first stimulus
-                if target == 0:
-                    trigger_type = f"loc_{visual_ori}_{auditory_freq}_first"
-                else:
-                    trigger_type = f"loc_{visual_ori}_{auditory_freq}_first_target"
-            else: # subsequent stimuli in the sequence
-                if target == 0:
-                    trigger_type = f"loc_{visual_ori}_{auditory_freq}"
-                else:
-                    trigger_type = f"loc_{visual_ori}_{auditory_freq}_target"
-            
-            interval.wait()  # Waits for the remaining time of the interval
-            
-            tone.play()  # play the leading tone
-            window.flip()  # Flips the window to show the pre-loaded gabor
-            send_trigger(trigger_type, context) # send trigger for the leading stimulus
-
-            timestamp_dicts["start_leading"] = trial_clock.time()
-            window.wait(STIM_INFO["leading_duration"])  # Waits for the leading duration
-            # ======= ISI ========
-            interval = Interval(duration=STIM_INFO["isi_duration"])
-            interval.reset()
-            draw_fixation(fixation_color, screen_info)  # draw the fixation dot with feedback color
-            window.flip()
-            send_trigger("loc_isi", context) # send trigger for the ISI
-            timestamp_dicts["start_isi"] = trial_clock.time()
-            interval.wait()  # Waits for the ISI duration
-        
-        # ======= Response ========
-        timestamp_dicts["start_response"] = trial_clock.time()
-        response = localizer_response(window, target_modality, trial["target_count"], context)
-        timestamp_dicts["end_trial"] = trial_clock.time()
-        block_data.append(
-            {
-                "num_trial": i,
-                "iti_duration": iti_duration,
-                **trial,
-                **response,
-                **timestamp_dicts,
-                **screen_info,
-                "full_screen": full_screen,
-            }
-        )
+
+        iti_duration = compensated_iti(random.uniform(*STIM_INFO["iti_range"])) # shortened after missed deadlines
+        stimuli = take_trial("localizer", block, conditions, i, screen_info) # prefetched during the previous trial
+        compiled = compile_localizer_trial(block, i, trial, stimuli, fixation_color, iti_duration, conditions, screen_info)
+        response, timestamps = run_trial(window, compiled)
+        block_data.append(trial_record(i, trial, iti_duration, response, timestamps))
 
     # Save the block data
     save_block_data(participant_data, block_data, "localizer", block)
@@ -151,110 +343,29 @@ def localizer_phase(participant_data, block, window, full_screen, screen_info):
 
 
 def learning_phase(participant_data, block, window, full_screen, screen_info):
-    # Instructions
-    if block == 1:
-        show_instructions(window, INSTRUCTIONS_TEXT["learning_start"], screen_info,)
-    else:
-        show_instructions(window, INSTRUCTIONS_TEXT["learning_continue"], screen_info,)
-   
-
     conditions = participant_data[f"conditions_learning_{block}"]
     key_mapping = participant_data[f"keymapping_learning_{block}"]
-    block_data = []
+    preload = preload_phase("learning", block, conditions, screen_info, window, key_mapping) # stimuli built while the instructions are read
 
-    for i, trial in enumerate(conditions):
-        # Get trigger ids for the current trial type
-        trial_type = f"{trial['v_trailing']}_{trial['v_pred']}_{trial['a_trailing']}_{trial['a_pred']}"
-        trial_start_trigger =f"{trial_type}_trial_start"
-        cue_onset_trigger = f"{trial_type}_cue_onset"
-        isi_trigger = f"{trial_type}_isi"
-        target_onset_trigger = f"{trial_type}_target_onset"
-        response_trigger = f"{trial_type}_response"
-        context = f"Trial {i+1}, Block {block}, learning phase" # context for trigger logs
+    # Instructions
+    text, kwargs = block_instructions("learning", block, participant_data)
+    show_instructions(window, text, screen_info, preload=preload, **kwargs)
+    prefetch_trial("learning", block, conditions, 0, screen_info)
+   
+    block_data = BlockRecorder("learning", block, {**screen_info, "full_screen": full_screen}) # session-constant fields are stored once
 
+    for i, trial in enumerate(conditions):
         if i == 0:
             fixation_color = FIXATION_PARAMS["color"]  # set the fixation color. In subsequent trials, the fixation color will be updated based on the response to provide feedback
         else: 
             fixation_color = response["fixation_color"]
-        trial_clock = Clock()  # This allows to init a clock to measure the RT
-        trial_clock.reset()
-        timestamp_dicts = {}
-        # Time up to milliseconds (4 digits of )
-        timestamp_dicts["start_trial_absolute"] = datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S.%f"
-        )
-
-        # ====== Inter trial interval ==========
-        iti_duration = random.uniform(*STIM_INFO["iti_range"])
-        interval = Interval(duration=iti_duration)  # This allows to init a time counter of duration
-        interval.reset()  # This allows to reset the time counter
-
-        draw_fixation(fixation_color, screen_info)  # draw the fixation dot with feedback color
-        window.flip()
-
-        send_trigger(trial_start_trigger, context) # send trigger for the start of the trial
-
-        timestamp_dicts["start_fixation"] = trial_clock.time()
-
-        # ======= Leading stimuli ========
-        # pre-load stimuli
-        fixation_color = FIXATION_PARAMS["color"]  # reset the fixation color to the default color for the ISI
-        leading_tone = create_puretone(
-            frequency=trial["a_leading"], duration=STIM_INFO["leading_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_leading"]]
-        )
-        draw_gabor(trial["v_leading"], screen_info)  # initiate the leading gabor,
-        draw_fixation(fixation_color, screen_info)  # Preload fixation
-        interval.wait()  # Waits for the remaining time of the interval
-
-        # presentation
-        leading_tone.play()  # play the leading tone
-        window.flip()  # Flips the window to show the pre-loaded gabor
-        send_trigger(cue_onset_trigger, context) # send trigger for the leading stimulus
-
-        timestamp_dicts["start_leading"] = trial_clock.time()
-        window.wait(STIM_INFO["leading_duration"])  # Waits for the leading duration
-
-        # ======= ISI ========
-        interval = Interval(duration=STIM_INFO["isi_duration"])
-        interval.reset()
-        draw_fixation(fixation_color, screen_info)
-        window.flip()
-        send_trigger(isi_trigger, context) # send trigger for the ISI)
-        
-        timestamp_dicts["start_isi"] = trial_clock.time()
-
-        # ======= Trailing stimuli ========
-        # pre-load stimuli
-        trailing_tone = create_puretone(
-            frequency=trial["a_trailing"], duration=STIM_INFO["target_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_trailing"]]
-        )
-        draw_gabor(trial["v_trailing"], screen_info)
-        draw_fixation(fixation_color, screen_info)
-        interval.wait()
-
-        # presentation
-        trailing_tone.play()
-        window.flip()  # Flips the window to show the pre-loaded gabor
-        send_trigger(target_onset_trigger, context) # send trigger for the trailing stimulus
-
-        timestamp_dicts["start_trailing"] = trial_clock.time()
-        window.wait(STIM_INFO["target_duration"])
-
-        # ======= Response ========
-        timestamp_dicts["start_response"] = trial_clock.time()
-        response = learning_response(window, key_mapping, trial, response_trigger, context)
-        timestamp_dicts["end_trial"] = trial_clock.time()
-        block_data.append(
-            {
-                "num_trial": i,
-                "iti_duration": iti_duration,
-                **trial,
-                **response,
-                **timestamp_dicts,
-                **screen_info,
-                "full_screen": full_screen,
-            }
-        )
+
+        iti_duration = compensated_iti(random.uniform(*STIM_INFO["iti_range"])) # shortened after missed deadlines
+        stimuli = take_trial("learning", block, conditions, i, screen_info)  # tones and images, prefetched during the previous trial
+        compiled = compile_trial("learning", block, i, trial, stimuli, fixation_color, iti_duration, key_mapping, conditions, screen_info)
+        response, timestamps = run_trial(window, compiled)
+        block_data.append(trial_record(i, trial, iti_duration, response, timestamps))
+
     # Save the block data
     save_block_data(participant_data, block_data, "learning", block)
 
@@ -262,146 +373,76 @@ def learning_phase(participant_data, block, window, full_screen, screen_info):
 
 
 def test_phase(participant_data, block, window, full_screen, screen_info):
-    # Instructions
-    if block == 1:
-        show_instructions(window, INSTRUCTIONS_TEXT["test_start"], screen_info,)
-    else:
-        show_instructions(window, INSTRUCTIONS_TEXT["test_continue"], screen_info,block=block)
-   
     conditions = participant_data[f"conditions_test_{block}"]
     key_mapping = participant_data[f"keymapping_test_{block}"]
-    block_data = []
+    preload = preload_phase("test", block, conditions, screen_info, window, key_mapping) # stimuli built while the instructions are read
 
-    for i, trial in enumerate(conditions):
-        # Get trigger ids for the current trial type
-        trial_type = f"{trial['v_trailing']}_{trial['v_pred']}_{trial['a_trailing']}_{trial['a_pred']}"
-        trial_start_trigger =f"{trial_type}_trial_start"
-        cue_onset_trigger = f"{trial_type}_cue_onset"
-        isi_trigger = f"{trial_type}_isi"
-        target_onset_trigger = f"{trial_type}_target_onset"
-        response_trigger = f"{trial_type}_response"
-        context = f"Trial {i+1}, Block {block}, test phase" # context for trigger logs
+    # Instructions
+    text, kwargs = block_instructions("test", block, participant_data)
+    show_instructions(window, text, screen_info, preload=preload, **kwargs)
+    prefetch_trial("test", block, conditions, 0, screen_info)
+   
+    block_data = BlockRecorder("test", block, {**screen_info, "full_screen": full_screen}) # session-constant fields are stored once
+
+    # Get staircase history
+    if ADAPTIVE_PROCEDURE == "quest":
+        # prior on the first block, posterior of the previous block afterwards
+        quest_data = new_quest() if block == 1 else load_last_quest_data(participant_data, block)
+        staircase_data = quest_record(quest_data)
+    elif block == 1: 
+        staircase_data = INITIAL_STAIRCASE # get the initial parameters, same for every participant
+    else: 
+        # get the last parameters from the previous block
+        staircase_data = load_last_staircase_data(participant_data, block)
 
+    for i, trial in enumerate(conditions):
         if i == 0: # first trial of the block
             fixation_color = FIXATION_PARAMS["color"]  # set the fixation color. In subsequent trials, the fixation color will be updated based on the response to provide feedback
-
-            # Get staircase history
-            if block == 1: 
-                staircase_data = INITIAL_STAIRCASE # get the initial parameters, same for every participant
-            else: 
-                # get the last parameters from the previous block
-                staircase_data = load_last_staircase_data(participant_data, block)
-
         else: # subsequent trials
             fixation_color = response["fixation_color"] # update fixation color based on the last response to provide feedback
-        
-     
-        trial_clock = Clock()  # This allows to init a clock to measure the RT
-        trial_clock.reset()
-        timestamp_dicts = {}
-        # Time up to milliseconds (4 digits of )
-        timestamp_dicts["start_trial_absolute"] = datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S.%f"
-        )
-
-        # ====== Inter trial interval ==========
-        iti_duration = random.uniform(*STIM_INFO["iti_range"])
-        interval = Interval(duration=iti_duration)  # This allows to init a time counter of duration
-        interval.reset()  # This allows to reset the time counter
-        draw_fixation(fixation_color, screen_info)  # draw the fixation dot with feedback color
-        window.flip()
-
-        send_trigger(trial_start_trigger, context) # send trigger for the start of the trial
-
-        timestamp_dicts["start_fixation"] = trial_clock.time()
-
-        # ======= Leding stimuli ========
-        # pre-load stimuli
-        fixation_color = FIXATION_PARAMS["color"]  # reset the fixation color to the default color for the ISI
-        leading_tone = create_puretone(
-            frequency=trial["a_leading"], duration=STIM_INFO["leading_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_leading"]]
-            )
-        draw_gabor(trial["v_leading"], screen_info)  # initiate the leading gabor,
-        draw_fixation(fixation_color, screen_info)  # Preload fixation
-        interval.wait()  # Waits for the remaining time of the interval
-
-        # presentation
-        leading_tone.play()  # play the leading tone
-        window.flip()  # Flips the window to show the pre-loaded gabor
-        send_trigger(cue_onset_trigger, context) # send trigger for the leading stimulus
-        
-        timestamp_dicts["start_leading"] = trial_clock.time()
-        window.wait(STIM_INFO["leading_duration"])  # Waits for the leading duration
-
-        # ======= ISI ========
-        interval = Interval(duration=STIM_INFO["isi_duration"])
-        interval.reset()
-        draw_fixation(fixation_color, screen_info)
-        window.flip()
-
-        send_trigger(isi_trigger, context) # send trigger for the ISI)
-        
-        timestamp_dicts["start_isi"] = trial_clock.time()
-
-        # ======= Trailing stimuli ========
-        # pre-load stimuli
-        trailing_tone = create_puretone(frequency=trial["a_trailing"], duration=STIM_INFO["target_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_trailing"]])
+
+        iti_duration = compensated_iti(random.uniform(*STIM_INFO["iti_range"])) # shortened after missed deadlines
         if trial["target"] == 0:
             current_ori_diff = 0
         else: # in target trials we add a random orientation difference to the trailing gabor
             current_ori_diff = staircase_data["ori_diff"]
             current_ori_diff = random.choice([-current_ori_diff, current_ori_diff])
 
-        draw_gabor(trial["v_trailing"] + current_ori_diff, screen_info)  # draw the trailing gabor
-        draw_fixation(fixation_color, screen_info)  # Preload fixation
-        interval.wait()
-
-        # presentation
-        trailing_tone.play()
-        window.flip()
-        send_trigger(target_onset_trigger, context) # send trigger for the trailing stimulus
-        timestamp_dicts["start_trailing"] = trial_clock.time()
-        window.wait(STIM_INFO["target_duration"])
-
-        # ======= Response ========
-        timestamp_dicts["start_response"] = trial_clock.time()
-        response = test_response(window, key_mapping, trial, response_trigger, context)
-        timestamp_dicts["end_trial"] = trial_clock.time()
+        # the trailing image of target trials depends on the staircase, it is made when drawn
+        stimuli = take_trial("test", block, conditions, i, screen_info)  # tones and images, prefetched during the previous trial
+        compiled = compile_trial("test", block, i, trial, stimuli, fixation_color, iti_duration, key_mapping, conditions, screen_info, current_ori_diff)
+        response, timestamps = run_trial(window, compiled)
 
         # --- Update the staircase if this is a target trial ---
         if trial["target"] == 1:
-            # Update staircase_data
-            staircase_data["last_outcome"] = response["outcome"]
-            # Update staircase parameters based on participant's response.
-            staircase_data = staircase(**staircase_data, **STAIRCASE_PARAMS)
+            if ADAPTIVE_PROCEDURE == "quest":
+                # Update the posterior and choose the next ori_diff
+                quest_data = quest(response["outcome"], **quest_data)
+                staircase_data = quest_record(quest_data)
+            else:
+                # Update staircase_data
+                staircase_data["last_outcome"] = response["outcome"]
+                # Update staircase parameters based on participant's response.
+                staircase_data = staircase(**staircase_data, **STAIRCASE_PARAMS)
                 
-
-        block_data.append(
-            {
-                "num_trial": i,
-                "iti_duration": iti_duration,
-                **trial,
-                **response,
-                **timestamp_dicts,
-                **staircase_data,
-                **screen_info,
-                "full_screen": full_screen,
-            }
-        )
+        block_data.append(trial_record(i, trial, iti_duration, response, timestamps, **staircase_data))
 
     # draw fixation dot with last feedback color
     draw_fixation(response["fixation_color"], screen_info)  # draw the fixation dot with feedback color
     window.flip()
-    window.wait(1) 
 
-    # Calculate block performance and show to the participant
+    # Calculate block performance and lay out its pages during the wait, then show to the participant
     block_performance = calculate_block_performance(block_data)
     remaining_blocks = PHASES["test_blocks"] - block 
+    prepare_instructions(INSTRUCTIONS_TEXT["test_block_end"], screen_info, remaining_blocks=remaining_blocks, block_performance=block_performance)
+    window.wait(1) 
     show_instructions(window, INSTRUCTIONS_TEXT["test_block_end"], screen_info, 
                       remaining_blocks=remaining_blocks, block_performance=block_performance
                       )
 
     # Save the block data
+    if ADAPTIVE_PROCEDURE == "quest":
+        save_quest_data(participant_data, quest_data, block)
     save_block_data(participant_data, block_data, "test", block)
 
 
@@ -409,106 +450,22 @@ def test_phase(participant_data, block, window, full_screen, screen_info):
 def explicit_phase(participant_data, block, window, full_screen, screen_info):
     conditions = participant_data[f"conditions_explicit_{block}"]
     key_mapping = participant_data[f"keymapping_explicit_{block}"]
-    block_data = []
+    block_data = BlockRecorder("explicit", block, {**screen_info, "full_screen": full_screen}) # session-constant fields are stored once
+    preload = preload_phase("explicit", block, conditions, screen_info, window, key_mapping) # stimuli built while the instructions are read
 
-    # Instructions
-    if conditions[0]["modality"] == "auditory":
-        show_instructions(window, INSTRUCTIONS_TEXT["explicit_phase"], screen_info, modality_task="noticed that some sounds were also paired more frequently than others.", modality_verb="hear", modality="an auditory")
-    else: # visual
-        show_instructions(window, INSTRUCTIONS_TEXT["explicit_phase"], screen_info, modality_task="can remember the visual pairs that you learned at the start of the experiment.", modality_verb="see", modality="a visual")
+    # Instructions (auditory or visual pairs, from the modality of the block)
+    text, kwargs = block_instructions("explicit", block, participant_data)
+    show_instructions(window, text, screen_info, preload=preload, **kwargs)
+    prefetch_trial("explicit", block, conditions, 0, screen_info)
 
+    fixation_color = FIXATION_PARAMS["color"]  # in this phase there is no feedback so it won't be updated
     for i, trial in enumerate(conditions):
-        # Get trigger ids for the current trial type
-        if trial["modality"] == "auditory":
-            trial_type = f"explicit_{trial['a_trailing']}_{trial['a_pred']}"
-            context = f"Trial {i+1}, Block {block} (auditory), explicit phase" # context for trigger logs
-        else:
-            trial_type = f"explicit_{trial['v_trailing']}_{trial['v_pred']}"
-            context = f"Trial {i+1}, Block {block} (visual), explicit phase" # context for trigger logs
-        
-        if i == 0:
-            fixation_color = FIXATION_PARAMS["color"]  # set the fixation color. In subsequent trials, in this phase there is no feedback so it won't be updated
-        
-        trial_clock = Clock()  # This allows to init a clock to measure the RT
-        trial_clock.reset()
-        timestamp_dicts = {}
-        # Time up to milliseconds (4 digits of )
-        timestamp_dicts["start_trial_absolute"] = datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S.%f"
-        )
-
-        # ====== Inter trial interval ==========
-        iti_duration = random.uniform(*STIM_INFO["iti_range"])
-        interval = Interval(duration=iti_duration)  # This allows to init a time counter of duration
-        interval.reset()  # This allows to reset the time counter
-        draw_fixation(fixation_color, screen_info)  # draw the fixation dot with feedback color
-        window.flip()
-
-        send_trigger(f"{trial_type}_trial_start", context) # send trigger for the start of the triall
-
-        timestamp_dicts["start_fixation"] = trial_clock.time()
-        # ======= Leding stimuli ========
-        # pre-load stimuli
-        if trial["modality"] == "auditory":
-            leading_tone = create_puretone(
-                frequency=trial["a_leading"], duration=STIM_INFO["leading_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_leading"]]
-            )
-            draw_fixation(fixation_color, screen_info)
-        else:
-            draw_gabor(trial["v_leading"], screen_info)  # initiate the leading gabor,
-            draw_fixation(fixation_color, screen_info)
-        interval.wait()  
-
-        # presentation
-        if trial["modality"] == "auditory": leading_tone.play()  # play the leading tone only in auditory block
-        window.flip()  # Flips the window to show the pre-loaded gabor and fixation
-        send_trigger(f"{trial_type}_cue_onset", context) # send trigger for the leading stimulus
-        timestamp_dicts["start_leading"] = trial_clock.time()
-        window.wait(STIM_INFO["leading_duration"])  # Waits for the leading duration
-
-        # ======= ISI ========
-        interval = Interval(duration=STIM_INFO["isi_duration"])
-        interval.reset()
-
-        send_trigger(f"{trial_type}_isi", context) # send trigger for the ISI)
-        draw_fixation(fixation_color, screen_info)
-        window.flip()
-        
-        timestamp_dicts["start_isi"] = trial_clock.time()
-        # ======= Trailing stimuli ========
-        # pre-load stimuli
-        if trial["modality"] == "auditory":
-            draw_fixation(fixation_color, screen_info)
-            trailing_tone = create_puretone(
-                frequency=trial["a_trailing"], duration=STIM_INFO["target_duration"], amplitude=ISOTONIC_SOUNDS[trial["a_trailing"]]
-            )
-        else:
-            draw_gabor(trial["v_trailing"], screen_info)
-            draw_fixation(fixation_color, screen_info)
-        interval.wait()
-
-        # presentation
-        if trial["modality"] == "auditory": trailing_tone.play()  # play the leading tone only in auditory block
-        window.flip()
-        send_trigger(f"{trial_type}_target_onset", context) # send trigger for the trailing stimulus
-        timestamp_dicts["start_trailing"] = trial_clock.time()
-        window.wait(STIM_INFO["target_duration"])
-
-        # ======= Response ========
-        timestamp_dicts["start_response"] = trial_clock.time()
-        response = explicit_response(window, key_mapping, trial, f"{trial_type}_response", f"{trial_type}_confidence", context)
-        timestamp_dicts["end_trial"] = trial_clock.time()
-        block_data.append(
-            {
-                "num_trial": i,
-                "iti_duration": iti_duration,
-                **trial,
-                **response,
-                **timestamp_dicts,
-                **screen_info,
-                "full_screen": full_screen,
-            }
-        )
+        iti_duration = compensated_iti(random.uniform(*STIM_INFO["iti_range"])) # shortened after missed deadlines
+        stimuli = take_trial("explicit", block, conditions, i, screen_info)  # tones or images, prefetched during the previous trial
+        compiled = compile_trial("explicit", block, i, trial, stimuli, fixation_color, iti_duration, key_mapping, conditions, screen_info)
+        response, timestamps = run_trial(window, compiled)
+        block_data.append(trial_record(i, trial, iti_duration, response, timestamps))
+
     # Save the block data
     save_block_data(participant_data, block_data, "explicit", block)
 
@@ -517,11 +474,24 @@ def run_phase(phase, block, window, participant_data, full_screen, screen_info):
     """
     dispatcher function to run the different phases of the experiment
     """
-    if phase == "localizer":
-        localizer_phase(participant_data, block, window, full_screen, screen_info)
-    elif phase == "learning":
-        learning_phase(participant_data, block, window, full_screen, screen_info)
-    elif phase == "test":
-        test_phase(participant_data, block, window, full_screen, screen_info)
-    elif phase == "explicit":
-        explicit_phase(participant_data, block, window, full_screen, screen_info)
+    start_block_frames()
+    start_block_gc()
+    start_block_deadlines()
+    try:
+        with span(f"{phase}_phase", f"block {block}"):
+            if phase == "localizer":
+                localizer_phase(participant_data, block, window, full_screen, screen_info)
+            elif phase == "learning":
+                learning_phase(participant_data, block, window, full_screen, screen_info)
+            elif phase == "test":
+                test_phase(participant_data, block, window, full_screen, screen_info)
+            elif phase == "explicit":
+                explicit_phase(participant_data, block, window, full_screen, screen_info)
+    finally:
+        end_block_gc(phase, block) # the automatic collection is enabled again even if the block raised or was aborted
+    print_block_frame_summary(phase, block)
+    print_deadline_report(phase, block)
+    print_audio_stats(phase, block)
+    print_prefetch_stats(phase, block)
+    print_latency_stats(phase, block)
+    export_block_trace(participant_data["participant_id"], phase, block) # only if tracing is enabled
@@ -0,0 +1,97 @@
+"""
+Look-ahead preparation of the stimuli of the next trial.
+
+While trial i waits for its target duration and the response (up to 2 s in wait_key), a worker thread
+prepares the stimuli of trial i+1 from the condition list: tone samples and gabor images, which are
+only numpy work. The textures and sprites are still created on the main thread when the stimuli are
+drawn (OpenGL calls must stay on the thread of the window). The prepared stimuli are handed over
+through a one-slot buffer: take_prefetched returns them (waiting if they are not ready yet), or None
+if nothing was prefetched for that trial, in which case the phase prepares them itself.
+"""
+import logging
+import queue
+import threading
+from time import perf_counter
+
+from experiment.tracing import span
+
+PREFETCHER = None # Global prefetch worker, started on first use
+PREFETCHER_LOCK = threading.Lock() # get_prefetcher is called from the startup thread too
+
+
+class Prefetcher:
+    """Worker thread preparing one trial ahead."""
+    def __init__(self):
+        self.jobs = queue.Queue(maxsize=1)
+        self.slot = queue.Queue(maxsize=1) # prepared stimuli of the next trial
+        self.pending = None # key of the job submitted and not taken yet
+        self.reset_stats()
+        self.thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self.thread.start()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.waits = [] # time spent waiting for a job still running (s)
+
+    def _run(self):
+        while True:
+            key, func, args = self.jobs.get()
+            try:
+                with span("prefetch", key):
+                    result = func(*args)
+            except Exception as e: # the phase prepares the stimuli itself
+                print(f"Prefetch of {key} failed: {e}")
+                logging.exception(f"Prefetch of {key} failed")
+                result = None
+            self.slot.put((key, result))
+
+    def submit(self, key, func, *args):
+        if self.pending is not None: # not taken (e.g. block interrupted), free the slot
+            self.take(self.pending)
+        self.pending = key
+        self.jobs.put((key, func, args))
+
+    def take(self, key):
+        if self.pending != key:
+            self.misses += 1
+            return None
+        self.pending = None
+        start = perf_counter()
+        _, result = self.slot.get()
+        self.waits.append(perf_counter() - start)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+
+def get_prefetcher():
+    """Get the prefetch worker, starting it on first use."""
+    global PREFETCHER
+    if PREFETCHER is None:
+        with PREFETCHER_LOCK:
+            if PREFETCHER is None:
+                PREFETCHER = Prefetcher()
+    return PREFETCHER
+
+
+def prefetch(key, func, *args):
+    """Run func(*args) on the prefetch worker, the result is taken with take_prefetched(key)."""
+    get_prefetcher().submit(key, func, *args)
+
+
+def take_prefetched(key):
+    """Result of the job submitted with key, or None if there is none."""
+    return get_prefetcher().take(key)
+
+
+def print_prefetch_stats(phase, block):
+    if PREFETCHER is None:
+        return
+    waits = PREFETCHER.waits
+    max_wait = max(waits) * 1000 if waits else 0.0
+    print(f"Prefetch {phase} block {block}: {PREFETCHER.hits} trials prefetched, {PREFETCHER.misses} prepared in the ITI, "
+          f"max wait {max_wait:.2f} ms")
+    PREFETCHER.reset_stats()
@@ -0,0 +1,87 @@
+"""
+Preload of the unique stimuli of a block while its instructions are shown.
+
+Each phase lists the unique assets of its condition list (gabor sprites, tones, localizer tone sequences)
+with an estimate of their size, and show_instructions builds them one by one between polls of the
+keyboard (preload_block is a generator, one asset per step), so the participant reading the instructions
+does not wait for them. The textures are created on the main thread, as required by OpenGL. Whatever is
+left when the instructions end is built before the first trial, and the block is then fully cached.
+Assets that do not fit in PRELOAD_PARAMS["memory_budget_mb"] are skipped and prepared trial by trial
+(see prefetch.py). A readiness report is printed and logged when the block is ready.
+"""
+import logging
+from time import perf_counter
+
+from experiment.constants import PRELOAD_PARAMS
+
+BLOCK_CACHE = None # Global cache of the stimuli of the current block
+
+
+class BlockCache:
+    """Assets of one block, within a memory budget."""
+    def __init__(self, phase, block, budget_mb=PRELOAD_PARAMS["memory_budget_mb"]):
+        self.phase = phase
+        self.block = block
+        self.budget = budget_mb * 2**20
+        self.assets = {} # key -> asset
+        self.nbytes = 0
+        self.skipped = 0 # assets over the budget
+        self.ready = False
+
+    def add(self, key, nbytes, build, *args):
+        """Build and keep the asset if it fits in the budget. Returns False otherwise."""
+        if self.nbytes + nbytes > self.budget:
+            self.skipped += 1
+            return False
+        self.assets[key] = build(*args)
+        self.nbytes += nbytes
+        return True
+
+    def get(self, key):
+        return self.assets.get(key)
+
+
+def preload_block(phase, block, assets):
+    """
+    Generator building the assets of a block, one per step: {key: (nbytes, build, args)}.
+    Replaces the cache of the previous block.
+    """
+    global BLOCK_CACHE
+    BLOCK_CACHE = BlockCache(phase, block)
+    duration = 0.0 # time spent building, not waiting between steps
+    for key, (nbytes, build, args) in assets.items():
+        start = perf_counter()
+        BLOCK_CACHE.add(key, nbytes, build, *args)
+        duration += perf_counter() - start
+        yield key
+    BLOCK_CACHE.ready = True
+    report_block_cache(duration)
+
+
+def finish_preload(steps):
+    """Build the assets left when the instructions end, before the first trial. Returns the time it took (s)."""
+    start = perf_counter()
+    left = sum(1 for _ in steps)
+    duration = perf_counter() - start
+    if left:
+        message = f"Preload {BLOCK_CACHE.phase} block {BLOCK_CACHE.block}: {left} stimuli built after the instructions ({duration:.2f} s)"
+        print(message)
+        logging.info(message)
+    return duration
+
+
+def cached(key):
+    """Asset preloaded for the current block, or None."""
+    if BLOCK_CACHE is None:
+        return None
+    return BLOCK_CACHE.get(key)
+
+
+def report_block_cache(duration):
+    cache = BLOCK_CACHE
+    message = (f"Preload {cache.phase} block {cache.block}: {len(cache.assets)} stimuli cached in {duration:.2f} s, "
+               f"{cache.nbytes / 2**20:.1f} of {cache.budget / 2**20:.0f} MB")
+    if cache.skipped:
+        message += f", {cache.skipped} over the budget (prepared trial by trial)"
+    print(message)
+    logging.info(message)
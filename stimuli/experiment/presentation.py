@@ -1,27 +1,76 @@
 import numpy as np
 from experiment.constants import (COLOR, GABOR_PARAMS,
                                   INSTRUCTIONS_FONT_SIZE, FIXATION_PARAMS)
-from psychos.sound import FlatEnvelope, Sine
-from psychos.visual import Gabor, RawImage, Text, Circle, Rectangle
+from psychos.visual import RawImage, Text, Circle, Rectangle
 from psychos.visual.synthetic import gabor_3d
+from pyglet.image import ImageData
+from experiment.audio import ScheduledTone, ToneSequence
+from experiment.preload import finish_preload
+from experiment.tracing import traced
 
 
-def show_instructions(window, text, screen_info=None, **kwargs):
+POLL_WAIT = 0.001 # s, keyboard polls between preload steps
+
+PAGES = {} # Global cache of the instruction pages: (text, position) -> laid out Text widget
+
+
+def instruction_page(text, screen_info=None):
+    """Text widget of an instruction page, laid out the first time and reused afterwards."""
+    position = (screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] / 2) if screen_info else None
+    text_widget = PAGES.get((text, position))
+    if text_widget is None:
+        text_widget = Text(font_size=INSTRUCTIONS_FONT_SIZE, color=COLOR)
+        if position is not None:
+            text_widget.position = position
+        text_widget.text = text
+        PAGES[(text, position)] = text_widget
+    return text_widget
+
+
+def prepare_instructions(text, screen_info=None, **kwargs):
+    """
+    Lay out the instruction pages in advance. Pages with placeholders missing from kwargs
+    (e.g. a performance not known yet) are left for show_instructions.
+    """
+    if isinstance(text, str):
+        text = [text]
+    for line in text:
+        try:
+            instruction_page(line.format(**kwargs), screen_info)
+        except KeyError:
+            continue
+
+
+def wait_space(window, steps=None):
+    """Wait for SPACE, running the preload steps (see preload.py) between polls of the keyboard."""
+    clear_events = True
+    if steps is not None:
+        for _ in steps:
+            if window.wait_key(["SPACE"], max_wait=POLL_WAIT, clear_events=clear_events).key is not None:
+                return
+            clear_events = False # a press during a step is still in the event queue
+    window.wait_key(["SPACE"], clear_events=clear_events)
+
+
+@traced("show_instructions")
+def show_instructions(window, text, screen_info=None, preload=None, **kwargs):
+    """
+    Show the instruction pages, each until SPACE is pressed. preload is a generator of preload steps
+    (preload.preload_block), built while the pages are read and finished before returning.
+    """
     if isinstance(text, str):
         text = [text]
 
     # format the text if it contains placeholders
     text = [line.format(**kwargs) for line in text]
 
-    text_widget = Text(font_size=INSTRUCTIONS_FONT_SIZE, color=COLOR)
-    if screen_info:
-        text_widget.position = (screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] / 2)
-
     for line in text:
-        text_widget.text = line
-        text_widget.draw()
+        instruction_page(line, screen_info).draw() # laid out by prepare_instructions, or now
         window.flip()
-        window.wait_key(["SPACE"])
+        wait_space(window, preload)
+
+    if preload is not None:
+        finish_preload(preload)
 
 
 def visual_angle_to_pixels(angle_deg, distance_cm, screen_width_cm, screen_width_px, sf=None):
@@ -52,7 +101,8 @@ def visual_angle_to_pixels(angle_deg, distance_cm, screen_width_cm, screen_width
 
     return int(round(size_px)), spatial_frequency
 
-def generate_neutral_gabor(screen_info, luminance_gain=1.0):
+def neutral_gabor_image(screen_info, luminance_gain=1.0):
+    """Image of the neutral plaid (average of a 0 and a 90 degrees gabor), as uint8 RGBA."""
     if GABOR_PARAMS["units"] == "deg":
         size, spatial_frequency = visual_angle_to_pixels(
             GABOR_PARAMS["size"], screen_info["distance_cm"], screen_info["screen_width_cm"], screen_info["screen_width_px"]
@@ -74,8 +124,19 @@ def generate_neutral_gabor(screen_info, luminance_gain=1.0):
 
     data_neutral = data_neutral.astype("uint8")
     #print("Mean luminance - G0:", np.mean(data_0), "Neutral:", np.mean(data_neutral))
+    return data_neutral
+
+
+def generate_neutral_gabor(screen_info, luminance_gain=1.0):
+    if GABOR_PARAMS["units"] == "deg":
+        size, _ = visual_angle_to_pixels(
+            GABOR_PARAMS["size"], screen_info["distance_cm"], screen_info["screen_width_cm"], screen_info["screen_width_px"]
+            )
+    else:
+        size = 256 # default to percentage of screen width
+
     image = RawImage(
-        raw_image=data_neutral,
+        raw_image=neutral_gabor_image(screen_info, luminance_gain),
         width=size,
         height=size,
         position=(screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] / 2)
@@ -84,43 +145,81 @@ def generate_neutral_gabor(screen_info, luminance_gain=1.0):
     return image 
 
 
-
-def draw_gabor(orientation, screen_info, contrast=None, spatial_frequency=None, **kwargs):
+@traced("gabor_image")
+def gabor_image(orientation, screen_info, contrast=None, spatial_frequency=None, **kwargs):
     """
-    Draw a Gabor patch on the screen.
-    :param orientation: Orientation of the Gabor in degrees.
-    :param screen_info: Dictionary containing screen information (distance, width, etc.).
-    :param contrast: Contrast of the Gabor. If None, it will use the default from GABOR_PARAMS.
-    :param spatial_frequency: Spatial frequency of the Gabor. If None, it will use the default from GABOR_PARAMS.
+    Image of a Gabor patch (or of the neutral plaid for "neutralV"), as drawn by draw_gabor.
+    Only numpy work, so it can be prepared on a worker thread (see prefetch.py).
     """
+    if orientation == "neutralV":
+        return neutral_gabor_image(screen_info, **kwargs)
 
     if contrast is None:
         contrast = GABOR_PARAMS["contrast"]
 
     if GABOR_PARAMS["units"] == "deg":
-        size, spatial_frequency = visual_angle_to_pixels(
+        _, spatial_frequency = visual_angle_to_pixels(
             GABOR_PARAMS["size"], screen_info["distance_cm"], screen_info["screen_width_cm"], screen_info["screen_width_px"], spatial_frequency
             )
     else:
-        size = "50vw" # default to percentage of screen width
         spatial_frequency = 20  # Adjust spatial frequency based on size
 
-    if orientation == "neutralV":
-        image = generate_neutral_gabor(screen_info, **kwargs)
-        image.draw()
-
-    else:  # gabor
-        image = Gabor(
-            orientation=orientation,
-            width=size,
-            height=size,
-            spatial_frequency=spatial_frequency,
-            contrast=contrast,
-        )
-
-        image.position = (screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] / 2)
-        image.draw()
+    # same image as psychos Gabor (256x256, scaled to the size when drawn)
+    return (255 * gabor_3d(size=(256, 256), orientation=orientation, spatial_frequency=spatial_frequency, contrast=contrast)).astype(int)
+
+
+def image_data(image):
+    """pyglet ImageData of an RGBA image array, the same bytes RawImage would build pixel by pixel."""
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width, channels = image.shape
+    return ImageData(width, height, "RGBA" if channels == 4 else "RGB", image.tobytes())
+
+
+@traced("gabor_sprite")
+def gabor_sprite(image, screen_info, orientation=None):
+    """
+    Sprite of a gabor image at the center of the screen. The texture is created here, so it must be
+    called on the main thread (OpenGL).
+    """
+    if GABOR_PARAMS["units"] == "deg":
+        size, _ = visual_angle_to_pixels(
+            GABOR_PARAMS["size"], screen_info["distance_cm"], screen_info["screen_width_cm"], screen_info["screen_width_px"]
+            )
+    elif orientation == "neutralV":
+        size = 256 # as generate_neutral_gabor
+    else:
+        size = "50vw" # default to percentage of screen width
+
+    return RawImage(
+        raw_image=image_data(image),
+        width=size,
+        height=size,
+        position=(screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] / 2),
+    )
+
+
+def create_gabor(orientation, screen_info, spatial_frequency=None):
+    """Sprite of a Gabor patch, drawn later with draw_gabor(..., image=sprite) (e.g. preloaded for a block)."""
+    return gabor_sprite(gabor_image(orientation, screen_info, spatial_frequency=spatial_frequency), screen_info, orientation)
+
+
+@traced("draw_gabor")
+def draw_gabor(orientation, screen_info, contrast=None, spatial_frequency=None, image=None, **kwargs):
+    """
+    Draw a Gabor patch on the screen.
+    :param orientation: Orientation of the Gabor in degrees.
+    :param screen_info: Dictionary containing screen information (distance, width, etc.).
+    :param contrast: Contrast of the Gabor. If None, it will use the default from GABOR_PARAMS.
+    :param spatial_frequency: Spatial frequency of the Gabor. If None, it will use the default from GABOR_PARAMS.
+    :param image: Image from gabor_image if it was prepared in advance, or sprite preloaded for the block (preload.py).
+    """
+    if image is None:
+        image = gabor_image(orientation, screen_info, contrast, spatial_frequency, **kwargs)
+
+    sprite = image if hasattr(image, "draw") else gabor_sprite(image, screen_info, orientation)
+    sprite.draw()
         
+@traced("draw_fixation")
 def draw_fixation(fixation_color, screen_info, radius=FIXATION_PARAMS["radius"]):
     """
     Draw a fixation dot on the screen.
@@ -147,19 +246,30 @@ def draw_white_square(screen_info, size=1):
     square.position = (screen_info["screen_width_px"] / 2, screen_info["screen_height_px"] * 0.1)
     square.draw()
 
+@traced("create_puretone")
 def create_puretone(frequency, duration=0.5, amplitude=1):
     """
     Create a puretone sound stimulus.
     :param frequency: Frequency of the puretone in Hz.
     :param duration: Duration of the puretone in seconds.
-    :return: A Sine object representing the puretone.
+    :return: A ScheduledTone, started with play_at(onset) to be heard at a flip.
     """
-    envelope = FlatEnvelope(
-        amplitude=amplitude,
-    )
-    puretone = Sine(
-        duration=duration,
+    puretone = ScheduledTone(
         frequency=int(frequency),
-        envelope=envelope,
+        duration=duration,
+        amplitude=amplitude,
     )
     return puretone
+
+
+@traced("create_tone_sequence")
+def create_tone_sequence(frequencies, amplitudes, tone_duration, interval):
+    """
+    Create one sound with a sequence of puretones.
+    :param frequencies: Frequency of each puretone in Hz.
+    :param amplitudes: Amplitude of each puretone (0 for silence).
+    :param tone_duration: Duration of each puretone in seconds.
+    :param interval: Time between the onsets of consecutive puretones in seconds.
+    :return: A ToneSequence, started with play_at(onset) to hear the first puretone at a flip.
+    """
+    return ToneSequence(frequencies, amplitudes, tone_duration, interval)
@@ -0,0 +1,126 @@
+"""
+QUEST+-style Bayesian adaptive procedure for the test phase (alternative to responses.staircase,
+selected with ADAPTIVE_PROCEDURE in constants).
+
+A posterior is kept over the threshold and slope of a Weibull psychometric function. The
+probability of a correct response for every allowed ori_diff and every (threshold, slope) pair is
+precomputed once, so a trial only needs a few small array operations: the posterior update, and the
+choice of the next ori_diff as the one that minimizes the expected entropy of the posterior.
+The posterior is saved at the end of every test block and loaded at the start of the next one.
+"""
+import os
+
+import numpy as np
+
+from experiment.constants import DATA_FOLDER, QUEST_PARAMS, STAIRCASE_PARAMS
+from experiment.io_worker import drain, get_data_writer
+
+TABLES = None # Global variable for lazy initialization of the likelihood tables
+
+
+class QuestTables:
+    """Stimulus and parameter grids with the precomputed likelihood of a correct response."""
+    def __init__(self, params=QUEST_PARAMS, max_diff=STAIRCASE_PARAMS["max_diff"]):
+        step = params["ori_diff_step"]
+        self.ori_diffs = np.arange(step, max_diff + step / 2, step) # allowed ori_diff values
+        thresholds = np.arange(*params["threshold_range"])
+        slopes = np.asarray(params["slopes"], dtype=np.float64)
+        self.alpha, self.beta = (grid.ravel() for grid in np.meshgrid(thresholds, slopes, indexing="ij"))
+
+        guess, lapse = params["guess"], params["lapse"]
+        x = self.ori_diffs[:, None] / self.alpha[None, :]
+        self.p_correct = guess + (1 - guess - lapse) * (1 - np.exp(-x ** self.beta[None, :])) # (n_ori_diffs, n_params)
+        self.p_incorrect = 1 - self.p_correct
+
+        # ori_diff at target_p correct for every parameter pair, to report the threshold estimate
+        self.threshold_at_target = self.alpha * (-np.log(1 - (params["target_p"] - guess) / (1 - guess - lapse))) ** (1 / self.beta)
+        self.prior = np.full(self.alpha.size, 1 / self.alpha.size)
+
+
+def get_quest_tables():
+    """Get the likelihood tables, computing them on first use."""
+    global TABLES
+    if TABLES is None:
+        TABLES = QuestTables()
+    return TABLES
+
+
+def _entropy(p):
+    """Entropy of each row of p (rows need not be normalized, the result is for the normalized rows)."""
+    total = p.sum(axis=-1)
+    plogp = np.where(p > 0, p * np.log(np.where(p > 0, p, 1)), 0).sum(axis=-1)
+    return np.log(total) - plogp / total
+
+
+def next_ori_diff(posterior, tables=None):
+    """Allowed ori_diff that minimizes the expected entropy of the posterior after the next response."""
+    tables = tables or get_quest_tables()
+    joint_correct = tables.p_correct * posterior
+    joint_incorrect = tables.p_incorrect * posterior
+    p_correct = joint_correct.sum(axis=1)
+    expected_entropy = p_correct * _entropy(joint_correct) + (1 - p_correct) * _entropy(joint_incorrect)
+    return float(tables.ori_diffs[np.argmin(expected_entropy)])
+
+
+def quest_summary(posterior, tables=None):
+    """Posterior mean and SD of the threshold (ori_diff at target_p correct) and mean slope."""
+    tables = tables or get_quest_tables()
+    threshold = float(posterior @ tables.threshold_at_target)
+    return {
+        "threshold_mean": threshold,
+        "threshold_sd": float(np.sqrt(posterior @ (tables.threshold_at_target - threshold) ** 2)),
+        "slope_mean": float(posterior @ tables.beta),
+    }
+
+
+def new_quest():
+    """Initial quest_data: the prior and the first ori_diff to test."""
+    tables = get_quest_tables()
+    posterior = tables.prior.copy()
+    return {"posterior": posterior, "ori_diff": next_ori_diff(posterior, tables), "n_updates": 0, **quest_summary(posterior, tables)}
+
+
+def quest(last_outcome, posterior, ori_diff, n_updates, **kwargs):
+    """
+    Update the posterior with the outcome (0 or 1) of a target trial presented at ori_diff,
+    and choose the ori_diff of the next target trial.
+    Takes and returns quest_data dicts, like responses.staircase does with staircase_data.
+    """
+    tables = get_quest_tables()
+    index = np.searchsorted(tables.ori_diffs, ori_diff) # ori_diff always comes from the grid
+    likelihood = tables.p_correct[index] if last_outcome == 1 else tables.p_incorrect[index]
+    posterior = posterior * likelihood
+    posterior /= posterior.sum()
+    return {"posterior": posterior, "ori_diff": next_ori_diff(posterior, tables), "n_updates": n_updates + 1, **quest_summary(posterior, tables)}
+
+
+def quest_record(quest_data):
+    """Fields of quest_data stored in the trial records (everything but the posterior)."""
+    return {key: value for key, value in quest_data.items() if key != "posterior"}
+
+
+def quest_data_path(participant_id, block):
+    return f"{DATA_FOLDER}/{participant_id}/test_block{block}_quest.npz"
+
+
+def save_quest_data(participant_data, quest_data, block):
+    """Save the posterior at the end of a test block (written by the I/O worker)."""
+    path = quest_data_path(participant_data["participant_id"], block)
+    get_data_writer().submit(np.savez, path, posterior=quest_data["posterior"], n_updates=quest_data["n_updates"])
+
+
+def load_last_quest_data(participant_data, block):
+    """Loads the posterior saved at the end of the previous test block."""
+    drain()  # the previous block may still be queued for writing
+    filepath = quest_data_path(participant_data["participant_id"], block - 1)
+
+    if os.path.exists(filepath):
+        with np.load(filepath) as data:
+            posterior = data["posterior"]
+            n_updates = int(data["n_updates"])
+        tables = get_quest_tables()
+        if posterior.shape != tables.prior.shape:
+            raise ValueError(f"Posterior in {filepath} does not match the current QUEST_PARAMS grids")
+        return {"posterior": posterior, "ori_diff": next_ori_diff(posterior, tables), "n_updates": n_updates, **quest_summary(posterior, tables)}
+    else:
+        raise FileNotFoundError(f"No previous quest data found at: {filepath}")
@@ -0,0 +1,160 @@
+"""
+Opt-in real-time process mode on Linux (REALTIME or main.py --realtime).
+
+enable_realtime is called once at startup, after the audio engine and the worker threads are started:
+- CPU affinity: the presentation (main) thread gets the last available core, the I/O worker and the
+  prefetch worker the one before, and the other threads (pyglet audio, ...) the remaining cores, so
+  the busy waits of the presentation thread (triggers, keyboard) do not compete with them.
+  Threads started later inherit the affinity (and scheduling) of the thread that starts them.
+- Scheduling: SCHED_FIFO or SCHED_RR for the presentation thread where permitted (CAP_SYS_NICE or an
+  rtprio limit), otherwise a nice boost, otherwise nothing.
+- Memory: mlockall, so no page of the process is swapped out. With MCL_FUTURE every later allocation
+  must also fit in RLIMIT_MEMLOCK, or it fails, so the mode depends on the limit: MCL_CURRENT |
+  MCL_FUTURE if the resident memory plus PRELOAD_PARAMS["memory_budget_mb"] fits, MCL_CURRENT only if
+  the resident memory fits, otherwise no lock.
+What was actually granted is printed and logged.
+
+The wake-up latency of the presentation thread (how late it resumes after the waits of
+frames.wait_screen, measured in any mode) is reported at the end of every block.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import resource
+import sys
+import threading
+
+import numpy as np
+
+from experiment.constants import PRELOAD_PARAMS, REALTIME_PARAMS
+from experiment.io_worker import get_data_writer
+from experiment.prefetch import get_prefetcher
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+WORKER_THREADS = ("io-worker", "prefetch")
+
+WAKEUPS = [] # Global list of the wake-up latencies of the current block (s)
+
+
+def core_assignment(cores):
+    """Cores of the presentation thread, the workers and the other threads, or None if there are fewer than 3."""
+    cores = sorted(cores)
+    if len(cores) < 3:
+        return None
+    return {"presentation": {cores[-1]}, "workers": {cores[-2]}, "other": set(cores[:-2])}
+
+
+def pin_threads(assignment):
+    """Set the affinity of every running thread. Returns {thread name: cores}."""
+    pinned = {}
+    for thread in threading.enumerate():
+        if thread is threading.main_thread():
+            cores = assignment["presentation"]
+        elif thread.name in WORKER_THREADS:
+            cores = assignment["workers"]
+        else:
+            cores = assignment["other"]
+        try:
+            os.sched_setaffinity(thread.native_id, cores)
+            pinned[thread.name] = sorted(cores)
+        except OSError as e:
+            pinned[thread.name] = f"not pinned ({e.strerror})"
+    return pinned
+
+
+def boost_priority(policy, priority, nice):
+    """Real-time scheduling of the calling thread, or a nice boost. Returns what was granted."""
+    policy_id = os.SCHED_FIFO if policy == "fifo" else os.SCHED_RR
+    try:
+        os.sched_setscheduler(0, policy_id, os.sched_param(priority))
+        return f"SCHED_{policy.upper()} priority {priority}"
+    except OSError as e:
+        denied = e.strerror
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+        return f"nice {nice} (SCHED_{policy.upper()} denied: {denied})"
+    except OSError as e:
+        return f"none (SCHED_{policy.upper()} denied: {denied}, nice {nice} denied: {e.strerror})"
+
+
+def memlock_limit():
+    """Bytes that the process may lock (RLIMIT_MEMLOCK soft limit), None if unlimited."""
+    if os.geteuid() == 0: # CAP_IPC_LOCK, the limit does not apply
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+def resident_memory():
+    """Resident memory of the process (bytes)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def memory_lock_mode(limit, resident, budget_mb):
+    """mlockall flags (None: no lock) and description for a RLIMIT_MEMLOCK limit (None: unlimited) and a resident size (bytes)."""
+    needed = resident + budget_mb * 2**20
+    if limit is None or limit >= needed:
+        return MCL_CURRENT | MCL_FUTURE, "current and future pages"
+    if limit >= resident:
+        return MCL_CURRENT, f"current pages only (RLIMIT_MEMLOCK {limit / 2**20:.0f} MB < {needed / 2**20:.0f} MB with the preload budget)"
+    return None, f"RLIMIT_MEMLOCK {limit / 2**20:.0f} MB < {resident / 2**20:.0f} MB resident"
+
+
+def lock_memory(budget_mb=PRELOAD_PARAMS["memory_budget_mb"]):
+    """
+    mlockall the pages of the process, with a mode that fits in RLIMIT_MEMLOCK: the current and future
+    pages if the resident memory plus the preload budget fit, only the current ones if the resident
+    memory fits, otherwise nothing. Returns what was granted.
+    """
+    flags, mode = memory_lock_mode(memlock_limit(), resident_memory(), budget_mb)
+    if flags is None:
+        granted = f"not locked ({mode})"
+    else:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.mlockall(flags) != 0:
+            granted = f"not locked ({os.strerror(ctypes.get_errno())}, requested {mode})"
+        else:
+            granted = f"locked, {mode}"
+    logging.info(f"Memory lock: {granted}")
+    return granted
+
+
+def enable_realtime(params=REALTIME_PARAMS):
+    """Pin the threads, raise the priority of the presentation thread and lock the memory. Returns the report."""
+    if not sys.platform.startswith("linux"):
+        print("Real-time mode is only available on Linux")
+        return None
+
+    get_data_writer() # the workers are started now, to be pinned
+    get_prefetcher()
+
+    report = {}
+    assignment = core_assignment(os.sched_getaffinity(0))
+    report["affinity"] = pin_threads(assignment) if assignment else f"not pinned ({len(os.sched_getaffinity(0))} cores)"
+    report["scheduling"] = boost_priority(params["policy"], params["priority"], params["nice"])
+    report["memory"] = lock_memory() if params["lock_memory"] else "not requested"
+
+    print(f"Real-time mode: scheduling {report['scheduling']}, memory {report['memory']}")
+    print(f"Real-time mode: affinity {report['affinity']}")
+    logging.info(f"Real-time mode: {report}")
+    return report
+
+
+def record_wakeup(latency):
+    """Wake-up latency of the presentation thread (s), see frames.wait_screen."""
+    WAKEUPS.append(latency)
+
+
+def print_latency_stats(phase, block):
+    if not WAKEUPS:
+        return
+    latencies = np.array(WAKEUPS) * 1000
+    message = (f"Wake-up latency {phase} block {block}: median {np.median(latencies):.3f} ms, "
+               f"p99 {np.percentile(latencies, 99):.3f} ms, max {latencies.max():.3f} ms ({latencies.size} waits)")
+    print(message)
+    logging.info(message)
+    WAKEUPS.clear()
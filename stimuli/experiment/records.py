@@ -0,0 +1,207 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from experiment.constants import DATA_FOLDER
+from experiment.tracing import traced
+
+
+class BlockRecorder:
+    """
+    Column-oriented store for the trial records of one block.
+    Each field of the trial records is kept as its own column, and fields that are constant for
+    the whole session (screen info, full screen...) are stored only once as block metadata.
+    Iterating over the recorder yields the usual dict-per-trial view.
+    """
+    __slots__ = ("phase", "block", "metadata", "columns", "n_trials")
+
+    def __init__(self, phase, block, metadata=None):
+        """
+        :param phase: Name of the phase (localizer, learning, test, explicit).
+        :param block: Block number.
+        :param metadata: Dictionary of session-constant fields merged into every trial in the dict view.
+        """
+        self.phase = phase
+        self.block = block
+        self.metadata = dict(metadata or {})
+        self.columns = {}  # field name -> list of values, one per trial
+        self.n_trials = 0
+
+    @traced("record_append")
+    def append(self, record):
+        """Add the record (dict) of one trial. Fields not seen before are backfilled with None."""
+        for name, column in self.columns.items():
+            if name not in record:
+                column.append(None)
+        for name, value in record.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * self.n_trials  # new field, backfill previous trials
+            column.append(value)
+        self.n_trials += 1
+
+    def column(self, name):
+        """Return the values of a field for all trials."""
+        return self.columns[name]
+
+    def row(self, index):
+        """Return the dict view of a single trial, including the block metadata."""
+        record = {name: column[index] for name, column in self.columns.items()}
+        record.update(self.metadata)
+        return record
+
+    def __len__(self):
+        return self.n_trials
+
+    def __iter__(self):
+        for index in range(self.n_trials):
+            yield self.row(index)
+
+    def to_arrays(self):
+        """
+        Convert the columns to typed numpy arrays.
+        Returns the arrays and a description of how to read them back into the dict view.
+        """
+        arrays = {}
+        json_columns = []
+        list_columns = []
+        for name, values in self.columns.items():
+            array, kind = _column_to_array(values)
+            arrays[name] = array
+            if kind == "json":
+                json_columns.append(name)
+            elif kind == "list":
+                list_columns.append(name)
+
+        layout = {
+            "phase": self.phase,
+            "block": self.block,
+            "n_trials": self.n_trials,
+            "columns": list(self.columns),
+            "json_columns": json_columns,
+            "list_columns": list_columns,
+            "metadata": self.metadata,
+        }
+        return arrays, layout
+
+    def to_npz(self, path):
+        """Save the block as a compressed .npz file (one array per column plus the metadata)."""
+        arrays, layout = self.to_arrays()
+        np.savez_compressed(
+            path,
+            __layout__=np.array(json.dumps(layout)),
+            **{f"col_{name}": array for name, array in arrays.items()},
+        )
+
+    def to_csv(self, path):
+        """Export the trial columns as a csv file. Lists and None values are written as JSON."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for index in range(self.n_trials):
+                writer.writerow(_csv_value(column[index]) for column in self.columns.values())
+
+
+def _column_to_array(values):
+    """
+    Pick the most compact array type that gives back the same python values.
+    Returns the array and its kind: "plain", "list" (equal length lists, stored as 2D) or "json".
+    """
+    types = {type(value) for value in values}
+
+    if types == {bool}:
+        return np.array(values, dtype=np.bool_), "plain"
+    if types == {int}:
+        return np.array(values, dtype=np.int64), "plain"
+    if types == {float}:
+        return np.array(values, dtype=np.float64), "plain"
+    if types == {str}:
+        return np.array(values, dtype=np.str_), "plain"
+
+    if types == {list} and len({len(value) for value in values}) == 1:
+        array = np.array(values)
+        item_types = {type(item) for value in values for item in value}
+        if len(item_types) == 1 and array.dtype.kind in "biufU":
+            return array, "list"
+
+    # Mixed types or missing values (e.g. "neutralV" among orientations, None on timeouts)
+    return np.array([json.dumps(value) for value in values], dtype=np.str_), "json"
+
+
+def _csv_value(value):
+    if value is None or isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def iter_block_records(path):
+    """
+    Load a block saved with BlockRecorder.to_npz and yield one dict per trial,
+    with the same fields as the records built in the phase functions.
+    Blocks saved by earlier versions as a json list of trials (legacy_block_path) are read as is.
+    """
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            yield from json.load(f)
+        return
+
+    with np.load(path, allow_pickle=False) as data:
+        layout = json.loads(str(data["__layout__"]))
+        json_columns = set(layout["json_columns"])
+
+        columns = {}
+        for name in layout["columns"]:
+            values = data[f"col_{name}"].tolist()  # tolist gives back python scalars and lists
+            if name in json_columns:
+                values = [json.loads(value) for value in values]
+            columns[name] = values
+
+    metadata = layout["metadata"]
+    for index in range(layout["n_trials"]):
+        record = {name: values[index] for name, values in columns.items()}
+        record.update(metadata)
+        yield record
+
+
+def load_block_records(path):
+    """Load a saved block as a list of dicts, one per trial."""
+    return list(iter_block_records(path))
+
+
+def block_data_path(participant_id, phase, block, run=None):
+    """
+    Path of the file holding the data of a block.
+    If run is None, returns the path of the most recent run of the block (or the first one if
+    the block has not been saved yet). A block saved only by earlier versions, as json, is
+    returned as its json file, so sessions started before the .npz format can be resumed.
+    """
+    folder = f"{DATA_FOLDER}/{participant_id}"
+    if run is None:
+        legacy_path = legacy_block_path(participant_id, phase, block)
+        if not os.path.exists(_run_path(folder, phase, block, 1)) and os.path.exists(legacy_path):
+            return legacy_path
+        run = 1
+        while os.path.exists(_run_path(folder, phase, block, run + 1)):
+            run += 1
+    return _run_path(folder, phase, block, run)
+
+
+def legacy_block_path(participant_id, phase, block):
+    """Path of a block saved by earlier versions: one json list with the trials of every run appended."""
+    return f"{DATA_FOLDER}/{participant_id}/{phase}_block{block}.json"
+
+
+def next_block_data_path(participant_id, phase, block):
+    """Path for saving a block without overwriting previous runs of the same block."""
+    folder = f"{DATA_FOLDER}/{participant_id}"
+    run = 1
+    while os.path.exists(_run_path(folder, phase, block, run)):
+        run += 1
+    return _run_path(folder, phase, block, run)
+
+
+def _run_path(folder, phase, block, run):
+    suffix = "" if run == 1 else f"_run{run}"
+    return f"{folder}/{phase}_block{block}{suffix}.npz"
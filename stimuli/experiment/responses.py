@@ -1,24 +1,77 @@
+import copy
 import json
 import os
 
 from experiment.constants import COLOR, RESPONSE_FONT_SIZE, DATA_FOLDER
+from experiment.io_worker import drain, get_data_writer
+from experiment.keyboard import wait_response
+from experiment.records import (block_data_path, load_block_records,
+                                next_block_data_path)
+from experiment.tracing import traced
 from experiment.triggers import send_trigger
 from psychos.core import Clock, Interval
 from psychos.visual import Text
 
+PROMPTS = {} # Global cache of the response screens: prompt -> Text widgets, laid out once
 
-def localizer_response(window, target_modality, target_count, context):
-    text_widget = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position = (window.width / 2, window.height / 2))
+# Prompts are tuples of (text, x, y), positions in fractions of the window size
+CONFIDENCE_PROMPT = (
+    ("How confident are you in your response?", 0.5, 0.6),
+    ("1: not at all", 0.3, 0.4),
+    ("2: a little", 0.4, 0.4),
+    ("3: moderately", 0.5, 0.4),
+    ("4: very", 0.6, 0.4),
+    ("5: completely", 0.7, 0.4),
+)
+
+
+def localizer_prompt(target_modality):
     if target_modality == "visual":
-        text_widget.text = f"How many targets did you see?"
+        return (("How many targets did you see?", 0.5, 0.5),)
     else: # target_modality == "auditory":
-        text_widget.text = f"How many weaker sounds did you hear?"
+        return (("How many weaker sounds did you hear?", 0.5, 0.5),)
+
+
+def learning_prompt(key_mapping):
+    return ((f"< z {key_mapping['Z']}    neutral    {key_mapping['M']} m >", 0.5, 0.5),)
+
+
+def test_prompt(key_mapping):
+    return ((f"< z {key_mapping['Z']}            {key_mapping['M']} m >", 0.5, 0.5),)
+
+
+def explicit_prompt(key_mapping):
+    return ((f"< Z {key_mapping['Z']}            {key_mapping['M']} M >", 0.5, 0.5),)
+
+
+def prompt_screen(window, prompt):
+    """
+    Text widgets of a prompt, created and laid out the first time it is shown (or preloaded with the
+    block, see phases.block_assets) and reused afterwards.
+    """
+    widgets = PROMPTS.get(prompt)
+    if widgets is None:
+        widgets = []
+        for text, x, y in prompt:
+            text_widget = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(window.width * x, window.height * y))
+            text_widget.text = text
+            widgets.append(text_widget)
+        PROMPTS[prompt] = widgets
+    return widgets
+
+
+def draw_prompt(window, prompt):
+    for text_widget in prompt_screen(window, prompt):
+        text_widget.draw()
 
-    text_widget.draw()
+
+@traced("localizer_response")
+def localizer_response(window, target_modality, target_count, context):
+    draw_prompt(window, localizer_prompt(target_modality))
     clock = Clock()  # This allows to init a clock to measure the RT
     window.flip()
     clock.reset()  # This allows to reset the clock
-    key_event = window.wait_key(["1", "2", "3", "4", "5", "6", "7", "8", "9"], clock=clock, max_wait=2)
+    key_event, flip_reaction_time = wait_response(window, ["1", "2", "3", "4", "5", "6", "7", "8", "9"], clock, max_wait=2)
     send_trigger("loc_response", context)  # Send the response trigger
     reaction_time = key_event.timestamp
     interval = Interval(duration=16/1000)  # safety interval between response trigger and the start of next trial
@@ -47,18 +100,18 @@ def localizer_response(window, target_modality, target_count, context):
         "response": pressed_key,
         "fixation_color": fixation_color,
         "reaction_time": reaction_time,
+        "reaction_time_flip": flip_reaction_time, # from the flip of the response screen
         "timeout": pressed_key is None,
     }
 
 
+@traced("learning_response")
 def learning_response(window, key_mapping, trial, response_trigger, context):
-    text_widget = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position = (window.width / 2, window.height / 2))
-    text_widget.text = f"< z {key_mapping['Z']}    neutral    {key_mapping['M']} m >"
-    text_widget.draw()
+    draw_prompt(window, learning_prompt(key_mapping))
     clock = Clock()  # This allows to init a clock to measure the RT
     window.flip()
     clock.reset()  # This allows to reset the clock
-    key_event = window.wait_key(["SPACE", "Z", "M"], clock=clock, max_wait=2)
+    key_event, flip_reaction_time = wait_response(window, ["SPACE", "Z", "M"], clock, max_wait=2)
     send_trigger(response_trigger, context)  # Send the response trigger
     reaction_time = key_event.timestamp
     interval = Interval(duration=16/1000)  # safety interval between response trigger and the start of next trial
@@ -88,19 +141,18 @@ def learning_response(window, key_mapping, trial, response_trigger, context):
         "response": key_mapping.get(pressed_key, "NA"),
         "fixation_color": fixation_color,
         "reaction_time": reaction_time,
+        "reaction_time_flip": flip_reaction_time, # from the flip of the response screen
         "timeout": pressed_key is None,
     }
 
 
+@traced("test_response")
 def test_response(window, key_mapping, trial, response_trigger, context):
-
-    text_widget = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position = (window.width / 2, window.height / 2))
-    text_widget.text = f"< z {key_mapping['Z']}            {key_mapping['M']} m >"
-    text_widget.draw()
+    draw_prompt(window, test_prompt(key_mapping))
     clock = Clock()  # This allows to init a clock to measure the RT
     window.flip()
     clock.reset()  # This allows to reset the clock
-    key_event = window.wait_key(["Z", "M"], clock=clock, max_wait=2)
+    key_event, flip_reaction_time = wait_response(window, ["Z", "M"], clock, max_wait=2)
     send_trigger(response_trigger, context)  # Send the response trigger
     reaction_time = key_event.timestamp
     interval = Interval(duration=16/1000)  # safety interval between response trigger and the start of next trial
@@ -128,20 +180,18 @@ def test_response(window, key_mapping, trial, response_trigger, context):
         "response": key_mapping.get(pressed_key, "NA"),
         "fixation_color": fixation_color,
         "reaction_time": reaction_time,
+        "reaction_time_flip": flip_reaction_time, # from the flip of the response screen
         "timeout": pressed_key is None,
     }
 
 
+@traced("explicit_response")
 def explicit_response(window, key_mapping, trial, response_trigger, confidence_trigger, context):
-
-    text_widget = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position = (window.width / 2, window.height / 2))
-    text_widget.text = f"< Z {key_mapping['Z']}            {key_mapping['M']} M >"
-    text_widget.position = (window.width * 0.5, window.height * 0.5)  # Center the text on the screen
-    text_widget.draw()
+    draw_prompt(window, explicit_prompt(key_mapping))
     clock = Clock()  # This allows to init a clock to measure the RT
     window.flip()
     clock.reset()  # This allows to reset the clock
-    key_event1 = window.wait_key(["Z", "M"], clock=clock, max_wait=60)
+    key_event1, flip_reaction_time = wait_response(window, ["Z", "M"], clock, max_wait=60)
     send_trigger(response_trigger, context)  # Send the response trigger
     reaction_time = key_event1.timestamp
     
@@ -167,31 +217,13 @@ def explicit_response(window, key_mapping, trial, response_trigger, confidence_t
         outcome = 1 if correct_conditions else 0  # saving the outcome of the trial
 
     # Confidence rating
+    confidence, confidence_RT, flip_confidence_RT = None, None, None # no rating when the response timed out
     if response != "NA":
-        width = window.width
-        height = window.height
         # Display the confidence rating question
-        question_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.5, height*0.6)) #(0, .2)
-        question_text.text = "How confident are you in your response?"
-        rating1_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.3 , height*0.4)) #(-.5, -.2)
-        rating1_text.text = "1: not at all"
-        rating2_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.4, height*0.4)) #(-.25, -.2)
-        rating2_text.text = "2: a little"
-        rating3_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.5, height*0.4)) #(0, -.2)
-        rating3_text.text = "3: moderately"
-        rating4_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.6, height*0.4)) #(.25, -.2)
-        rating4_text.text = "4: very"
-        rating5_text = Text(font_size=RESPONSE_FONT_SIZE, color=COLOR, position=(width*0.7, height*0.4)) #(.5, -.2)
-        rating5_text.text = "5: completely"
-        question_text.draw()
-        rating1_text.draw()
-        rating2_text.draw()
-        rating3_text.draw()
-        rating4_text.draw()
-        rating5_text.draw()
+        draw_prompt(window, CONFIDENCE_PROMPT)
         window.flip()
         clock.reset()  # Reset the clock for the confidence rating
-        key_event2 = window.wait_key(["1", "2", "3", "4", "5"], clock=clock, max_wait=60)
+        key_event2, flip_confidence_RT = wait_response(window, ["1", "2", "3", "4", "5"], clock, max_wait=60)
         send_trigger(confidence_trigger, context)  # Send the confidence trigger
         confidence = key_event2.key if key_event2 else None
         confidence_RT = key_event2.timestamp 
@@ -201,8 +233,10 @@ def explicit_response(window, key_mapping, trial, response_trigger, confidence_t
         "outcome": outcome,
         "response": response,
         "reaction_time": reaction_time,
+        "reaction_time_flip": flip_reaction_time, # from the flip of the response screen
         "confidence": confidence,
         "confidence_RT": confidence_RT,
+        "confidence_RT_flip": flip_confidence_RT,
         "timeout": pressed_key1 is None,
     }
 
@@ -273,12 +307,12 @@ def load_last_staircase_data(participant_data, block):
     """
     participant_id = participant_data["participant_id"]
     prev_block = block - 1
-    filepath = f"data/{participant_id}/test_block{prev_block}.json"
+    drain()  # the previous block may still be queued for writing
+    filepath = block_data_path(participant_id, "test", prev_block)
 
     if os.path.exists(filepath):
-        with open(filepath, "r") as f:
-            block_trials = json.load(f)
-        last_trial = block_trials[-1] #[0]  # Get the final trial of previous block
+        block_trials = load_block_records(filepath)
+        last_trial = block_trials[-1]  # Get the final trial of previous block
 
         staircase_data = {
             "ori_diff": last_trial["ori_diff"],
@@ -303,23 +337,15 @@ def calculate_block_performance(block_data):
 
     return proportion_correct * 100  # Convert to percentage
 
+@traced("save_block_data")
 def save_block_data(participant_data, block_data, phase, block):
     """
-    Save the data of the block in the participant data directory as a json file
-    If file already exists, and contains data from previous blocks append the data to the existing json
+    Save the data of the block (a BlockRecorder) in the participant data directory as a .npz file,
+    with a csv export next to it, and the updated participant progress.
+    The files are written by the I/O worker so the presentation thread does not wait for the disk.
+    If the block was already run, the data is saved as a new run instead of overwriting the previous one.
     """
-    out_path = f"data/{participant_data['participant_id']}/{phase}_block{block}.json"
-    if os.path.exists(out_path):
-        with open(out_path, "r") as f:
-            data = json.load(f)
-            data.append(block_data)
-        with open(out_path, "w") as f:
-            json.dump(data, f)
-    else:
-        with open(out_path, "w") as f:
-            json.dump(block_data, f)
-
-    print(f"Block data saved to {out_path}")
+    participant_id = participant_data['participant_id']
 
     # Update completed_blocks tracker in participant_data
     completed = participant_data.setdefault("completed_blocks", {
@@ -331,7 +357,26 @@ def save_block_data(participant_data, block_data, phase, block):
     if block not in completed[phase]:
         completed[phase].append(block)
 
-    # Save updated participant_data back to disk
-    participant_data_path = f"{DATA_FOLDER}/{participant_data['participant_id']}/{participant_data['participant_id']}_info.json"
+    # Save updated participant_data back to disk. Only completed_blocks changes during the session,
+    # so a copy of it is enough to keep the snapshot unchanged until the worker writes it
+    snapshot = {**participant_data, "completed_blocks": copy.deepcopy(completed)}
+    participant_data_path = f"{DATA_FOLDER}/{participant_id}/{participant_id}_info.json"
+    get_data_writer().submit(_write_block, participant_id, block_data, phase, block, snapshot, participant_data_path)
+
+
+def _write_block(participant_id, block_data, phase, block, snapshot, participant_data_path):
+    """Block data, then the progress: the block is only marked complete on disk once its data is saved."""
+    _write_block_data(participant_id, block_data, phase, block)
+    _write_participant_data(snapshot, participant_data_path)
+
+
+def _write_block_data(participant_id, block_data, phase, block):
+    out_path = next_block_data_path(participant_id, phase, block)
+    block_data.to_npz(out_path)
+    block_data.to_csv(out_path[:-len(".npz")] + ".csv")
+    print(f"Block data saved to {out_path}")
+
+
+def _write_participant_data(participant_data, participant_data_path):
     with open(participant_data_path, "w") as f:
         json.dump(participant_data, f, indent=4)
@@ -0,0 +1,252 @@
+"""
+Trial schedules for all phases, generated with numpy from a per-participant seed.
+Every block gets its own random generator derived from the participant seed, so the whole
+schedule of a participant can be regenerated bit-identically from the seed alone.
+The generators return compact structured arrays; the *_to_dicts functions convert them to the
+dict-per-trial format stored in participant_data and used by the phase functions.
+"""
+import numpy as np
+
+from experiment.constants import COUNTERBALANCING_FACTORS, KEY_MAPPINGS, PHASES
+from experiment.sequencing import sequence_trials
+
+NEUTRAL = -1 # code of the neutral leading stimuli (neutralV, neutralA) in the compact arrays
+MISSING = -2 # code of the stimuli that are not presented (other modality in the explicit phase)
+
+PAIR_DTYPE = np.dtype([("leading", "i2"), ("trailing", "i2"), ("pred", "U7"), ("weight", "i2")])
+
+TRIAL_DTYPE = np.dtype([
+    ("modality", "U8"), # only used in the explicit phase
+    ("v_leading", "i2"),
+    ("v_trailing", "i2"),
+    ("v_pred", "U7"),
+    ("a_leading", "i2"),
+    ("a_trailing", "i2"),
+    ("a_pred", "U7"),
+    ("target", "i1"), # -1 when there is no target task (explicit phase)
+])
+
+LOCALIZER_PAIRS = np.array([(45, 100), (45, 160), (135, 100), (135, 160)] * 3, dtype="i2") # 4 * 3 = 12 balanced multimodal pairs
+LOCALIZER_TARGET_COUNTS = (0.5, 0.85) # P(0 targets) = 0.5, P(1 target) = 0.35, otherwise 2 or 3 targets
+
+PHASE_KEYS = {"setup": 0, "localizer": 1, "learning": 2, "test": 3, "explicit": 4} # stream ids for seeding
+
+
+def new_seed():
+    """Draw a fresh random seed for a new participant (a large int, safe to store in json)."""
+    return np.random.SeedSequence().entropy
+
+
+def block_rng(seed, phase, block=0):
+    """Independent random generator for one block of one phase, derived from the participant seed."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PHASE_KEYS[phase], block)))
+
+
+def visual_pairs(visual_mapping, explicit=False):
+    """
+    Leading -> trailing orientation pairs with their condition and weight (number of repetitions).
+    Mapping 0: vertical -> 135 and horizontal -> 45 are expected. Mapping 1: the opposite.
+    In the explicit phase every predictive pair is asked 3 times and there is no neutral cue.
+    """
+    exp_vertical, exp_horizontal = (135, 45) if visual_mapping == 0 else (45, 135)
+    uex_vertical, uex_horizontal = exp_horizontal, exp_vertical
+    exp_weight, uex_weight = (3, 3) if explicit else (3, 1)
+    pairs = [
+        (90, exp_vertical, "EXP", exp_weight),
+        (90, uex_vertical, "UEX", uex_weight),
+        (0, exp_horizontal, "EXP", exp_weight),
+        (0, uex_horizontal, "UEX", uex_weight),
+    ]
+    if not explicit:
+        pairs += [(NEUTRAL, 45, "neutral", 2), (NEUTRAL, 135, "neutral", 2)] # balanced neutral pairs
+    return np.array(pairs, dtype=PAIR_DTYPE)
+
+
+def auditory_pairs(auditory_mapping, explicit=False):
+    """
+    Leading -> trailing tone pairs with their condition and weight.
+    Mapping 0: 1000Hz -> 100Hz and 1600Hz -> 160Hz are expected. Mapping 1: the opposite.
+    The neutral auditory pairs have weight 0 (no auditory neutral condition).
+    """
+    exp_low, exp_high = (100, 160) if auditory_mapping == 0 else (160, 100)
+    exp_weight, uex_weight = (3, 3) if explicit else (3, 1)
+    pairs = [
+        (1000, exp_low, "EXP", exp_weight),
+        (1000, exp_high, "UEX", uex_weight),
+        (1600, exp_high, "EXP", exp_weight),
+        (1600, exp_low, "UEX", uex_weight),
+    ]
+    if not explicit:
+        pairs += [(NEUTRAL, 100, "neutral", 0), (NEUTRAL, 160, "neutral", 0)]
+    return np.array(pairs, dtype=PAIR_DTYPE)
+
+
+def learning_schedule(rng, auditory_mapping=0, visual_mapping=0):
+    """
+    Trials of one block of the learning or test phase as a TRIAL_DTYPE array.
+    Every visual-auditory combination is repeated (visual weight * auditory weight) times,
+    half of the repetitions of each combination are target trials (for odd counts the extra
+    trial is a target or not at random), and the trial order is shuffled.
+    Use sequence_trials on the result to impose the sequence constraints.
+    """
+    v_pairs = visual_pairs(visual_mapping)
+    a_pairs = auditory_pairs(auditory_mapping)
+
+    counts = np.outer(v_pairs["weight"], a_pairs["weight"]).ravel() # repetitions of each combination
+    combination = np.repeat(np.arange(counts.size), counts)[rng.permutation(counts.sum())] # shuffled trial order
+    v_index, a_index = np.divmod(combination, a_pairs.size)
+
+    # Number of targets per combination
+    n_targets = counts // 2 + (counts % 2) * rng.integers(0, 2, counts.size)
+    # Random rank of each trial among the trials of its combination; the n_targets lowest ranks are targets
+    order = np.lexsort((rng.random(combination.size), combination))
+    group_start = np.repeat(np.cumsum(counts) - counts, counts)
+    rank = np.empty(combination.size, dtype=np.int64)
+    rank[order] = np.arange(combination.size) - group_start
+
+    trials = np.empty(combination.size, dtype=TRIAL_DTYPE)
+    trials["modality"] = ""
+    trials["v_leading"] = v_pairs["leading"][v_index]
+    trials["v_trailing"] = v_pairs["trailing"][v_index]
+    trials["v_pred"] = v_pairs["pred"][v_index]
+    trials["a_leading"] = a_pairs["leading"][a_index]
+    trials["a_trailing"] = a_pairs["trailing"][a_index]
+    trials["a_pred"] = a_pairs["pred"][a_index]
+    trials["target"] = rank < n_targets[combination]
+    return trials
+
+
+def explicit_schedule(rng, block_modality="visual", visual_mapping=0, auditory_mapping=0):
+    """Trials of one block of the explicit phase: each predictive pair of the block modality 3 times, shuffled."""
+    pairs = visual_pairs(visual_mapping, explicit=True) if block_modality == "visual" else auditory_pairs(auditory_mapping, explicit=True)
+    pairs = np.repeat(pairs, pairs["weight"])[rng.permutation(pairs["weight"].sum())]
+
+    trials = np.empty(pairs.size, dtype=TRIAL_DTYPE)
+    trials["modality"] = block_modality
+    trials["target"] = -1
+    presented, absent = ("v", "a") if block_modality == "visual" else ("a", "v")
+    trials[f"{presented}_leading"] = pairs["leading"]
+    trials[f"{presented}_trailing"] = pairs["trailing"]
+    trials[f"{presented}_pred"] = pairs["pred"]
+    trials[f"{absent}_leading"] = MISSING
+    trials[f"{absent}_trailing"] = MISSING
+    trials[f"{absent}_pred"] = ""
+    return trials
+
+
+def localizer_schedule(rng, n_trials=None):
+    """
+    Sequences of the localizer phase.
+    Returns visual and auditory stimuli and target flags as (n_trials, 12) arrays, and the
+    number of targets per sequence.
+    """
+    if n_trials is None:
+        n_trials = PHASES["localizer_trials"]
+    n_stimuli = len(LOCALIZER_PAIRS)
+
+    pairs = LOCALIZER_PAIRS[rng.permuted(np.tile(np.arange(n_stimuli), (n_trials, 1)), axis=1)]
+
+    p = rng.random(n_trials)
+    several = rng.integers(2, 4, n_trials) # 2 or 3 targets
+    target_count = np.where(p < LOCALIZER_TARGET_COUNTS[0], 0, np.where(p < LOCALIZER_TARGET_COUNTS[1], 1, several))
+    rank = rng.random((n_trials, n_stimuli)).argsort(axis=1).argsort(axis=1) # random position ranks
+    target_sequence = (rank < target_count[:, None]).astype("i1")
+
+    return pairs[..., 0], pairs[..., 1], target_sequence, target_count.astype("i1")
+
+
+def _stimulus(code, neutral_name):
+    if code == NEUTRAL:
+        return neutral_name
+    if code == MISSING:
+        return None
+    return int(code)
+
+
+def trials_to_dicts(trials, auditory_mapping, visual_mapping):
+    """Convert a TRIAL_DTYPE array to the list of trial dicts stored in participant_data."""
+    records = []
+    for trial in trials.tolist():
+        modality, v_leading, v_trailing, v_pred, a_leading, a_trailing, a_pred, target = trial
+        record = {"modality": modality} if modality else {}
+        record.update({
+            "v_leading": _stimulus(v_leading, "neutralV"),
+            "v_trailing": _stimulus(v_trailing, None),
+            "v_pred": v_pred or None,
+            "a_leading": _stimulus(a_leading, "neutralA"),
+            "a_trailing": _stimulus(a_trailing, None),
+            "a_pred": a_pred or None,
+            "target": None if target < 0 else target,
+            "auditory_mapping": auditory_mapping,
+            "visual_mapping": visual_mapping,
+        })
+        records.append(record)
+    return records
+
+
+def localizer_to_dicts(sequences, block_modality="visual", target_modality="visual"):
+    """Convert the arrays of localizer_schedule to the list of trial dicts stored in participant_data."""
+    visual, auditory, targets, target_count = (array.tolist() for array in sequences)
+    return [
+        {
+            "visual_sequence": visual[i],
+            "auditory_sequence": auditory[i],
+            "target_sequence": targets[i],
+            "target_count": target_count[i],
+            "block_modality": [block_modality] * len(visual[i]),
+            "target_modality": [target_modality] * len(visual[i]),
+        }
+        for i in range(len(visual))
+    ]
+
+
+def draw_counterbalancing(rng):
+    """Draw a random counterbalancing cell: one binary level per factor of COUNTERBALANCING_FACTORS."""
+    return {factor: int(rng.integers(2)) for factor in COUNTERBALANCING_FACTORS}
+
+
+def build_participant_conditions(seed, cell=None):
+    """
+    Generate the conditions and key mappings of every block for one participant, in the format
+    stored in participant_data.
+    cell is the counterbalancing cell assigned by the cohort plan (see cohort.py); if None it is
+    drawn at random. The result only depends on the seed and the cell.
+    """
+    rng = block_rng(seed, "setup")
+    cell = dict(cell) if cell is not None else draw_counterbalancing(rng)
+    data = {
+        "counterbalancing": cell,
+        "auditory_mapping": cell["auditory_mapping"], # probabilistic associations mapping
+        "visual_mapping": cell["visual_mapping"],
+    }
+
+    # Localizer phase
+    target_modalities = list(PHASES["localizer_targets"])
+    if cell["localizer_target_order"]:
+        target_modalities.reverse()
+    for block, block_modality in enumerate(PHASES["localizer_blocks"]):
+        # if unimodal, the target is necessarily the same as block modality
+        target_modality = target_modalities[block] if block_modality == "multimodal" else block_modality
+        sequences = localizer_schedule(block_rng(seed, "localizer", block + 1))
+        data[f"conditions_localizer_{block + 1}"] = localizer_to_dicts(sequences, block_modality, target_modality)
+
+    # Learning and test phases, alternating key mappings across blocks
+    for phase in ["learning", "test"]:
+        key_order = cell[f"{phase}_key_order"]
+        for block in range(PHASES[f"{phase}_blocks"]):
+            trial_rng = block_rng(seed, phase, block + 1)
+            trials = learning_schedule(trial_rng, data["auditory_mapping"], data["visual_mapping"])
+            trials, stats = sequence_trials(trials, trial_rng) # constrained order instead of a plain shuffle
+            data[f"conditions_{phase}_{block + 1}"] = trials_to_dicts(trials, data["auditory_mapping"], data["visual_mapping"])
+            data[f"sequence_stats_{phase}_{block + 1}"] = stats
+            data[f"keymapping_{phase}_{block + 1}"] = KEY_MAPPINGS[phase][0 if block % 2 == key_order else 1]
+
+    # Explicit phase: order of the blocks and of the key mappings
+    explicit_blocks = ["auditory", "visual"] if cell["explicit_order"] else ["visual", "auditory"]
+    explicit_keymappings = KEY_MAPPINGS["explicit"][::-1] if cell["explicit_key_order"] else KEY_MAPPINGS["explicit"]
+    for block, block_modality, key_mapping in zip([1, 2], explicit_blocks, explicit_keymappings):
+        trials = explicit_schedule(block_rng(seed, "explicit", block), block_modality, data["visual_mapping"], data["auditory_mapping"])
+        data[f"conditions_explicit_{block}"] = trials_to_dicts(trials, data["auditory_mapping"], data["visual_mapping"])
+        data[f"keymapping_explicit_{block}"] = key_mapping
+
+    return data
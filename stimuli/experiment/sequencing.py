@@ -0,0 +1,261 @@
+"""
+Constrained ordering of the trials of a block.
+
+Instead of re-shuffling until a random order happens to be acceptable, the order is repaired
+incrementally (min-conflicts local search): a position involved in a violation is swapped with the
+candidate position that reduces the violations the most. The cost of a swap is computed only
+from the windows and transitions around the two swapped positions, so every step is cheap.
+
+Constraints (see SEQUENCE_CONSTRAINTS in constants):
+- max_run: maximum number of consecutive trials with the same level of a factor.
+- min_uex_distance: minimum distance between two UEX trials of the same modality.
+- balanced_transitions: the count of each first-order transition (level a followed by level b)
+  must be within transition_tolerance of the count expected in a random order.
+"""
+import logging
+
+import numpy as np
+
+from experiment.constants import SEQUENCE_CONSTRAINTS
+
+N_CANDIDATES = 24 # number of swap partners evaluated per repair step
+NOISE = 0.02 # probability of taking a random swap, to escape local minima
+HARD_WEIGHT = 10 # a run or UEX violation costs as much as 10 transitions off balance
+
+
+def _codes(values):
+    """Integer level codes of a factor as a python list."""
+    return np.unique(values, return_inverse=True)[1].ravel().tolist()
+
+
+class _ConstrainedOrder:
+    """Current order of a block with the bookkeeping needed to evaluate swaps incrementally."""
+
+    def __init__(self, trials, constraints):
+        self.n = len(trials)
+        self.order = list(range(self.n))
+
+        # Factor levels per position as python lists (faster than numpy for single element access)
+        self.runs = [
+            (factor, _codes(trials[factor]), max_run)
+            for factor, max_run in constraints.get("max_run", {}).items()
+        ]
+        self.uex = [
+            (factor, (trials[factor] == "UEX").astype(int).tolist(), distance)
+            for factor, distance in constraints.get("min_uex_distance", {}).items()
+        ]
+
+        self.tolerance = constraints.get("transition_tolerance", 1)
+        self.transitions = []
+        for factor in constraints.get("balanced_transitions", []):
+            codes = _codes(trials[factor])
+            level_counts = np.bincount(codes)
+            # expected number of times level a is followed by level b in a random order
+            expected = (np.outer(level_counts, level_counts) - np.diag(level_counts)) / self.n
+            counts = np.zeros_like(expected, dtype=int)
+            np.add.at(counts, (codes[:-1], codes[1:]), 1)
+            self.transitions.append((factor, codes, expected.tolist(), counts.tolist()))
+
+    # ---- violations ----
+    def _run_excess(self, codes, max_run, positions):
+        """Sum of (run length - max_run) over the runs containing the given positions."""
+        excess = 0
+        seen = set()
+        for p in positions:
+            if p < 0 or p >= self.n:
+                continue
+            level = codes[p]
+            start = p
+            while start > 0 and codes[start - 1] == level:
+                start -= 1
+            if start in seen:
+                continue
+            seen.add(start)
+            end = p
+            while end < self.n - 1 and codes[end + 1] == level:
+                end += 1
+            excess += max(0, end - start + 1 - max_run)
+        return excess
+
+    def _hard_violations(self, positions):
+        """Run and UEX distance violations around the given positions."""
+        violations = 0
+        # swapping can also merge or split the runs next to a position
+        neighbourhood = [q for p in positions for q in (p - 1, p, p + 1)]
+        for _, codes, max_run in self.runs:
+            violations += self._run_excess(codes, max_run, neighbourhood)
+        for _, flags, distance in self.uex:
+            pairs = set()
+            for p in positions:
+                if flags[p]:
+                    pairs.update((min(p, q), max(p, q)) for q in range(max(0, p - distance + 1), min(self.n, p + distance)) if q != p and flags[q])
+            violations += len(pairs)
+        return violations
+
+    def _transition_cost(self, counts, expected, cells):
+        return sum(max(0.0, abs(counts[a][b] - expected[a][b]) - self.tolerance) for a, b in cells)
+
+    def _swap(self, i, j):
+        self.order[i], self.order[j] = self.order[j], self.order[i]
+        for _, codes, _ in self.runs:
+            codes[i], codes[j] = codes[j], codes[i]
+        for _, flags, _ in self.uex:
+            flags[i], flags[j] = flags[j], flags[i]
+        for _, codes, _, _ in self.transitions:
+            codes[i], codes[j] = codes[j], codes[i]
+
+    def _pairs(self, i, j):
+        """Transitions (k, k + 1) changed by swapping positions i and j."""
+        return {k for p in (i, j) for k in (p - 1, p) if 0 <= k < self.n - 1}
+
+    def swap(self, i, j, apply=False):
+        """Change in cost if positions i and j are swapped. The swap is kept only if apply is True."""
+        pairs = self._pairs(i, j)
+        old_cells = [[(codes[k], codes[k + 1]) for k in pairs] for _, codes, _, _ in self.transitions]
+        hard_before = self._hard_violations((i, j))
+
+        self._swap(i, j)
+        delta = HARD_WEIGHT * (self._hard_violations((i, j)) - hard_before)
+
+        for (_, codes, expected, counts), old in zip(self.transitions, old_cells):
+            new = [(codes[k], codes[k + 1]) for k in pairs]
+            cells = set(old) | set(new)
+            cost_before = self._transition_cost(counts, expected, cells)
+            _move_counts(counts, old, new)
+            delta += self._transition_cost(counts, expected, cells) - cost_before
+            if not apply:
+                _move_counts(counts, new, old)
+
+        if not apply:
+            self._swap(i, j)
+        return delta
+
+    def conflicted_positions(self):
+        """Positions involved in a violation of any constraint."""
+        conflicted = set()
+        for _, codes, max_run in self.runs:
+            start = 0
+            for p in range(1, self.n + 1):
+                if p == self.n or codes[p] != codes[start]:
+                    if p - start > max_run:
+                        conflicted.update(range(start, p))
+                    start = p
+        for _, flags, distance in self.uex:
+            for p in range(self.n):
+                if flags[p] and any(flags[q] for q in range(p + 1, min(self.n, p + distance))):
+                    conflicted.add(p)
+        for _, codes, expected, counts in self.transitions:
+            for k in range(self.n - 1):
+                a, b = codes[k], codes[k + 1]
+                if counts[a][b] - expected[a][b] > self.tolerance: # over-represented transition
+                    conflicted.update((k, k + 1))
+        return sorted(conflicted)
+
+    def cost(self):
+        hard = self._hard_violations(range(self.n))
+        soft = 0.0
+        for _, _, expected, counts in self.transitions:
+            n_levels = len(counts)
+            soft += self._transition_cost(counts, expected, [(a, b) for a in range(n_levels) for b in range(n_levels)])
+        return HARD_WEIGHT * hard + soft
+
+
+def _move_counts(counts, old, new):
+    for a, b in old:
+        counts[a][b] -= 1
+    for a, b in new:
+        counts[a][b] += 1
+
+
+def sequence_trials(trials, rng, constraints=None):
+    """
+    Reorder the trials of a block (a structured array, see schedule.TRIAL_DTYPE) so that the
+    sequence constraints are met.
+    Starts from a random order and repairs it with swaps chosen by min-conflicts.
+    If the constraints cannot be met within max_iterations, the order with the lowest cost found
+    is kept and a warning is logged.
+    Returns the reordered trials and the constraint statistics of that order.
+    """
+    if constraints is None:
+        constraints = SEQUENCE_CONSTRAINTS
+
+    trials = trials[rng.permutation(len(trials))]
+    state = _ConstrainedOrder(trials, constraints)
+    cost = state.cost()
+    best_cost, best_order = cost, list(state.order) # random and sideways moves can leave a better order
+
+    iterations = 0
+    while cost > 1e-9 and iterations < constraints.get("max_iterations", 20000): # cost is a float sum of deltas
+        iterations += 1
+        conflicted = state.conflicted_positions()
+        if not conflicted: # only under-represented transitions left: any position can help
+            conflicted = range(state.n)
+        i = conflicted[rng.integers(len(conflicted))]
+
+        if rng.random() < NOISE:
+            j = int(rng.integers(state.n))
+            if j != i:
+                cost += state.swap(i, j, apply=True)
+                if cost < best_cost - 1e-9:
+                    best_cost, best_order = cost, list(state.order)
+            continue
+
+        candidates = rng.choice(state.n, size=min(N_CANDIDATES, state.n), replace=False)
+        best_j, best_delta = None, None
+        for j in candidates.tolist():
+            if j == i:
+                continue
+            delta = state.swap(i, j)
+            if best_delta is None or delta < best_delta:
+                best_j, best_delta = j, delta
+        if best_delta is not None and best_delta <= 0: # accept improving and sideways moves
+            cost += state.swap(i, best_j, apply=True)
+            if cost < best_cost - 1e-9:
+                best_cost, best_order = cost, list(state.order)
+
+    ordered = trials[best_order]
+    stats = sequence_stats(ordered, constraints)
+    stats["iterations"] = iterations
+    stats["cost"] = round(max(0.0, best_cost), 2)
+    if not stats["satisfied"]:
+        logging.warning(f"Sequence constraints not met after {iterations} iterations "
+                        f"(violated: {', '.join(stats['violations'])}), keeping the best order found (cost {stats['cost']})")
+    return ordered, stats
+
+
+def sequence_stats(trials, constraints=None):
+    """
+    Constraint statistics of a trial order: longest run per factor, smallest distance between
+    UEX trials and largest deviation of a transition count from its expected value.
+    """
+    if constraints is None:
+        constraints = SEQUENCE_CONSTRAINTS
+    n = len(trials)
+    stats = {"n_trials": n, "max_run": {}, "min_uex_distance": {}, "max_transition_deviation": {}}
+
+    for factor in constraints.get("max_run", {}):
+        values = trials[factor]
+        changes = np.flatnonzero(values[1:] != values[:-1]) + 1
+        run_lengths = np.diff(np.concatenate(([0], changes, [n])))
+        stats["max_run"][factor] = int(run_lengths.max())
+
+    for factor in constraints.get("min_uex_distance", {}):
+        positions = np.flatnonzero(trials[factor] == "UEX")
+        stats["min_uex_distance"][factor] = int(np.diff(positions).min()) if positions.size > 1 else None
+
+    for factor in constraints.get("balanced_transitions", []):
+        codes = np.array(_codes(trials[factor]))
+        level_counts = np.bincount(codes)
+        expected = (np.outer(level_counts, level_counts) - np.diag(level_counts)) / n
+        counts = np.zeros_like(expected)
+        np.add.at(counts, (codes[:-1], codes[1:]), 1)
+        stats["max_transition_deviation"][factor] = round(float(np.abs(counts - expected).max()), 2)
+
+    violations = [f"max_run {f}" for f, m in constraints.get("max_run", {}).items() if stats["max_run"][f] > m]
+    violations += [f"min_uex_distance {f}" for f, d in stats["min_uex_distance"].items()
+                   if d is not None and d < constraints["min_uex_distance"][f]]
+    violations += [f"balanced_transitions {f}" for f, d in stats["max_transition_deviation"].items()
+                   if d > constraints.get("transition_tolerance", 1)]
+    stats["violations"] = violations
+    stats["satisfied"] = not violations
+    return stats
@@ -1,65 +1,37 @@
 import datetime
 import json
 import logging
-import random
 import re
 from pathlib import Path
 
+import numpy as np
 from psychos import Window
 from psychos.gui import Dialog
 
+from .cohort import load_planned_conditions
 from .constants import BACKGROUND_COLOR, DATA_FOLDER, PHASES, SCREENS
+from .io_worker import QueuedHandler
+from .schedule import (build_participant_conditions, explicit_schedule,
+                       learning_schedule, localizer_schedule,
+                       localizer_to_dicts, new_seed, trials_to_dicts)
+from .sequencing import sequence_trials
+from .startup import run_startup_task, startup_result
 
 
-def generate_localizer_sequences(block_modality="visual", target_modality="visual"):
+def generate_localizer_sequences(block_modality="visual", target_modality="visual", rng=None):
     """
     Generate a list of 8 stimuli for trials of the localizer phase.
     A sequence for each modality.
     The visual stimuli are Gabor patches with orientations 0, 45, 90, and 135 degrees.
     The auditory stimuli are sine waves at frequencies 100Hz, 160Hz, 1000Hz and 1600Hz.
+    rng is a numpy Generator (see schedule.block_rng), a new unseeded one is used if None.
     """
+    rng = rng if rng is not None else np.random.default_rng()
+    return localizer_to_dicts(localizer_schedule(rng), block_modality, target_modality)
 
-    trials = []
-    for trial in range(PHASES["localizer_trials"]):
-        stimuli = [(45, 100), (45, 160), (135, 100), (135, 160)] * 3 # define multimodal pairs to ensure balanced presentation 4 * 3 = 12
-        random.shuffle(stimuli) # shuffle the pairs
-        visual_stimuli = [stim[0] for stim in stimuli] # extract the visual stimuli
-        auditory_stimuli = [stim[1] for stim in stimuli] # extract the auditory stimuli
-
-        target_sequence = [0] * len(visual_stimuli) # create a sequence of zeros and randomly add ones to mark targets
-
-        p = random.random()
-        if p < 0.5:
-            target_count = 0  # No targets
-        elif p < 0.85:
-            # One target
-            idx = random.randint(0, len(target_sequence) - 1)
-            target_sequence[idx] = 1
-            target_count = 1
-        else:
-            # Multiple targets (2 or 3)
-            target_count = random.choice([2, 3])
-            indices = random.sample(range(len(target_sequence)), target_count)
-            for idx in indices:
-                target_sequence[idx] = 1
-
-
-        # Create a trial with the randomized stimuli
-        trial_data = {
-            "visual_sequence": visual_stimuli,
-            "auditory_sequence": auditory_stimuli,
-            "target_sequence": target_sequence,
-            "target_count": target_count,
-            "block_modality": [block_modality] * len(visual_stimuli),
-            "target_modality": [target_modality] * len(visual_stimuli),
-        }
-
-        trials.append(trial_data)
-    return trials
-
-
-
-def generate_trials(auditory_mapping=0, visual_mapping=0):
+
+
+def generate_trials(auditory_mapping=0, visual_mapping=0, rng=None):
     """
     Generates lists of trials for each block of the learning and test phases.
     
@@ -86,188 +58,105 @@ def generate_trials(auditory_mapping=0, visual_mapping=0):
     Parameters:
         auditory_mapping (int): 0 or 1, indicating the mapping condition for auditory stimuli.
         visual_mapping (int): 0 or 1, indicating the mapping condition for visual stimuli.
+        rng: numpy Generator used for the randomization (see schedule.block_rng). If None, a new unseeded one is used.
     
     Returns:
        list of dictionaries for each trial, including the leading and trailing stimuli, their conditions, and the target status.
     """
+    rng = rng if rng is not None else np.random.default_rng()
+    trials = learning_schedule(rng, auditory_mapping, visual_mapping)
+    trials, _ = sequence_trials(trials, rng) # order with bounded runs, spaced UEX trials and balanced transitions
+    return trials_to_dicts(trials, auditory_mapping, visual_mapping)
 
-    
-    # Randomize visual mapping: choose between two conditions.
-    if visual_mapping == 0:
-        # Condition A: horizontal->CW high, vertical->CCW high.
-        visual_pairs = [
-            # Vertical stimulus: high probability for CCW, low for CW.
-            (90, 135, 'EXP', 3),
-            (90, 45,  'UEX', 1),
-            # Horizontal stimulus: high probability for CW, low for CCW.
-            (0, 45, 'EXP', 3),
-            (0, 135, 'UEX', 1),
-        ]
-    else:
-        # Condition B: horizontal->CCW high, vertical->CW high.
-        visual_pairs = [
-            # Vertical stimulus: high probability for CW, low for CCW.
-            (90, 45, 'EXP', 3),
-            (90, 135, 'UEX', 1),
-            # Horizontal stimulus: high probability for CCW, low for CW.
-            (0, 135, 'EXP', 3),
-            (0, 45, 'UEX', 1),
-        ]
-    # Add balanced neutral visual pairs.
-    visual_pairs.append(('neutralV', 45, 'neutral', 2))
-    visual_pairs.append(('neutralV', 135, 'neutral', 2))
-    
-    # Randomize auditory mapping: choose between two conditions.
-    if auditory_mapping == 0:
-        # Condition A: 1000Hz->100Hz high, 1600Hz->160Hz high.
-        auditory_pairs = [
-            (1000, 100, 'EXP', 3),
-            (1000, 160, 'UEX', 1),
-            (1600, 160, 'EXP', 3),
-            (1600, 100, 'UEX', 1),
-        ]
-    else:
-        # Condition B: 1000Hz->160Hz high, 1600Hz->100Hz high.
-        auditory_pairs = [
-            (1000, 160, 'EXP', 3),
-            (1000, 100, 'UEX', 1),
-            (1600, 100, 'EXP', 3),
-            (1600, 160, 'UEX', 1),
-        ]
-    # Add balanced neutral auditory pairs.
-    auditory_pairs.append(('neutralA', 100, 'neutral', 0)) # 0 for no auditory neutral condition
-    auditory_pairs.append(('neutralA', 160, 'neutral', 0))
-    
-    # Build the cross–product.
-    trials = []
-    for v_lead, v_target, v_cond, v_weight in visual_pairs:
-        for a_lead, a_target, a_cond, a_weight in auditory_pairs:
-            count = v_weight * a_weight  # number of repetitions for this combination
-            
-            if count == 0:
-                continue  # skip 
-
-            if count % 2 == 0: # event count of trials for this combination 
-                n_zeros = count // 2 # we can have an equal number of target and non-target trials
-                n_ones = count // 2
-            else: # odd number of trials, we need to randomize the distribution of targets and non-targets
-                if random.choice([True, False]): # more non-targets than targets
-                    n_zeros = count // 2
-                    n_ones = count - n_zeros
-                else: # more targets than non-targets
-                    n_ones = count // 2
-                    n_zeros = count - n_ones
-
-            target_list = [0] * n_zeros + [1] * n_ones # create a list of zeros and ones and shuffle
-            random.shuffle(target_list)
-
-            for t in target_list:
-                trial = {
-                'v_leading': v_lead,
-                'v_trailing': v_target,
-                'v_pred': v_cond,
-                'a_leading': a_lead,
-                'a_trailing': a_target,
-                'a_pred': a_cond,
-                'target': t,
-                'auditory_mapping': auditory_mapping,
-                'visual_mapping': visual_mapping,
-             }
-                trials.append(trial)
-    
-    # Shuffle the trial order to randomize sequence.
-    random.shuffle(trials)
-    return trials
-
-def generate_explicit_trials(block_modality="visual", visual_mapping=0, auditory_mapping=0):
+def generate_explicit_trials(block_modality="visual", visual_mapping=0, auditory_mapping=0, rng=None):
     """
     Generates a list of trials for the explicit phase of the experiment.
     """
+    rng = rng if rng is not None else np.random.default_rng()
+    trials = explicit_schedule(rng, block_modality, visual_mapping, auditory_mapping)
+    return trials_to_dicts(trials, auditory_mapping, visual_mapping)
 
-    # Randomize visual mapping: choose between two conditions.
-    if visual_mapping == 0:
-        # Condition A: horizontal->CW high, vertical->CCW high.
-        visual_pairs = [
-            (90, 135, 'EXP', 3), # asking 3 times for each pair
-            (90, 45,  'UEX', 3),
-            (0, 45, 'EXP', 3),
-            (0, 135, 'UEX', 3),
-        ]
-    else:
-        # Condition B: horizontal->CCW high, vertical->CW high.
-        visual_pairs = [
-            (90, 45, 'EXP', 3),
-            (90, 135, 'UEX', 3),
-            (0, 135, 'EXP', 3),
-            (0, 45, 'UEX', 3),
-        ]
-    
-    # Randomize auditory mapping: choose between two conditions.
-    if auditory_mapping == 0:
-        # Condition A: 1000Hz->100Hz high, 1600Hz->160Hz high.
-        auditory_pairs = [
-            (1000, 100, 'EXP', 3),
-            (1000, 160, 'UEX', 3),
-            (1600, 160, 'EXP', 3),
-            (1600, 100, 'UEX', 3),
-        ]
+
+
+def print_sequence_stats(participant_data):
+    """Print the sequence constraint statistics of every learning and test block."""
+    for key, stats in participant_data.items():
+        if key.startswith("sequence_stats_"):
+            status = "ok" if stats["satisfied"] else f"NOT SATISFIED ({', '.join(stats.get('violations', []))})"
+            print(f"{key[len('sequence_stats_'):]}: {status} | max run {stats['max_run']} | "
+                  f"min UEX distance {stats['min_uex_distance']} | max transition deviation {stats['max_transition_deviation']}")
+
+
+def setup_logging(participant_folder, participant_id):
+    """Log the triggers of the participant to <participant_id>_triggers.log in the participant folder."""
+    # Create a log file for the participant
+    log_file = Path(participant_folder) / f"{participant_id}_triggers.log"
+
+    # Set up root logger
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    # Clear existing handlers to avoid duplicate logs
+    if logger.hasHandlers():
+        logger.handlers.clear()
+
+    # File handler
+    file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(QueuedHandler(file_handler)) # log lines are written by the I/O worker, not during trials
+
+
+def participant_conditions(participant_id):
+    """Schedule seed and conditions (counterbalancing, conditions and key mappings of every block) of a new participant."""
+    planned = load_planned_conditions(participant_id)
+    if planned is not None: # precomputed by the cohort planner
+        schedule_seed, conditions = planned
+        print(f"Using the cohort plan for {participant_id}: {conditions['counterbalancing']}")
     else:
-        # Condition B: 1000Hz->160Hz high, 1600Hz->100Hz high.
-        auditory_pairs = [
-            (1000, 160, 'EXP', 3),
-            (1000, 100, 'UEX', 3),
-            (1600, 100, 'EXP', 3),
-            (1600, 160, 'UEX', 3),
-        ]
+        print(f"{participant_id} is not in the cohort plan, drawing the counterbalancing at random.")
+        schedule_seed = new_seed()
+        conditions = build_participant_conditions(schedule_seed)
+    return schedule_seed, conditions
 
-    
-    # Build list of trials
-    trials = []
 
-    if block_modality == "visual":
-        # Visual modality
-        for v_lead, v_target, v_cond, v_weight in visual_pairs:
-            count = v_weight * 1
-    
+def create_participant_data(participant_id, demographics, conditions=None):
+    """
+    Participant info of a new participant: demographics (gender, age, handedness), counterbalancing,
+    and conditions and key mappings of every block. conditions is the result of participant_conditions
+    if it was computed in advance.
+    """
+    # Store participant info
+    participant_data = {
+        "participant_id": participant_id,
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "gender": demographics["gender"],
+        "age": demographics["age"],
+        "handedness": demographics["handedness"],
+    }
+
+    # Counterbalancing, conditions and key mappings of every block, all derived from the participant seed
+    participant_data["schedule_seed"], conditions = conditions or participant_conditions(participant_id)
+    participant_data.update(conditions)
+    print_sequence_stats(participant_data)
+    return participant_data
+
+
+def get_edf_filename(participant_id, batch):
+    """EDF file name for the participant and batch (at most 8 characters before the extension)."""
+    batch_str = str(batch) if batch else "manual"
 
-            for i in range(count):
-                trial = {
-                'modality': 'visual',
-                'v_leading': v_lead,
-                'v_trailing': v_target,
-                'v_pred': v_cond,
-                'a_leading': None,
-                'a_trailing': None,
-                'a_pred': None,
-                'target': None,
-                'auditory_mapping': auditory_mapping,
-                'visual_mapping': visual_mapping,
-             }
-                trials.append(trial)
-    else: 
-        # Auditory modality
-        for a_lead, a_target, a_cond, a_weight in auditory_pairs:
-            count = a_weight * 1
-
-            for i in range(count):
-                trial = {
-                'modality': 'auditory',
-                'v_leading': None,
-                'v_trailing': None,
-                'v_pred': None,
-                'a_leading': a_lead,
-                'a_trailing': a_target,
-                'a_pred': a_cond,
-                'target': None,
-                'auditory_mapping': auditory_mapping,
-                'visual_mapping': visual_mapping,
-             }
-                trials.append(trial)
-    
-    # Shuffle the trial order to randomize sequence.
-    random.shuffle(trials)
-    return trials
+    # Remove 'sub-' prefix and non-alphanumerics, then convert to uppercase
+    match = re.match(r"sub-(\d+)", participant_id, re.IGNORECASE)
+    if match:
+        clean_id = f"SUB{match.group(1)}"
+    else:
+        # fallback: just sanitize to valid EDF format
+        clean_id = re.sub(r'[^A-Za-z0-9]', '', participant_id).upper()
 
+    # Compose final EDF name and clip to 8 characters if necessary
+    edf_basename = f"{clean_id}_{batch_str}"[:8]
+    return f"{edf_basename}.edf"
 
 
 def setup(batch):
@@ -287,27 +176,14 @@ def setup(batch):
     participant_folder.mkdir(exist_ok=True)  # Create participant folder
 
     # ========= Set up logging ==========
-    # Create a log file for the participant
-    log_file = participant_folder / f"{participant_id}_triggers.log"
-
-    # Set up root logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-
-    # Clear existing handlers to avoid duplicate logs
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    # File handler
-    file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    setup_logging(participant_folder, participant_id)
 
     # ======= Create or load participant info ========
     #  Check if participant data already exists
     participant_info_path = participant_folder / f"{participant_id}_info.json"
     if not participant_info_path.exists():
+        run_startup_task("conditions", participant_conditions, participant_id) # built while the demographics are entered
+
         # Second dialog to collect demographic info
         dialog2 = Dialog(title="Demographic Information")
         dialog2.add_field(name="gender", default="female", label="Gender", choices=["female", "male", "other"])
@@ -317,66 +193,7 @@ def setup(batch):
         if not data:
             raise RuntimeError("User cancelled the dialog.")
 
-        # Store participant info
-        participant_data = {
-            "participant_id": participant_id,
-            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "gender": data["gender"],
-            "age": data["age"],
-            "handedness": data["handedness"],
-        }
-
-        # probabilistic associations mapping
-        participant_data["auditory_mapping"] = random.choice([0, 1])
-        participant_data["visual_mapping"] = random.choice([0, 1])
-
-        # Key mappings
-        learning_key_mapping1 = {"Z": "frequent", "M": "infrequent", "SPACE": "neutral"}
-        learning_key_mapping2 = {"Z": "infrequent", "M": "frequent", "SPACE": "neutral"}
-
-        test_key_mapping1 = {"Z": "deviant", "M": "normal"}
-        test_key_mapping2 = {"Z": "normal", "M": "deviant"}
-
-        explicit_key_mapping1 = {"Z": "frequent", "M": "infrequent"}
-        explicit_key_mapping2 = {"Z": "infrequent", "M": "frequent"}
-
-
-        # Localizer phase
-        target_modalities = PHASES["localizer_targets"]
-        random.shuffle(target_modalities)  # Randomize the order of the modalities
-        for block, block_modality in enumerate(PHASES["localizer_blocks"]):
-            if block_modality == "multimodal":
-                target_modality = target_modalities[block] 
-            else:
-                target_modality = block_modality # if unimodal, necessarily the same as block modality
-
-            participant_data[f"conditions_localizer_{block + 1}"] = generate_localizer_sequences(block_modality=block_modality, target_modality=target_modality)
-        
-
-        # Learning phase
-        random_key_order = random.choice([True, False])
-        for block in range(PHASES["learning_blocks"]):
-            participant_data[f"conditions_learning_{block + 1}"] = generate_trials(participant_data["auditory_mapping"], participant_data["visual_mapping"])
-            participant_data[f"keymapping_learning_{block + 1}"] = learning_key_mapping1 if block % 2 == random_key_order else learning_key_mapping2
-
-        
-        # Test phase
-        random_key_order = random.choice([True, False])
-        for block in range(PHASES["test_blocks"]):
-            participant_data[f"conditions_test_{block + 1}"] = generate_trials(participant_data["auditory_mapping"], participant_data["visual_mapping"])
-            participant_data[f"keymapping_test_{block + 1}"] = test_key_mapping1 if block % 2 == random_key_order else test_key_mapping2
-
-        
-        # Explicit phase
-        explicit_blocks = ["visual", "auditory"]
-        explicit_keymappings = [explicit_key_mapping1, explicit_key_mapping2]
-        random.shuffle(explicit_blocks) # randomize the order of the blocks
-        random.shuffle(explicit_keymappings) # randomize the order of the key mappings
-
-        for block, block_modality, key_mapping in zip([1, 2], explicit_blocks, explicit_keymappings):
-            participant_data[f"conditions_explicit_{block}"] = generate_explicit_trials(block_modality, participant_data["visual_mapping"], participant_data["auditory_mapping"])
-            participant_data[f"keymapping_explicit_{block}"] = key_mapping
-
+        participant_data = create_participant_data(participant_id, data, startup_result("conditions"))
 
         # 🔹 Save JSON file
         with open(participant_info_path, "w") as f:
@@ -432,19 +249,7 @@ def setup(batch):
     screen_info = SCREENS[data["screen_info"]]
 
     # define name for edf file
-    batch_str = str(batch) if batch else "manual"
-
-    # Remove 'sub-' prefix and non-alphanumerics, then convert to uppercase
-    match = re.match(r"sub-(\d+)", participant_id, re.IGNORECASE)
-    if match:
-        clean_id = f"SUB{match.group(1)}"
-    else:
-        # fallback: just sanitize to valid EDF format
-        clean_id = re.sub(r'[^A-Za-z0-9]', '', participant_id).upper()
-
-    # Compose final EDF name and clip to 8 characters if necessary
-    edf_basename = f"{clean_id}_{batch_str}"[:8]
-    edf_filename = f"{edf_basename}.edf"
+    edf_filename = get_edf_filename(participant_id, batch)
 
     #  window for the experiment
     window = Window(background_color=BACKGROUND_COLOR, fullscreen=full_screen == "Yes", coordinates="px", width=screen_info["screen_width_px"], height=screen_info["screen_height_px"]) # important to set px coordinates for eyetracker calibration
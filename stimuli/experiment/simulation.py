@@ -0,0 +1,337 @@
+"""
+Headless fast-forward simulation of the experiment.
+
+The psychos window, clocks, intervals, widgets and sounds used by the experiment modules are replaced
+by stand-ins driven by a virtual clock: waits, flips and key presses advance virtual time instantly,
+and responses come from a responder (random or scripted). Everything else runs as in a real session:
+the phase and response functions, the trigger path (with a silent serial port), the trigger log and
+the data saving, to SIM_DATA_FOLDER instead of DATA_FOLDER so that the simulated participants never
+mix with the real ones. Since no real time is spent waiting, the real time spent per trial is the CPU
+overhead of the experiment code.
+
+No display is needed: pyglet runs headless (pyglet.options["headless"], set by main.py --simulate and
+when this module is imported before psychos).
+
+Usage (from the stimuli folder):
+    python main.py --simulate            # all batches of a new simulated participant
+    python main.py --simulate --batch 2
+"""
+import json
+import math
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pyglet
+
+pyglet.options["headless"] = True # before psychos imports pyglet.gl, if it was not imported yet
+
+import experiment.constants as constants
+import experiment.frames as frames
+import experiment.keyboard as keyboard
+import experiment.phases as phases
+import experiment.presentation as presentation
+import experiment.quest as quest
+import experiment.records as records
+import experiment.responses as responses
+import experiment.setup as setup
+import experiment.timeline as timeline
+import experiment.triggers as triggers
+from experiment.constants import SCREENS
+from experiment.setup import create_participant_data, get_edf_filename, setup_logging
+from psychos.types import KeyEvent
+
+CLOCK = None # Virtual clock of the running simulation
+
+REFRESH_RATE = 60 # Hz, flips are aligned to virtual frames of 1 / REFRESH_RATE
+
+SIM_DATA_FOLDER = "sim_data" # Data of the simulated participants (and benchmarks), instead of DATA_FOLDER
+DATA_FOLDER_MODULES = (constants, quest, records, responses, setup) # modules that build paths from DATA_FOLDER
+
+
+class VirtualClock:
+    """Simulated time in seconds. Only advances when the experiment waits."""
+    def __init__(self):
+        self.now = 0.0
+
+    def advance(self, duration):
+        if duration > 0:
+            self.now += duration
+
+
+class SimClock:
+    """Stand-in for psychos.core.Clock."""
+    def __init__(self, *args, **kwargs):
+        self.start_time = CLOCK.now
+
+    def time(self):
+        return CLOCK.now - self.start_time
+
+    def reset(self):
+        self.start_time = CLOCK.now
+
+
+class SimInterval:
+    """Stand-in for psychos.core.Interval."""
+    def __init__(self, duration, *args, **kwargs):
+        self.duration = duration
+        self.start_time = CLOCK.now
+
+    def reset(self):
+        self.start_time = CLOCK.now
+
+    def remaining(self):
+        return max(0.0, self.start_time + self.duration - CLOCK.now)
+
+    def wait(self):
+        CLOCK.advance(self.remaining())
+
+
+class SimWindow:
+    """Stand-in for psychos.Window: flips, waits and key presses advance the virtual clock."""
+    def __init__(self, width, height, responder, background_color="grey", refresh_rate=REFRESH_RATE):
+        self.width = int(width)
+        self.height = int(height)
+        self.size = (self.width, self.height)
+        self.background_color = (0.5, 0.5, 0.5) if background_color == "grey" else background_color
+        self.color = self.background_color
+        self.frame_period = 1 / refresh_rate
+        self.responder = responder
+        self.n_flips = 0
+        self.n_key_waits = 0
+
+    def flip(self):
+        """Advance to the next frame boundary."""
+        CLOCK.now = (math.floor(CLOCK.now / self.frame_period + 1e-9) + 1) * self.frame_period
+        self.n_flips += 1
+        return CLOCK.now
+
+    def wait(self, duration):
+        CLOCK.advance(duration)
+
+    def wait_key(self, keys=None, modifiers=None, clock=None, max_wait=None, event="press", clear_events=True):
+        if max_wait is not None and max_wait < self.frame_period: # keyboard polls (preload.py) never see a press
+            CLOCK.advance(max_wait)
+            return KeyEvent(key=None, timestamp=clock.time() if clock is not None else CLOCK.now, modifiers="", event=event)
+        self.n_key_waits += 1
+        keys = [keys] if isinstance(keys, str) else list(keys or ["SPACE"])
+        key, rt = self.responder(keys, max_wait)
+        if key is None or (max_wait is not None and rt > max_wait):
+            key, rt = None, max_wait
+        CLOCK.advance(rt)
+        timestamp = clock.time() if clock is not None else CLOCK.now
+        return KeyEvent(key=key, timestamp=timestamp, modifiers="", event=event)
+
+    def close(self):
+        pass
+
+
+class SimKeyCollector:
+    """Stand-in for keyboard.KeyCollector: the presses come from the responder of the window."""
+    def __init__(self, window):
+        self.window = window
+
+    def poll(self, keys):
+        return None
+
+    def wait(self, keys, onset, max_wait):
+        self.window.n_key_waits += 1
+        key, rt = self.window.responder(list(keys), max_wait)
+        if key is None or rt > max_wait:
+            CLOCK.advance(max_wait)
+            return None, None
+        CLOCK.advance(rt)
+        return key, CLOCK.now
+
+
+class SimWidget:
+    """
+    Stand-in for the psychos Text, Circle, Rectangle and RawImage widgets (nothing is drawn).
+    The gabor images are still computed (presentation.gabor_image), so their CPU cost is measured.
+    """
+    def __init__(self, *args, text="", position=(0, 0), **kwargs):
+        self.text = text
+        self.position = position
+
+    def draw(self):
+        pass
+
+
+class SimSound:
+    """Stand-in for the psychos sounds and the audio.ScheduledTone and ToneSequence (nothing is played)."""
+    def __init__(self, *args, **kwargs):
+        self.duration = kwargs.get("duration")
+        self.planned_onset = None
+        self.estimated_onset = None
+
+    def play(self):
+        pass
+
+    def play_at(self, onset):
+        self.planned_onset = self.estimated_onset = onset
+        return onset
+
+
+class SimSerial:
+    """Silent serial port that counts the triggers written."""
+    def __init__(self):
+        self.is_open = True
+        self.n_writes = 0
+
+    def write(self, data):
+        self.n_writes += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def _virtual_time():
+    return CLOCK.now
+
+
+def _advance_ms(duration_ms):
+    CLOCK.advance(duration_ms / 1000)
+
+
+class RandomResponder:
+    """Presses one of the allowed keys at random after a random reaction time, and sometimes misses."""
+    def __init__(self, rng, rt_range=(0.3, 1.2), p_miss=0.02):
+        self.rng = rng
+        self.rt_range = rt_range
+        self.p_miss = p_miss
+
+    def __call__(self, keys, max_wait):
+        if max_wait is None: # instructions and prompts without timeout
+            return keys[0], 0.5
+        if self.rng.random() < self.p_miss:
+            return None, None
+        return keys[int(self.rng.integers(len(keys)))], float(self.rng.uniform(*self.rt_range))
+
+
+class ScriptedResponder:
+    """Takes the (key, reaction time) responses from a script, then falls back to another responder."""
+    def __init__(self, script, fallback):
+        self.script = iter(script)
+        self.fallback = fallback
+
+    def __call__(self, keys, max_wait):
+        if max_wait is None:
+            return self.fallback(keys, max_wait)
+        return next(self.script, None) or self.fallback(keys, max_wait)
+
+
+class Simulation:
+    """
+    Context manager that installs the simulation stand-ins in the experiment modules, and provides
+    the setup and tracker used by main.main(simulation=...).
+    """
+    def __init__(self, responder=None, seed=None, screen="VU_experiment", modules=(), participant_prefix="sim",
+                 data_folder=SIM_DATA_FOLDER):
+        """
+        :param responder: Callable (keys, max_wait) -> (key, reaction time). Defaults to a RandomResponder.
+        :param seed: Seed of the responder and of the ITI draws.
+        :param screen: Key of SCREENS to simulate.
+        :param modules: Additional modules to patch (e.g. main).
+        :param participant_prefix: Prefix of the simulated participant ID (and data folder).
+        :param data_folder: Folder of the simulated participants, used instead of DATA_FOLDER.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.responder = responder or RandomResponder(self.rng)
+        self.screen_info = SCREENS[screen]
+        self.clock = VirtualClock()
+        self.serial = SimSerial()
+        self.participant_data = None
+        self.participant_prefix = participant_prefix
+        self.data_folder = data_folder
+        self.modules = [frames, keyboard, phases, presentation, responses, timeline, *modules]
+        self.replacements = {
+            "Clock": SimClock, "Interval": SimInterval,
+            "RawImage": SimWidget, "Text": SimWidget, "Circle": SimWidget, "Rectangle": SimWidget,
+            "KeyCollector": SimKeyCollector,
+            "Sine": SimSound, "ScheduledTone": SimSound, "ToneSequence": SimSound, "send_trigger": self._send_trigger,
+            "perf_counter": _virtual_time, # flip timestamps of the frame monitor
+        }
+        self._saved = []
+        self.trials = [] # (phase, wall seconds, cpu seconds) per trial
+        self._trial_start = None
+
+    # ---- patching ----
+    def __enter__(self):
+        global CLOCK
+        CLOCK = self.clock
+        if self.seed is not None:
+            random.seed(self.seed)
+        for module in self.modules:
+            for name, replacement in self.replacements.items():
+                if hasattr(module, name):
+                    self._saved.append((module, name, getattr(module, name)))
+                    setattr(module, name, replacement)
+        self._saved += [(triggers, "precise_delay_ms", triggers.precise_delay_ms), (triggers, "PORT", triggers.PORT)]
+        triggers.precise_delay_ms = _advance_ms
+        triggers.PORT = self.serial
+        for module in DATA_FOLDER_MODULES:
+            self._saved.append((module, "DATA_FOLDER", module.DATA_FOLDER))
+            module.DATA_FOLDER = self.data_folder
+        self.wall_start, self.cpu_start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global CLOCK
+        self.wall_end, self.cpu_end = time.perf_counter(), time.process_time()
+        for module, name, original in reversed(self._saved):
+            setattr(module, name, original)
+        self._saved = []
+        CLOCK = None
+        return False
+
+    def _send_trigger(self, trigger_type, context=None):
+        """send_trigger that also marks the trial boundaries for the CPU report."""
+        if trigger_type.endswith("trial_start"):
+            now = (time.perf_counter(), time.process_time())
+            phase = context.rsplit(" ", 2)[-2] if context else None # contexts end with "<phase> phase"
+            if self._trial_start is not None and self._trial_start[0] == phase:
+                self.trials.append((phase, now[0] - self._trial_start[1], now[1] - self._trial_start[2]))
+            self._trial_start = (phase, *now)
+        triggers.send_trigger(trigger_type, context)
+
+    # ---- replacements for setup and the eye tracker ----
+    def setup(self, batch, phase="localizer", block=1):
+        """Same return values as setup.setup, for a new simulated participant and without dialogs."""
+        if self.participant_data is None:
+            participant_id = f"{self.participant_prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+            participant_folder = Path(self.data_folder) / participant_id
+            participant_folder.mkdir(parents=True, exist_ok=True)
+            setup_logging(participant_folder, participant_id)
+
+            self.participant_data = create_participant_data(participant_id, {"gender": "other", "age": 0, "handedness": "right"})
+            self.participant_data["completed_blocks"] = {"localizer": [], "learning": [], "test": [], "explicit": []}
+            with open(participant_folder / f"{participant_id}_info.json", "w") as f:
+                json.dump(self.participant_data, f, indent=4)
+
+        window = SimWindow(self.screen_info["screen_width_px"], self.screen_info["screen_height_px"], self.responder)
+        self._trial_start = None
+        edf_filename = get_edf_filename(self.participant_data["participant_id"], batch)
+        return window, self.participant_data, phase, block, "No", self.screen_info, edf_filename
+
+    def tracker(self, window, edf_filename):
+        import experiment.eyelinker as eyelinker
+        return eyelinker.MockEyeLinker(window, edf_filename, "RIGHT")
+
+    # ---- report ----
+    def report(self):
+        """Print the simulated session duration, the real time it took, and the CPU overhead per trial."""
+        wall = self.wall_end - self.wall_start
+        print(f"Simulated {self.clock.now / 60:.1f} min of experiment in {wall:.1f} s "
+              f"(CPU {self.cpu_end - self.cpu_start:.1f} s), {self.serial.n_writes} triggers sent")
+        print(f"{'phase':>10} {'trials':>6} | {'wall mean':>9} {'median':>7} {'p95':>7} {'max':>7} | {'cpu mean':>8} (ms per trial)")
+        for phase in dict.fromkeys(phase for phase, _, _ in self.trials):
+            wall_ms = np.array([w for p, w, _ in self.trials if p == phase]) * 1000
+            cpu_ms = np.array([c for p, _, c in self.trials if p == phase]) * 1000
+            print(f"{phase:>10} {wall_ms.size:>6} | {wall_ms.mean():>9.2f} {np.median(wall_ms):>7.2f} "
+                  f"{np.percentile(wall_ms, 95):>7.2f} {wall_ms.max():>7.2f} | {cpu_ms.mean():>8.2f}")
@@ -0,0 +1,199 @@
+"""
+Monte-Carlo simulator of the test phase staircase, for tuning INITIAL_STAIRCASE and STAIRCASE_PARAMS.
+
+update() is a vectorized copy of responses.staircase: it applies the same 3-down-1-up rule with
+the same step size schedule and the same handling of max_diff to arrays of observers at once
+(check_update_rule compares both trial by trial).
+Synthetic observers answer target trials with a Weibull psychometric function of ori_diff; their
+threshold is the ori_diff at which they are correct with the probability the 3-down-1-up rule
+converges to (0.5 ** (1/3) ~ 79.4%).
+Parameter sets are simulated in parallel across processes.
+
+Usage (from the stimuli folder):
+    python -m experiment.staircase_sim --initial 10 15 20 --max-diff 20 25 --observers 20000
+"""
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from experiment.constants import INITIAL_STAIRCASE, PHASES, STAIRCASE_PARAMS
+
+TARGET_P = 0.5 ** (1 / 3) # convergence point of a 3-down-1-up staircase
+TARGETS_PER_BLOCK = 48 # target trials per test block (half of the 96 trials)
+
+OBSERVERS = { # synthetic observer population
+    "alpha_range": (4, 16), # Weibull scale, drawn uniformly per observer (degrees)
+    "beta": 2.0, # Weibull slope
+    "guess": 0.1, # P(correct) at ori_diff = 0
+    "lapse": 0.02,
+}
+
+
+def init_state(n_observers, initial=INITIAL_STAIRCASE):
+    """Staircase state of n_observers as arrays, starting from the INITIAL_STAIRCASE values."""
+    return {
+        "ori_diff": np.full(n_observers, initial["ori_diff"], dtype=np.float64),
+        "inversions_count": np.full(n_observers, initial["inversions_count"], dtype=np.int64),
+        "up": np.full(n_observers, initial["last_direction"] == "up"), # last_direction == "up"
+        "history": np.full(n_observers, initial["history"], dtype=np.int64),
+        "step_size": np.zeros(n_observers, dtype=np.float64),
+    }
+
+
+def update(state, outcome, step_size_list, step_update, max_diff):
+    """
+    Apply one staircase update (in place) to all observers. outcome is a 0/1 array.
+    Returns the mask of observers for which ori_diff was clamped to max_diff.
+    """
+    step = np.asarray(step_size_list, dtype=np.float64)[np.searchsorted(step_update, state["inversions_count"], side="right")]
+    state["step_size"] = step
+    ori_diff, up = state["ori_diff"], state["up"]
+
+    incorrect = outcome == 0
+    fits = ori_diff + step <= max_diff
+    increase = incorrect & fits
+    clamped = incorrect & ~fits # history, direction and inversions are left unchanged
+
+    state["history"] = np.where(incorrect, np.where(fits, 0, state["history"]), state["history"] + 1)
+    decrease = ~incorrect & (state["history"] == 3)
+    state["history"][decrease] = 0
+
+    state["inversions_count"] += (increase & ~up) | (decrease & up)
+    state["ori_diff"] = np.where(increase, ori_diff + step, np.where(clamped, max_diff, np.where(decrease, ori_diff - step, ori_diff)))
+    state["up"] = np.where(increase, True, np.where(decrease, False, up))
+    return clamped
+
+
+def p_correct(ori_diff, alpha, beta, guess, lapse):
+    """Weibull psychometric function (ori_diff <= 0 gives the guess rate)."""
+    x = np.maximum(ori_diff, 0) / alpha
+    return guess + (1 - guess - lapse) * (1 - np.exp(-x ** beta))
+
+
+def threshold(alpha, beta, guess, lapse, p=TARGET_P):
+    """ori_diff at which the psychometric function reaches p."""
+    return alpha * (-np.log(1 - (p - guess) / (1 - guess - lapse))) ** (1 / beta)
+
+
+def simulate(params, n_observers=10000, n_trials=None, seed=0, observers=OBSERVERS, tail=20, tolerance=2.0, chunk=10000):
+    """
+    Simulate one parameter set.
+    params: dict with "initial" (INITIAL_STAIRCASE-like) and the STAIRCASE_PARAMS keys.
+    tail: the threshold estimate is the mean ori_diff of the last tail trials.
+    tolerance: an observer has converged from the first trial after which the running mean of
+    ori_diff (over tail trials) stays within tolerance degrees of the true threshold.
+    """
+    if n_trials is None:
+        n_trials = TARGETS_PER_BLOCK * PHASES["test_blocks"]
+    rng = np.random.default_rng(seed)
+    bias, converged_at, clamp_trials, hit = [], [], [], []
+
+    for start in range(0, n_observers, chunk):
+        n = min(chunk, n_observers - start)
+        alpha = rng.uniform(*observers["alpha_range"], n)
+        true_threshold = threshold(alpha, observers["beta"], observers["guess"], observers["lapse"])
+
+        state = init_state(n, params["initial"])
+        trajectory = np.empty((n_trials, n), dtype=np.float32)
+        clamps = np.zeros(n, dtype=np.int64)
+        for t in range(n_trials):
+            p = p_correct(state["ori_diff"], alpha, observers["beta"], observers["guess"], observers["lapse"])
+            outcome = (rng.random(n) < p).astype(np.int64)
+            clamps += update(state, outcome, params["step_size_list"], params["step_update"], params["max_diff"])
+            trajectory[t] = state["ori_diff"]
+
+        bias.append(trajectory[-tail:].mean(axis=0) - true_threshold)
+        cumulative = np.cumsum(trajectory, axis=0, dtype=np.float64)
+        cumulative[tail:] = cumulative[tail:] - cumulative[:-tail]
+        running_mean = cumulative / np.minimum(np.arange(1, n_trials + 1), tail)[:, None]
+        outside = np.abs(running_mean - true_threshold) > tolerance
+        last_outside = n_trials - 1 - np.argmax(outside[::-1], axis=0)
+        converged_at.append(np.where(outside.any(axis=0), last_outside + 1, 0)) # n_trials = never converged
+        clamp_trials.append(clamps)
+        hit.append(clamps > 0)
+
+    bias, converged_at = np.concatenate(bias), np.concatenate(converged_at)
+    clamp_trials, hit = np.concatenate(clamp_trials), np.concatenate(hit)
+    converged = converged_at < n_trials
+    return {
+        "params": params,
+        "n_observers": n_observers,
+        "n_trials": n_trials,
+        "converged": float(converged.mean()),
+        "trials_to_converge_median": float(np.median(converged_at[converged])) if converged.any() else None,
+        "bias_mean": float(bias.mean()),
+        "bias_sd": float(bias.std()),
+        "max_diff_hit_rate": float(hit.mean()), # observers clamped to max_diff at least once
+        "max_diff_trial_rate": float(clamp_trials.sum() / (n_observers * n_trials)),
+    }
+
+
+def simulate_sets(parameter_sets, max_workers=None, **kwargs):
+    """Simulate several parameter sets in parallel processes (same observers and seed for each set)."""
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(simulate, params, **kwargs) for params in parameter_sets]
+        return [future.result() for future in futures]
+
+
+def check_update_rule(n_observers=200, n_trials=300, seed=0, params=STAIRCASE_PARAMS):
+    """Check that update() matches responses.staircase for random outcome sequences."""
+    from experiment.responses import staircase
+
+    rng = np.random.default_rng(seed)
+    outcomes = rng.integers(0, 2, (n_trials, n_observers))
+    state = init_state(n_observers)
+    scalar = [dict(INITIAL_STAIRCASE) for _ in range(n_observers)]
+    for t in range(n_trials):
+        update(state, outcomes[t], **params)
+        for i, data in enumerate(scalar):
+            data["last_outcome"] = int(outcomes[t, i])
+            scalar[i] = staircase(**data, **params)
+        expected = np.array([data["ori_diff"] for data in scalar])
+        if not np.array_equal(expected, state["ori_diff"]):
+            return False
+    return True
+
+
+def parameter_grid(initial_values, max_diffs, step_lists, step_updates):
+    sets = []
+    for ori_diff, max_diff, steps, updates in itertools.product(initial_values, max_diffs, step_lists, step_updates):
+        sets.append({
+            "initial": {**INITIAL_STAIRCASE, "ori_diff": ori_diff},
+            "step_size_list": steps,
+            "step_update": updates,
+            "max_diff": max_diff,
+        })
+    return sets
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the staircase for synthetic observers.")
+    parser.add_argument("--initial", type=float, nargs="+", default=[INITIAL_STAIRCASE["ori_diff"]], help="Initial ori_diff values.")
+    parser.add_argument("--max-diff", type=float, nargs="+", default=[STAIRCASE_PARAMS["max_diff"]], help="max_diff values.")
+    parser.add_argument("--steps", type=_int_list, nargs="+", default=[STAIRCASE_PARAMS["step_size_list"]], help="Step size lists, e.g. 6,4,2,1")
+    parser.add_argument("--updates", type=_int_list, nargs="+", default=[STAIRCASE_PARAMS["step_update"]], help="Step update lists, e.g. 2,4,8")
+    parser.add_argument("--observers", type=int, default=10000, help="Observers per parameter set.")
+    parser.add_argument("--trials", type=int, default=None, help="Target trials per observer (default: all test blocks).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--check", action="store_true", help="Check the update rule against responses.staircase first.")
+    args = parser.parse_args()
+
+    if args.check:
+        print("Update rule matches responses.staircase:", check_update_rule())
+
+    sets = parameter_grid(args.initial, args.max_diff, args.steps, args.updates)
+    results = simulate_sets(sets, args.workers, n_observers=args.observers, n_trials=args.trials, seed=args.seed)
+    print(f"{'initial':>7} {'max':>5} {'steps':>12} {'updates':>9} | {'conv':>5} {'trials':>6} {'bias':>6} {'sd':>5} {'hit':>5} {'clamp':>6}")
+    for r in results:
+        p = r["params"]
+        trials = r["trials_to_converge_median"]
+        print(f"{p['initial']['ori_diff']:>7g} {p['max_diff']:>5g} {','.join(map(str, p['step_size_list'])):>12} {','.join(map(str, p['step_update'])):>9} | "
+              f"{r['converged']:>5.2f} {trials if trials is not None else '-':>6} {r['bias_mean']:>6.2f} {r['bias_sd']:>5.2f} "
+              f"{r['max_diff_hit_rate']:>5.2f} {r['max_diff_trial_rate']:>6.3f}")
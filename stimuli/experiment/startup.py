@@ -0,0 +1,131 @@
+"""
+Concurrent startup: slow initializations run in the background while the setup dialogs are open.
+
+start_startup is called before setup and starts one thread per task:
+- tracker: first connection attempt to the EyeLink (eyelinker._try_connection), used by EyeLinker;
+- serial: detection and opening of the EEG trigger port (triggers.get_serial_port);
+- warmup: a first gabor image and tone (numpy code paths).
+The I/O and prefetch workers are started before, on the main thread.
+setup adds the conditions of a new participant (create_participant_data) while the demographics are
+entered. wait_startup prints the readiness of every task once the window is open and waits for the
+ones still running, and the time from start_startup to the first trial is reported when it starts.
+"""
+import logging
+import threading
+from time import perf_counter
+
+from experiment.audio import render_tone
+from experiment.constants import SCREENS
+from experiment.eyelinker import _try_connection
+from experiment.io_worker import get_data_writer
+from experiment.prefetch import get_prefetcher
+from experiment.presentation import gabor_image
+from experiment.triggers import get_serial_port
+
+STARTUP = None # Global startup orchestrator
+
+
+class StartupTask:
+    """One initialization running on its own thread."""
+    __slots__ = ("name", "thread", "result", "error", "start", "end")
+
+    def __init__(self, name, func, *args):
+        self.name = name
+        self.result = None
+        self.error = None
+        self.start = perf_counter()
+        self.end = None
+        self.thread = threading.Thread(target=self._run, args=(func, args), name=f"startup-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self, func, args):
+        try:
+            self.result = func(*args)
+        except Exception as e: # raised again by Startup.result
+            self.error = e
+        self.end = perf_counter()
+
+    def status(self):
+        if self.end is None:
+            return f"{self.name}: running ({perf_counter() - self.start:.1f} s)"
+        if self.error is not None:
+            return f"{self.name}: failed after {self.end - self.start:.1f} s ({self.error})"
+        return f"{self.name}: ready in {self.end - self.start:.1f} s"
+
+
+class Startup:
+    """Startup tasks of the session and the time to the first trial."""
+    def __init__(self):
+        self.start = perf_counter()
+        self.tasks = {}
+        self.first_trial = None
+
+    def run(self, name, func, *args):
+        self.tasks[name] = StartupTask(name, func, *args)
+
+    def result(self, name):
+        """Result of the task, waiting for it to finish. Its exception is raised again if it failed."""
+        task = self.tasks[name]
+        task.thread.join()
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+
+def get_startup():
+    global STARTUP
+    if STARTUP is None:
+        STARTUP = Startup()
+    return STARTUP
+
+
+def warm_up():
+    """Run the numpy code paths of the stimuli once."""
+    gabor_image(45, next(iter(SCREENS.values())))
+    render_tone(1000, 0.1)
+
+
+def start_startup():
+    """Start the workers, then the tracker connection, the serial port and the warm-up in the background."""
+    get_data_writer() # on the main thread, before the background tasks can use them
+    get_prefetcher()
+    startup = get_startup()
+    startup.run("tracker", _try_connection)
+    startup.run("serial", get_serial_port)
+    startup.run("warmup", warm_up)
+    return startup
+
+
+def run_startup_task(name, func, *args):
+    """Run func(*args) in the background, its result is taken with startup_result(name)."""
+    get_startup().run(name, func, *args)
+
+
+def startup_result(name):
+    """Result of a startup task (waits for it), or None if it was not started."""
+    if STARTUP is None or name not in STARTUP.tasks:
+        return None
+    return STARTUP.result(name)
+
+
+def wait_startup():
+    """Print the readiness of the startup tasks and wait for the ones still running."""
+    if STARTUP is None:
+        return
+    for task in STARTUP.tasks.values():
+        print(f"Startup {task.status()}")
+    for task in STARTUP.tasks.values():
+        if task.end is None:
+            task.thread.join()
+            print(f"Startup {task.status()}")
+        logging.info(f"Startup {task.status()}")
+
+
+def mark_first_trial():
+    """Report the time from the start of the startup to the first trial (once)."""
+    if STARTUP is None or STARTUP.first_trial is not None:
+        return
+    STARTUP.first_trial = perf_counter()
+    message = f"Time to first trial: {STARTUP.first_trial - STARTUP.start:.1f} s"
+    print(message)
+    logging.info(message)
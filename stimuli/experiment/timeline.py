@@ -0,0 +1,134 @@
+"""
+Trial timeline shared by the phases.
+
+Every trial is compiled by its phase (see phases.py) into a Trial: the list of screens it shows, each with
+its draw calls (prepared stimuli), the tone scheduled on its flip, its trigger and its duration, followed
+by the response handler. run_trial executes any compiled trial with the same loop: the next screen is
+drawn and its tone scheduled while the current one is on, wait_screen keeps the current screen for its
+duration in frames, then the flip, the trigger and the timestamps (start_<label> and flip_<label>, and
+the tone onsets) follow, and the flip is checked against its deadline (see deadlines.py). Frame
+monitoring, tracing, audio scheduling and the deadline watchdog thus apply to all phases alike.
+The ISI of the explicit phase keeps its original order, with the trigger sent before the flip
+(Screen.trigger_before_flip), so its triggers are timed as in the sessions already recorded.
+"""
+from datetime import datetime
+from time import perf_counter
+
+from experiment.audio import tone_onsets
+from experiment.deadlines import check_deadline, trial_deadline_stats
+from experiment.frames import (delay_screen, label_flip, next_flip_time,
+                               start_trial_frames, trial_frame_stats,
+                               wait_screen)
+from experiment.gc_control import collect_garbage, trial_gc_stats
+from experiment.startup import mark_first_trial
+from experiment.triggers import send_trigger
+from psychos.core import Clock
+
+
+class Screen:
+    """One screen of a trial, shown from its flip for duration (s, counted in frames)."""
+    __slots__ = ("label", "duration", "trigger", "draws", "tone", "tone_label", "collect", "trigger_before_flip")
+
+    def __init__(self, label, duration, trigger, draws=(), tone=None, tone_label=None, collect=False, trigger_before_flip=False):
+        """
+        :param label: Label of the flip (fixation, leading, isi, trailing), used in the timestamps.
+        :param duration: Duration of the screen in seconds.
+        :param trigger: Trigger sent right after the flip.
+        :param draws: (function, args, kwargs) called to draw the screen before its flip.
+        :param tone: Tone (audio.ScheduledTone) scheduled to start with the flip.
+        :param tone_label: Prefix of the tone onsets in the record, defaults to the label.
+        :param collect: Collect the garbage after the flip (see gc_control.py), on a screen long enough for it (the ITI).
+        :param trigger_before_flip: Send the trigger before the flip instead (ISI of the explicit phase, as in its
+            original code). The trigger delay then postpones the flip, and the previous screen lasts a frame longer.
+        """
+        self.label = label
+        self.duration = duration
+        self.trigger = trigger
+        self.draws = draws
+        self.tone = tone
+        self.tone_label = tone_label or label
+        self.collect = collect
+        self.trigger_before_flip = trigger_before_flip
+
+
+class Trial:
+    """Compiled trial: its screens and the response handler called after the last one."""
+    __slots__ = ("screens", "response", "context", "prepare_next")
+
+    def __init__(self, screens, response, context, prepare_next=None):
+        """
+        :param screens: Screens shown in order.
+        :param response: (function, args) called after the last screen, returning the response dict.
+        :param context: Context of the trigger logs.
+        :param prepare_next: (function, args) called when the response starts, e.g. to prefetch the next trial.
+        """
+        self.screens = screens
+        self.response = response
+        self.context = context
+        self.prepare_next = prepare_next
+
+
+def run_trial(window, trial):
+    """Run a compiled trial. Returns the response and the timestamps (relative to the start of the trial)."""
+    mark_first_trial()
+    trial_clock = Clock()  # This allows to init a clock to measure the RT
+    trial_clock.reset()
+    start_trial_frames()
+    timestamps = {"start_trial_absolute": datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")}
+
+    duration = None # of the screen being shown
+    for screen in trial.screens:
+        # pre-load the next screen while the current one is on
+        prep = [] # (draw function, duration), to find the cause of a missed deadline
+        for function, args, kwargs in screen.draws:
+            start = perf_counter()
+            function(*args, **kwargs)
+            prep.append((function, perf_counter() - start))
+        if duration is not None:
+            planned = next_flip_time(duration) # deadline of the flip
+            if screen.tone is not None:
+                screen.tone.play_at(planned)  # schedule the tone on the flip of the screen
+            slack = wait_screen(window, duration)  # Waits until the flip that ends the current screen
+
+        if screen.trigger_before_flip:
+            send_trigger(screen.trigger, trial.context)
+            if duration is not None:
+                planned = delay_screen(planned) # the delay of the trigger is neither a missed deadline nor a dropped frame
+        window.flip()
+        if not screen.trigger_before_flip:
+            send_trigger(screen.trigger, trial.context)
+        if duration is not None:
+            check_deadline(trial.context, screen.label, planned, slack, prep)
+        timestamps[f"start_{screen.label}"] = trial_clock.time()
+        timestamps[f"flip_{screen.label}"] = label_flip(screen.label, trial_clock) # time of the flip itself
+        if screen.tone is not None:
+            timestamps.update(tone_onsets(screen.tone_label, screen.tone, trial_clock, timestamps[f"flip_{screen.label}"]))
+        if screen.collect:
+            collect_garbage()
+        duration = screen.duration
+    wait_screen(window, duration)  # Waits for the duration of the last screen
+
+    # ======= Response ========
+    if trial.prepare_next is not None:
+        function, args = trial.prepare_next
+        function(*args) # next trial prepared during the response
+    timestamps["start_response"] = trial_clock.time()
+    function, args = trial.response
+    response = function(window, *args)
+    timestamps["end_trial"] = trial_clock.time()
+    return response, timestamps
+
+
+def trial_record(i, trial, iti_duration, response, timestamps, **fields):
+    """Record of a trial in the block data."""
+    return {
+        "num_trial": i,
+        "iti_duration": iti_duration,
+        **trial,
+        **response,
+        **timestamps,
+        **trial_frame_stats(),
+        **trial_gc_stats(),
+        **trial_deadline_stats(),
+        **fields,
+    }
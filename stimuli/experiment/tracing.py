@@ -0,0 +1,188 @@
+"""
+Lightweight tracing of the stages of the phase loops, exported as Chrome/Perfetto trace JSON.
+
+Spans (name, optional detail, start, duration, thread) are stored in preallocated numpy arrays, so
+recording a span does not allocate. Tracing is off unless enable_tracing() is called (main.py
+--trace or TRACING in constants); when it is off, span() returns a shared no-op object and traced
+functions only pay one global lookup.
+The spans of each block are written next to the block data as <phase>_block<block>_trace.json,
+which can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import functools
+import gc
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+
+TRACER = None # Global tracer, None when tracing is disabled
+
+MAX_SPANS = 500000 # size of the span buffer (about 15 MB), more than enough for one block
+
+
+class Tracer:
+    """Preallocated buffer of spans."""
+    def __init__(self, max_spans=MAX_SPANS):
+        self.max_spans = max_spans
+        self.name = np.zeros(max_spans, dtype=np.int32)
+        self.detail = np.full(max_spans, -1, dtype=np.int32)
+        self.start = np.zeros(max_spans, dtype=np.float64)
+        self.duration = np.zeros(max_spans, dtype=np.float64)
+        self.thread = np.zeros(max_spans, dtype=np.int32)
+        self.strings = {} # name or detail -> id
+        self.threads = {} # thread ident -> (index, name)
+        self.origin = time.perf_counter()
+        self.dropped = 0
+        self._counter = itertools.count() # next() is atomic, spans can be recorded from several threads
+
+    def string_id(self, text):
+        string_id = self.strings.get(text)
+        if string_id is None:
+            string_id = self.strings.setdefault(text, len(self.strings))
+        return string_id
+
+    def record(self, name_id, detail_id, start, end):
+        index = next(self._counter)
+        if index >= self.max_spans:
+            self.dropped += 1
+            return
+        ident = threading.get_ident()
+        thread = self.threads.get(ident)
+        if thread is None:
+            thread = self.threads.setdefault(ident, (len(self.threads), threading.current_thread().name))
+        self.name[index] = name_id
+        self.detail[index] = detail_id
+        self.start[index] = start
+        self.duration[index] = end - start
+        self.thread[index] = thread[0]
+
+    def take(self):
+        """Return a copy of the recorded spans and empty the buffer."""
+        n = min(next(self._counter), self.max_spans)
+        spans = {
+            "name": self.name[:n].copy(), "detail": self.detail[:n].copy(), "start": self.start[:n].copy(),
+            "duration": self.duration[:n].copy(), "thread": self.thread[:n].copy(),
+            "strings": {string_id: text for text, string_id in self.strings.items()},
+            "threads": dict(self.threads.values()), "origin": self.origin, "dropped": self.dropped,
+        }
+        self._counter = itertools.count()
+        self.dropped = 0
+        return spans
+
+
+class _Span:
+    __slots__ = ("tracer", "name_id", "detail_id", "start")
+
+    def __init__(self, tracer, name_id, detail_id):
+        self.tracer = tracer
+        self.name_id = name_id
+        self.detail_id = detail_id
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name_id, self.detail_id, self.start, time.perf_counter())
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, detail=None):
+    """Context manager that records a span named name (detail is shown as an argument of the span)."""
+    if TRACER is None:
+        return NULL_SPAN
+    return _Span(TRACER, TRACER.string_id(name), -1 if detail is None else TRACER.string_id(str(detail)))
+
+
+def traced(name):
+    """Decorator recording a span for every call of the function."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if TRACER is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _gc_callback(phase, info):
+    """Record garbage collections as spans (gc.callbacks are called at the start and stop of each collection)."""
+    if TRACER is None:
+        return
+    if phase == "start":
+        _gc_callback.start = time.perf_counter()
+    elif getattr(_gc_callback, "start", None) is not None:
+        TRACER.record(TRACER.string_id("gc"), TRACER.string_id(f"generation {info['generation']}"), _gc_callback.start, time.perf_counter())
+        _gc_callback.start = None
+
+
+def enable_tracing(max_spans=MAX_SPANS):
+    """Start recording spans (including garbage collections)."""
+    global TRACER
+    if TRACER is None:
+        TRACER = Tracer(max_spans)
+        gc.callbacks.append(_gc_callback)
+    return TRACER
+
+
+def tracing_enabled():
+    return TRACER is not None
+
+
+def instrument_window(window):
+    """Record spans for the flips, waits and key waits of the window (only if tracing is enabled)."""
+    if TRACER is None:
+        return window
+    for method in ("flip", "wait", "wait_key"):
+        setattr(window, method, traced(f"window.{method}")(getattr(window, method)))
+    return window
+
+
+def to_chrome_trace(spans):
+    """Convert spans (see Tracer.take) to the Chrome trace event format (times in microseconds)."""
+    strings = spans["strings"]
+    events = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": index, "args": {"name": name}}
+        for index, name in spans["threads"].items()
+    ]
+    start_us = (spans["start"] - spans["origin"]) * 1e6
+    duration_us = spans["duration"] * 1e6
+    for name, detail, ts, dur, tid in zip(spans["name"].tolist(), spans["detail"].tolist(), start_us.tolist(), duration_us.tolist(), spans["thread"].tolist()):
+        event = {"name": strings[name], "ph": "X", "ts": round(ts, 3), "dur": round(dur, 3), "pid": 1, "tid": tid}
+        if detail >= 0:
+            event["args"] = {"detail": strings[detail]}
+        events.append(event)
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": spans["dropped"]}}
+
+
+def _write_trace(path, spans):
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(spans), f)
+    print(f"Trace saved to {path}")
+
+
+def export_block_trace(participant_id, phase, block):
+    """Write the spans recorded since the last export to the participant folder (by the I/O worker)."""
+    if TRACER is None:
+        return
+    from experiment.constants import DATA_FOLDER # Import here to avoid circular import issues (constants imports triggers)
+    from experiment.io_worker import get_data_writer
+    spans = TRACER.take()
+    get_data_writer().submit(_write_trace, f"{DATA_FOLDER}/{participant_id}/{phase}_block{block}_trace.json", spans)
@@ -4,6 +4,8 @@ import subprocess
 import serial
 import time
 
+from experiment.tracing import span
+
 # from psychos.triggers import ParallelPort, SerialPort # comment if using port = DummyPort(). Otherwise it raises an error
 
 PORT = None # # Global variable for lazy initialization of the EEG trigger port
@@ -93,21 +95,24 @@ def send_trigger(trigger_type, context=None):
     """
     Send a trigger to the EEG system and EyeLink tracker.
     """
-    port = get_serial_port() # Get the serial port 
-    trigger_mapping = get_trigger_mapping() # Get the trigger mapping
-    triggerval = trigger_mapping[trigger_type] # Get the trigger value from the mapping
+    with span("send_trigger", trigger_type):
+        port = get_serial_port() # Get the serial port 
+        trigger_mapping = get_trigger_mapping() # Get the trigger mapping
+        triggerval = trigger_mapping[trigger_type] # Get the trigger value from the mapping
 
-    try:
-        port.write(triggerval.to_bytes(1,'little'))
-        context_info = f" | Context: {context}" if context else ""
-        logger.info(f"Trigger sent: {trigger_type}, value: {triggerval}{context_info}")
-    except Exception as e:
-        print(f"Failed to send trigger {trigger_type}: {e}")
-        logger.warning(f"Failed to send EEG trigger {trigger_type}: {e}")
+        try:
+            with span("trigger.serial_write"):
+                port.write(triggerval.to_bytes(1,'little'))
+            context_info = f" | Context: {context}" if context else ""
+            logger.info(f"Trigger sent: {trigger_type}, value: {triggerval}{context_info}")
+        except Exception as e:
+            print(f"Failed to send trigger {trigger_type}: {e}")
+            logger.warning(f"Failed to send EEG trigger {trigger_type}: {e}")
 
-    TRACKER.send_message("trig" + str(triggerval)) # Send trigger to EyeLink tracker
+        TRACKER.send_message("trig" + str(triggerval)) # Send trigger to EyeLink tracker
 
-    precise_delay_ms(16) # Wait for 16 ms to ensure the trigger is sent
+        with span("trigger.delay"):
+            precise_delay_ms(16) # Wait for 16 ms to ensure the trigger is sent
     
 
 # This function is called in constants.py
@@ -1,26 +1,55 @@
 import argparse
 import os
+import sys
+
+import pyglet
+
+if "--simulate" in sys.argv: # no display in simulation mode, set before psychos imports pyglet.gl and pyglet.window
+    pyglet.options["headless"] = True
 
 import experiment.eyelinker as eyelinker
-from experiment.constants import BATCH_SEQUENCES
-from experiment.phases import run_phase
+from experiment.audio import start_audio_engine
+from experiment.constants import BATCH_SEQUENCES, REALTIME, TRACING
+from experiment.frames import monitor_frames
+from experiment.gc_control import enable_gc_control
+from experiment.io_worker import drain
+from experiment.phases import layout_instructions, run_phase
+from experiment.realtime import enable_realtime
 from experiment.setup import setup
+from experiment.startup import start_startup, startup_result, wait_startup
+from experiment.tracing import enable_tracing, instrument_window
 from experiment.triggers import get_tracker, send_trigger
 from psychos.core import Interval
 
 
-def main(batch=None):
+def main(batch=None, simulation=None, realtime=False):
     """
     Main function that runs the experiment. 
     If no batch is specified, the experimenter will manually select an individual block and phase to run.
     Otherwise, if the script is run like: python main.py --batch 1,2..., it will run all blocks specified in the batch.
+    If simulation (experiment.simulation.Simulation) is given, the experiment runs headless in virtual time.
+    If realtime, the process runs in real-time mode on Linux (see experiment/realtime.py).
     """
     # === SETUP ===
-    window, participant_data, phase, block, full_screen, screen_info, edf_filename = setup(batch)
+    if simulation:
+        window, participant_data, phase, block, full_screen, screen_info, edf_filename = simulation.setup(batch)
+    else:
+        start_startup() # tracker connection, serial port and warm-up run while the dialogs are open
+        window, participant_data, phase, block, full_screen, screen_info, edf_filename = setup(batch)
+        wait_startup() # readiness of the background tasks, before the audio engine and the real-time mode
+    monitor_frames(window, screen_info) # timestamp every flip and detect dropped frames
+    instrument_window(window) # trace flips and waits if tracing is enabled
+    if not simulation:
+        start_audio_engine() # one output stream for the whole session, the tones are mixed into it
+    if realtime and not simulation:
+        enable_realtime() # after the audio engine, so its thread is pinned away from the presentation thread
     print(window.width)
     # === EYE TRACKER ===
     # Initialize the EyeLink tracker
-    tracker = eyelinker.EyeLinker(window, edf_filename, 'RIGHT')  # {data_folder}/{participant_id}/{participant_id}_eye.edf'
+    if simulation:
+        tracker = simulation.tracker(window, edf_filename)
+    else:
+        tracker = eyelinker.EyeLinker(window, edf_filename, 'RIGHT', connection=startup_result("tracker"))  # {data_folder}/{participant_id}/{participant_id}_eye.edf'
     tracker.init_tracker()
     mock_tracker = getattr(tracker, 'mock', False) # Check if the tracker is in mock mode
     get_tracker(tracker) # inject tracker object in the triggers module
@@ -34,6 +63,9 @@ def main(batch=None):
     else:
         eyelinker.offline_mode_start() # Start recording Eye
 
+    # Lay out the instruction pages of the session once, before the first block
+    layout_instructions(BATCH_SEQUENCES[batch] if batch else [(phase, block)], participant_data, screen_info)
+
     # ==== RUN EXPERIMENT ====
     # Using batch sequences to run specific blocks
     if batch:
@@ -50,6 +82,7 @@ def main(batch=None):
 
         interval = Interval(duration=1)  # safety interval to wait for the last trigger to be sent
         interval.reset()
+        drain() # make sure all block data and trigger logs of the batch are on disk
         if not mock_tracker: tracker.transfer_edf() # Send eye data at the end of each batch
         send_trigger("recording_off", context=context) # Send trigger to EEG system to stop recording
         interval.wait() # Wait for the last trigger to be sent
@@ -61,6 +94,7 @@ def main(batch=None):
             return
         
         run_phase(phase, block, window, participant_data, full_screen, screen_info)
+        drain() # make sure the block data is on disk before the EDF transfer
         if not mock_tracker: tracker.transfer_edf() # Send eye data at the end of each block
 
     tracker.close_connection()
@@ -73,9 +107,28 @@ if __name__ == "__main__":
     # allow command line argument "batch" to run a specific batch of blocks
     parser = argparse.ArgumentParser()
     parser.add_argument("--batch", type=str, choices=BATCH_SEQUENCES.keys(), help="Run predefined part of the experiment")
+    parser.add_argument("--simulate", action="store_true", help="Run headless (no display needed) in virtual time with simulated responses (all batches if no --batch)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the simulated responses")
+    parser.add_argument("--trace", action="store_true", help="Record tracing spans and save a Chrome trace file per block")
+    parser.add_argument("--realtime", action="store_true", help="Pin the threads, raise the priority and lock the memory (Linux)")
+    parser.add_argument("--gc-control", action="store_true", help="Disable the automatic garbage collection during the blocks and collect in the ITIs")
     args = parser.parse_args()
 
+    if args.trace or TRACING:
+        enable_tracing()
+
+    if args.gc_control:
+        enable_gc_control()
+
+    if args.simulate:
+        from experiment.simulation import Simulation
+        with Simulation(seed=args.seed, modules=[sys.modules[__name__]]) as simulation:
+            for batch in [args.batch] if args.batch else list(BATCH_SEQUENCES):
+                main(batch=batch, simulation=simulation)
+        simulation.report()
+        sys.exit()
+
     try:
-        main(batch=args.batch)
+        main(batch=args.batch, realtime=args.realtime or REALTIME)
     except RuntimeError as e:
         raise e
\ No newline at end of file
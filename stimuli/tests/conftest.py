@@ -0,0 +1,3 @@
+import pyglet
+
+pyglet.options["headless"] = True # the tests never open a display, set before psychos imports pyglet.gl
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from experiment import audio
+from experiment.audio import MixerSource, ToneSequence, render_tone, tone_onsets
+
+
+def test_tone_onsets_record_the_hardware_latency(monkeypatch):
+    clock = SimpleNamespace(start_time=10.0)
+    tone = SimpleNamespace(planned_onset=10.5, estimated_onset=10.502)
+
+    monkeypatch.setitem(audio.AUDIO_PARAMS, "hardware_latency", None)
+    record = tone_onsets("leading", tone, clock, 0.5)
+    assert record["leading_av_offset_ms"] == 2.0
+    assert record["audio_hardware_latency_ms"] == 0.0
+    assert record["audio_latency_calibrated"] is False
+
+    monkeypatch.setitem(audio.AUDIO_PARAMS, "hardware_latency", 0.012)
+    record = tone_onsets("leading", tone, clock, 0.5)
+    assert record["audio_hardware_latency_ms"] == 12.0
+    assert record["audio_latency_calibrated"] is True
+
+
+def test_tone_sequence_places_each_tone_at_its_offset():
+    sample_rate = 1000
+    sequence = ToneSequence([1000, 1600, 100], [1, 0, 0.5], tone_duration=0.05, interval=0.2, sample_rate=sample_rate)
+    assert sequence.samples.size == 400 + 50 # last onset plus one tone
+    assert sequence.duration == 0.45
+    np.testing.assert_array_equal(sequence.samples[:50], render_tone(1000, 0.05, 1, sample_rate))
+    assert not sequence.samples[50:400].any() # silent gaps and the tone with amplitude 0
+    np.testing.assert_array_equal(sequence.samples[400:], render_tone(100, 0.05, 0.5, sample_rate))
+
+
+def mixed(source, n_samples):
+    return np.frombuffer(source.get_audio_data(2 * n_samples).data, dtype=np.int16)
+
+
+def test_mixer_mixes_buffers_across_driver_reads():
+    source = MixerSource(sample_rate=1000)
+    tone = np.arange(1, 11, dtype=np.int16) * 100
+    assert source.schedule(tone, 5) == 5
+    assert source.schedule(np.full(4, 7, dtype=np.int16), 6) == 6 # overlaps the first buffer
+
+    first = mixed(source, 8)
+    np.testing.assert_array_equal(first, [0, 0, 0, 0, 0, 100, 207, 307])
+    second = mixed(source, 8)
+    np.testing.assert_array_equal(second, [407, 507, 600, 700, 800, 900, 1000, 0])
+    assert source.queue_depth() == 0 and source.written == 16
+
+
+def test_mixer_clips_the_sum_and_starts_late_schedules_at_once():
+    source = MixerSource(sample_rate=1000)
+    mixed(source, 8)
+    # the driver already has the samples up to 8: a schedule at 2 starts at 8
+    assert source.schedule(np.full(3, 30000, dtype=np.int16), 2) == 8
+    assert source.schedule(np.full(3, 30000, dtype=np.int16), 9) == 9
+    np.testing.assert_array_equal(mixed(source, 4), [30000, 32767, 32767, 30000])
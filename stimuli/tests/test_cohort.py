@@ -0,0 +1,38 @@
+from itertools import combinations
+
+import numpy as np
+
+from experiment.cohort import balanced_cells
+from experiment.constants import COUNTERBALANCING_FACTORS
+
+
+def cell_matrix(n_participants, seed=0):
+    cells = balanced_cells(n_participants, np.random.default_rng(seed))
+    return np.array([[cell[factor] for factor in COUNTERBALANCING_FACTORS] for cell in cells])
+
+
+def test_full_cycle_covers_every_cell_once():
+    k = len(COUNTERBALANCING_FACTORS)
+    rows = cell_matrix(2 ** k)
+    assert len({tuple(row) for row in rows}) == 2 ** k
+
+
+def test_no_factor_is_aliased_with_an_interaction():
+    rows = cell_matrix(2 ** len(COUNTERBALANCING_FACTORS))
+    for i, j in combinations(range(rows.shape[1]), 2):
+        interaction = rows[:, i] ^ rows[:, j]
+        for k in set(range(rows.shape[1])) - {i, j}:
+            assert not np.array_equal(rows[:, k], interaction)
+            assert not np.array_equal(rows[:, k], 1 - interaction)
+
+
+def test_groups_are_balanced():
+    rows = cell_matrix(40, seed=1)
+    for start in range(0, 40, 8):
+        group = rows[start:start + 8]
+        assert (group.sum(axis=0) == 4).all() # each level of each factor
+        for i, j in combinations(range(group.shape[1]), 2):
+            pairs = {(a, b): 0 for a in (0, 1) for b in (0, 1)}
+            for a, b in group[:, [i, j]]:
+                pairs[(a, b)] += 1
+            assert set(pairs.values()) == {2} # each combination of levels of two factors
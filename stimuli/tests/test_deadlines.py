@@ -0,0 +1,62 @@
+import pytest
+
+from experiment import deadlines
+from experiment.deadlines import DeadlineWatchdog
+
+PERIOD = 0.01
+
+
+@pytest.fixture
+def flip(monkeypatch):
+    """Set the time of the last flip seen by the watchdog."""
+    times = {"flip": 0.0}
+    monkeypatch.setattr(deadlines, "frame_period", lambda: PERIOD)
+    monkeypatch.setattr(deadlines, "last_flip_time", lambda: times["flip"])
+    return lambda time: times.update(flip=time)
+
+
+def draw_gabor():
+    pass
+
+
+def test_a_miss_is_a_flip_later_than_half_a_frame(flip):
+    watchdog = DeadlineWatchdog()
+    flip(1.004)
+    watchdog.check("trial 1", "leading", 1.0, 0.002, [])
+    flip(2.006)
+    watchdog.check("trial 1", "isi", 2.0, 0.002, [])
+    assert watchdog.segments == 2
+    assert [(label, round(late, 6)) for _, label, _, late in watchdog.misses] == [("isi", 0.006)]
+    assert watchdog.trial_stats()["deadline_misses"] == 1
+    assert watchdog.trial_stats()["deadline_misses"] == 0 # reset per trial
+
+
+def test_cause_of_a_miss(flip):
+    watchdog = DeadlineWatchdog()
+    flip(1.01)
+    watchdog.check("trial 1", "leading", 1.0, -0.003, [(draw_gabor, 0.012), (print, 0.001)]) # preparation overran
+    flip(2.01)
+    watchdog.check("trial 1", "trailing", 2.0, 0.004, [(draw_gabor, 0.001)]) # prepared in time
+    causes = [cause for _, _, cause, _ in watchdog.misses]
+    assert causes == ["prep (draw_gabor 12.0 ms)", "flip"]
+
+
+def test_debt_is_recovered_over_the_next_itis_above_the_floor(flip):
+    watchdog = DeadlineWatchdog()
+    flip(1.05)
+    watchdog.check("trial 1", "leading", 1.0, None, []) # 50 ms lost
+    assert watchdog.compensate(1.02, min_iti=1.0) == pytest.approx(1.0) # only down to the floor
+    assert watchdog.debt == pytest.approx(0.03) # carried over
+    assert watchdog.compensate(0.9, min_iti=1.0) == 0.9 # an ITI under the floor is not shortened
+    assert watchdog.compensate(1.5, min_iti=1.0) == pytest.approx(1.47)
+    assert watchdog.debt == pytest.approx(0.0)
+    assert watchdog.recovered == pytest.approx(0.05)
+    assert watchdog.trial_stats()["iti_compensation_ms"] == pytest.approx(30.0)
+
+
+def test_compensated_iti_uses_the_iti_range_floor(flip, monkeypatch):
+    monkeypatch.setattr(deadlines, "WATCHDOG", DeadlineWatchdog())
+    flip(1.2)
+    deadlines.check_deadline("trial 1", "leading", 1.0, None, []) # 200 ms lost
+    assert deadlines.compensated_iti(1.1, iti_range=(1.0, 1.5)) == pytest.approx(1.0)
+    assert deadlines.compensated_iti(1.5, iti_range=(1.0, 1.5)) == pytest.approx(1.4)
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from experiment import frames
+from experiment.frames import FrameMonitor, print_block_frame_summary
+
+PERIOD = 0.01
+
+
+class FakeScreen:
+    """Window whose flips return at given times, on a fake perf_counter."""
+    def __init__(self, monkeypatch):
+        self.now = 0.0
+        self.flip_ends = []
+        monkeypatch.setattr(frames, "perf_counter", lambda: self.now)
+        monkeypatch.setattr(frames, "record_wakeup", lambda latency: None)
+
+    def wait(self, duration):
+        self.now += duration
+
+    def flip(self):
+        self.now = self.flip_ends.pop(0)
+
+
+def show(monitor, screen, label, flip_end, duration=None, delay=0.0):
+    """Flip at flip_end after keeping the current screen for duration. delay: trigger sent before the flip."""
+    if duration is not None:
+        planned = monitor.last_flip + round(duration / PERIOD) * PERIOD
+        monitor.wait_screen(screen, duration)
+        if delay:
+            screen.now += delay
+            monitor.delay(planned)
+    screen.flip_ends.append(flip_end)
+    monitor.flip()
+    monitor.label_last_flip(label)
+
+
+def test_a_late_flip_is_one_dropped_frame(monkeypatch):
+    screen = FakeScreen(monkeypatch)
+    monitor = FrameMonitor(screen, PERIOD)
+    monitor.start_trial()
+    show(monitor, screen, "leading", 0.0)
+    show(monitor, screen, "isi", 0.03, duration=0.02) # one frame late: the leading screen lasts 3 frames
+    show(monitor, screen, "trailing", 0.05, duration=0.02)
+
+    stats = monitor.trial_stats()
+    assert stats["late_flips"] == 1
+    assert stats["leading_frames"] == 3 and stats["leading_frames_planned"] == 2
+    assert stats["dropped_frames"] == 1
+
+
+def test_trigger_before_the_isi_flip_is_not_a_dropped_frame(monkeypatch):
+    screen = FakeScreen(monkeypatch)
+    monitor = FrameMonitor(screen, PERIOD)
+    monitor.start_trial()
+    show(monitor, screen, "leading", 0.0)
+    # explicit phase: the 16 ms trigger before the ISI flip delays it to the next frames on purpose
+    show(monitor, screen, "isi", 0.04, duration=0.02, delay=0.016)
+    show(monitor, screen, "trailing", 0.06, duration=0.02)
+
+    stats = monitor.trial_stats()
+    assert stats["leading_frames"] == 4 and stats["leading_frames_planned"] == 2
+    assert stats["dropped_frames"] == 0
+    assert monitor.block_summary()["long_screens"] == 0
+
+
+def test_summary_of_a_block_without_flips(monkeypatch, capsys):
+    window = SimpleNamespace(flip=lambda: None)
+    monkeypatch.setattr(frames, "FRAMES", FrameMonitor(window, 1 / 60))
+
+    print_block_frame_summary("test", 1) # e.g. a block aborted before its first screen
+    assert "0 flips" in capsys.readouterr().out
+
+    window.flip()
+    print_block_frame_summary("test", 2)
+    assert "flip duration median" in capsys.readouterr().out
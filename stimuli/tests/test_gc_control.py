@@ -0,0 +1,41 @@
+import gc
+
+import pytest
+
+from experiment import gc_control
+from experiment.gc_control import collect_garbage, end_block_gc, start_block_gc, trial_gc_stats
+
+
+def test_gc_control_is_off_by_default():
+    assert not gc_control.ENABLED
+    start_block_gc()
+    assert gc.isenabled()
+    collect_garbage()
+    assert "gc_pause_ms" not in trial_gc_stats()
+    end_block_gc("test", 1)
+    assert gc.isenabled()
+
+
+def test_automatic_collection_is_restored_after_a_block(monkeypatch):
+    monkeypatch.setattr(gc_control, "ENABLED", True)
+    start_block_gc()
+    assert not gc.isenabled() and gc.get_freeze_count() > 0
+    collect_garbage()
+    assert "gc_pause_ms" in trial_gc_stats()
+    end_block_gc("test", 1)
+    assert gc.isenabled() and gc.get_freeze_count() == 0
+
+
+def test_automatic_collection_is_restored_when_a_block_raises(monkeypatch):
+    pytest.importorskip("pylink") # imported by the eye tracker module (requirements.txt)
+    from experiment import phases
+
+    def failing_phase(*args):
+        assert not gc.isenabled()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(gc_control, "ENABLED", True)
+    monkeypatch.setattr(phases, "test_phase", failing_phase)
+    with pytest.raises(KeyboardInterrupt):
+        phases.run_phase("test", 1, None, {"participant_id": "p01"}, "No", {})
+    assert gc.isenabled() and gc.get_freeze_count() == 0
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from experiment import io_worker
+from experiment.io_worker import DataWriter
+
+
+def test_drain_raises_the_first_failed_write():
+    writer = DataWriter()
+    written = []
+
+    def failing_write():
+        raise OSError("disk full")
+
+    writer.submit(failing_write)
+    writer.submit(written.append, "after") # later writes still run
+    with pytest.raises(OSError, match="disk full"):
+        writer.drain()
+    assert written == ["after"]
+    assert writer.failed_writes == 1
+
+    writer.drain() # the error is raised once
+    writer.close()
+
+
+def test_one_writer_for_concurrent_first_calls(monkeypatch):
+    monkeypatch.setattr(io_worker, "WRITER", None)
+    barrier = threading.Barrier(8)
+    writers = []
+
+    def first_call():
+        barrier.wait()
+        writers.append(io_worker.get_data_writer())
+
+    threads = [threading.Thread(target=first_call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(writer) for writer in writers}) == 1
+    writers[0].close()
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+from pyglet.window import key
+
+from experiment import keyboard
+from experiment.keyboard import KeyCollector, wait_response
+
+
+class FakeWindow:
+    """Window whose pending key presses are dispatched on dispatch_events."""
+    def __init__(self):
+        self.pending = [] # (symbol, perf_counter time)
+        self.handler = None
+        self.dispatches = 0
+
+    def push_handlers(self, on_key_press):
+        self.handler = on_key_press
+
+    def press(self, symbol, time):
+        self.pending.append((symbol, time))
+
+    def dispatch_events(self):
+        self.dispatches += 1
+        for symbol, time in self.pending:
+            keyboard.perf_counter = lambda: time # dispatch time of the press
+            self.handler(symbol, 0)
+        self.pending = []
+
+
+def test_wait_clears_earlier_presses_and_skips_other_keys(monkeypatch):
+    monkeypatch.setattr(keyboard, "perf_counter", keyboard.perf_counter)
+    window = FakeWindow()
+    collector = KeyCollector(window)
+    window.press(key.Z, 9.0)
+    window.dispatch_events() # anticipation before the response screen
+    window.press(key.SPACE, 10.1) # not a response key
+    window.press(key.M, 10.2)
+    window.press(key.Z, 10.3)
+
+    assert collector.wait(["Z", "M"], onset=10.0, max_wait=2) == ("M", 10.2)
+    assert collector.poll(["Z", "M"]) == ("Z", 10.3)
+    assert collector.poll(["Z", "M"]) is None
+
+
+def test_wait_times_out_without_busy_looping():
+    window = FakeWindow()
+    collector = KeyCollector(window)
+    onset = keyboard.perf_counter()
+    assert collector.wait(["Z"], onset, max_wait=0.02) == (None, None)
+    assert window.dispatches < 100 # one poll every POLL_INTERVAL, not a spin
+
+
+def test_wait_response_gives_clock_and_flip_reaction_times(monkeypatch):
+    monkeypatch.setattr(keyboard, "perf_counter", keyboard.perf_counter)
+    window = FakeWindow()
+    monkeypatch.setattr(keyboard, "KEYBOARD", KeyCollector(window))
+    monkeypatch.setattr(keyboard, "last_flip_time", lambda: 100.0) # flip of the response screen
+    clock = SimpleNamespace(start_time=100.004, time=lambda: 0.0) # reset after the flip returned
+    window.press(key.M, 100.5)
+
+    event, flip_rt = wait_response(window, ["Z", "M"], clock, max_wait=2)
+    assert event.key == "M"
+    assert abs(event.timestamp - 0.496) < 1e-9 # raw: from the response clock
+    assert abs(flip_rt - 0.5) < 1e-9 # corrected: from the flip
@@ -0,0 +1,39 @@
+import threading
+
+from experiment.prefetch import Prefetcher
+
+
+def test_hit_waits_for_the_job_of_the_trial():
+    prefetcher = Prefetcher()
+    release = threading.Event()
+    prefetcher.submit(("test", 1, 2), lambda: release.wait() and "stimuli of trial 2")
+    threading.Timer(0.05, release.set).start() # the job is still running when the trial starts
+    assert prefetcher.take(("test", 1, 2)) == "stimuli of trial 2"
+    assert (prefetcher.hits, prefetcher.misses) == (1, 0)
+    assert prefetcher.waits[0] > 0.02
+
+
+def test_miss_for_a_trial_that_was_not_prefetched():
+    prefetcher = Prefetcher()
+    assert prefetcher.take(("test", 1, 3)) is None
+    prefetcher.submit(("test", 1, 4), lambda: "stimuli of trial 4")
+    assert prefetcher.take(("test", 1, 5)) is None # another trial
+    assert prefetcher.take(("test", 1, 4)) == "stimuli of trial 4" # still pending
+    assert (prefetcher.hits, prefetcher.misses) == (1, 2)
+
+
+def test_new_job_replaces_the_one_not_taken():
+    prefetcher = Prefetcher()
+    prefetcher.submit(("test", 1, 6), lambda: "stimuli of trial 6") # e.g. block interrupted
+    prefetcher.submit(("learning", 1, 1), lambda: "stimuli of learning trial 1")
+    assert prefetcher.take(("test", 1, 6)) is None
+    assert prefetcher.take(("learning", 1, 1)) == "stimuli of learning trial 1"
+
+
+def test_failed_job_is_a_miss():
+    prefetcher = Prefetcher()
+    prefetcher.submit(("test", 1, 7), lambda: 1 / 0)
+    assert prefetcher.take(("test", 1, 7)) is None
+    assert prefetcher.misses == 1
+    prefetcher.submit(("test", 1, 8), lambda: "stimuli of trial 8") # the worker keeps running
+    assert prefetcher.take(("test", 1, 8)) == "stimuli of trial 8"
@@ -0,0 +1,36 @@
+from experiment import preload
+from experiment.preload import cached, finish_preload, preload_block
+
+MB = 2**20
+
+
+def test_assets_are_built_one_per_step_and_the_rest_before_the_first_trial(monkeypatch):
+    monkeypatch.setattr(preload, "BLOCK_CACHE", None)
+    built = []
+    assets = {("gabor", angle): (MB, built.append, (angle,)) for angle in (45, 135, 0)}
+
+    steps = preload_block("test", 1, assets)
+    assert next(steps) == ("gabor", 45) # one asset built while the instructions are shown
+    assert built == [45] and not preload.BLOCK_CACHE.ready
+    finish_preload(steps) # the instructions ended
+    assert built == [45, 135, 0]
+    assert preload.BLOCK_CACHE.ready
+    assert ("gabor", 0) in preload.BLOCK_CACHE.assets
+    assert cached(("tone", 1000)) is None
+
+
+def test_assets_over_the_budget_are_skipped():
+    cache = preload.BlockCache("localizer", 1, budget_mb=2)
+    assert cache.add("tone", MB, lambda: "tone")
+    assert not cache.add("sequence", 2 * MB, lambda: "sequence") # does not fit any more
+    assert cache.add("gabor", MB, lambda: "gabor")
+    assert cache.get("tone") == "tone" and cache.get("gabor") == "gabor"
+    assert cache.get("sequence") is None # prepared trial by trial
+    assert cache.skipped == 1 and cache.nbytes == 2 * MB
+
+
+def test_a_new_block_replaces_the_cache(monkeypatch):
+    monkeypatch.setattr(preload, "BLOCK_CACHE", None)
+    finish_preload(preload_block("test", 1, {"gabor": (1, lambda: "block 1", ())}))
+    finish_preload(preload_block("test", 2, {"tone": (1, lambda: "block 2", ())}))
+    assert cached("gabor") is None and cached("tone") == "block 2"
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from experiment import quest as quest_module
+from experiment.constants import QUEST_PARAMS
+from experiment.io_worker import drain
+from experiment.quest import load_last_quest_data, new_quest, quest, quest_record, save_quest_data
+from experiment.staircase_sim import p_correct, threshold
+
+
+@pytest.mark.parametrize("alpha, beta, seed", [(6.0, 2.0, 0), (12.0, 3.0, 1)])
+def test_posterior_converges_on_the_observer_threshold(alpha, beta, seed):
+    rng = np.random.default_rng(seed)
+    guess, lapse = QUEST_PARAMS["guess"], QUEST_PARAMS["lapse"]
+    true_threshold = threshold(alpha, beta, guess, lapse, QUEST_PARAMS["target_p"])
+
+    quest_data = new_quest()
+    prior_sd = quest_data["threshold_sd"]
+    for _ in range(240): # 5 test blocks of 48 target trials
+        correct = rng.random() < p_correct(quest_data["ori_diff"], alpha, beta, guess, lapse)
+        quest_data = quest(int(correct), **quest_data)
+
+    assert quest_data["n_updates"] == 240
+    assert abs(quest_data["threshold_mean"] - true_threshold) < 1.5
+    assert quest_data["threshold_sd"] < prior_sd / 4
+    assert "posterior" not in quest_record(quest_data)
+
+
+def test_posterior_is_carried_over_to_the_next_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(quest_module, "DATA_FOLDER", str(tmp_path))
+    (tmp_path / "p01").mkdir()
+    quest_data = new_quest()
+    for outcome in [1, 1, 0, 1, 1, 1, 0]:
+        quest_data = quest(outcome, **quest_data)
+
+    save_quest_data({"participant_id": "p01"}, quest_data, block=1)
+    drain()
+    loaded = load_last_quest_data({"participant_id": "p01"}, block=2)
+    np.testing.assert_array_equal(loaded["posterior"], quest_data["posterior"])
+    assert loaded["ori_diff"] == quest_data["ori_diff"] and loaded["n_updates"] == 7
+
+    with pytest.raises(FileNotFoundError):
+        load_last_quest_data({"participant_id": "p01"}, block=4)
@@ -0,0 +1,13 @@
+from experiment.realtime import MCL_CURRENT, MCL_FUTURE, memory_lock_mode
+
+MB = 2**20
+
+
+def test_memory_lock_mode_follows_the_memlock_limit():
+    assert memory_lock_mode(None, 300 * MB, 256)[0] == MCL_CURRENT | MCL_FUTURE
+    assert memory_lock_mode(600 * MB, 300 * MB, 256)[0] == MCL_CURRENT | MCL_FUTURE
+    # room for the current pages, not for the preloaded block
+    assert memory_lock_mode(400 * MB, 300 * MB, 256)[0] == MCL_CURRENT
+    # the default 8 MB limit of most distributions
+    flags, mode = memory_lock_mode(8 * MB, 300 * MB, 256)
+    assert flags is None and "8 MB" in mode
@@ -0,0 +1,30 @@
+import json
+
+from experiment import records
+from experiment.records import BlockRecorder, block_data_path, load_block_records
+
+
+def test_legacy_json_block_is_loaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "DATA_FOLDER", str(tmp_path))
+    (tmp_path / "p01").mkdir()
+    trials = [{"trial": 1, "ori_diff": 8.0}, {"trial": 2, "ori_diff": 6.5, "history": [1, -1]}]
+    with open(tmp_path / "p01" / "test_block1.json", "w") as f:
+        json.dump(trials, f)
+
+    path = block_data_path("p01", "test", 1)
+    assert path.endswith("test_block1.json")
+    assert load_block_records(path) == trials
+
+
+def test_npz_block_is_preferred_over_legacy_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "DATA_FOLDER", str(tmp_path))
+    (tmp_path / "p01").mkdir()
+    with open(tmp_path / "p01" / "test_block1.json", "w") as f:
+        json.dump([{"trial": 1}], f)
+    recorder = BlockRecorder("test", 1)
+    recorder.append({"trial": 1, "ori_diff": 4.0})
+    recorder.to_npz(block_data_path("p01", "test", 1, run=1))
+
+    path = block_data_path("p01", "test", 1)
+    assert path.endswith("test_block1.npz")
+    assert load_block_records(path)[0]["ori_diff"] == 4.0
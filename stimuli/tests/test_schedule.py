@@ -0,0 +1,77 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from experiment.schedule import (block_rng, build_participant_conditions, explicit_schedule, learning_schedule,
+                                 localizer_schedule, trials_to_dicts)
+
+# Weights of the baseline setup.generate_trials: (leading, trailing, pred, weight) for mapping 0 and 1
+BASELINE_VISUAL = {
+    0: [(90, 135, "EXP", 3), (90, 45, "UEX", 1), (0, 45, "EXP", 3), (0, 135, "UEX", 1)],
+    1: [(90, 45, "EXP", 3), (90, 135, "UEX", 1), (0, 135, "EXP", 3), (0, 45, "UEX", 1)],
+}
+BASELINE_AUDITORY = {
+    0: [(1000, 100, "EXP", 3), (1000, 160, "UEX", 1), (1600, 160, "EXP", 3), (1600, 100, "UEX", 1)],
+    1: [(1000, 160, "EXP", 3), (1000, 100, "UEX", 1), (1600, 100, "EXP", 3), (1600, 160, "UEX", 1)],
+}
+NEUTRAL_VISUAL = [("neutralV", 45, "neutral", 2), ("neutralV", 135, "neutral", 2)] # no auditory neutral pairs (weight 0)
+
+
+@pytest.mark.parametrize("auditory_mapping, visual_mapping", [(0, 0), (0, 1), (1, 0), (1, 1)])
+def test_learning_block_matches_the_baseline_counts(auditory_mapping, visual_mapping):
+    trials = trials_to_dicts(learning_schedule(block_rng(7, "learning", 1), auditory_mapping, visual_mapping),
+                             auditory_mapping, visual_mapping)
+    expected = {
+        (*v[:3], *a[:3]): v[3] * a[3]
+        for v in BASELINE_VISUAL[visual_mapping] + NEUTRAL_VISUAL
+        for a in BASELINE_AUDITORY[auditory_mapping]
+    }
+    combinations = Counter((t["v_leading"], t["v_trailing"], t["v_pred"], t["a_leading"], t["a_trailing"], t["a_pred"]) for t in trials)
+    assert combinations == expected
+    assert len(trials) == sum(expected.values()) == 96
+
+    # half of the repetitions of each combination are targets, the extra one of odd counts either way
+    targets = Counter()
+    for t in trials:
+        targets[(t["v_leading"], t["v_trailing"], t["a_leading"], t["a_trailing"])] += t["target"]
+    for (v_leading, v_trailing, _, a_leading, a_trailing, _), count in expected.items():
+        assert targets[(v_leading, v_trailing, a_leading, a_trailing)] in {count // 2, count - count // 2}
+
+
+def test_each_block_is_reproducible_from_the_seed():
+    for phase, block in [("localizer", 1), ("learning", 1), ("test", 3), ("explicit", 2)]:
+        first, second = block_rng(123, phase, block), block_rng(123, phase, block)
+        if phase == "localizer":
+            for a, b in zip(localizer_schedule(first), localizer_schedule(second)):
+                np.testing.assert_array_equal(a, b)
+        elif phase == "explicit":
+            np.testing.assert_array_equal(explicit_schedule(first, "auditory"), explicit_schedule(second, "auditory"))
+        else:
+            np.testing.assert_array_equal(learning_schedule(first), learning_schedule(second))
+
+    # blocks and seeds draw from independent streams
+    assert not np.array_equal(learning_schedule(block_rng(123, "test", 1)), learning_schedule(block_rng(123, "test", 2)))
+    assert not np.array_equal(learning_schedule(block_rng(123, "test", 1)), learning_schedule(block_rng(124, "test", 1)))
+
+
+def test_participant_conditions_depend_only_on_the_seed():
+    assert build_participant_conditions(42) == build_participant_conditions(42)
+    assert build_participant_conditions(42) != build_participant_conditions(43)
+
+
+def test_explicit_block_asks_every_predictive_pair_three_times():
+    trials = trials_to_dicts(explicit_schedule(block_rng(5, "explicit", 1), "visual", 0, 0), 0, 0)
+    pairs = Counter((t["v_leading"], t["v_trailing"], t["v_pred"]) for t in trials)
+    assert pairs == {(v[0], v[1], v[2]): 3 for v in BASELINE_VISUAL[0]}
+    assert all(t["modality"] == "visual" and t["a_leading"] is None and t["target"] is None for t in trials)
+
+
+def test_localizer_target_counts():
+    visual, auditory, targets, target_count = localizer_schedule(block_rng(9, "localizer", 1), n_trials=2000)
+    assert visual.shape == auditory.shape == targets.shape == (2000, 12)
+    np.testing.assert_array_equal(targets.sum(axis=1), target_count)
+    assert 0.45 < np.mean(target_count == 0) < 0.55 # P(0 targets) = 0.5
+    assert 0.30 < np.mean(target_count == 1) < 0.40 # P(1 target) = 0.35
+    # every sequence presents the 12 balanced multimodal pairs
+    assert all(Counter(zip(v, a)) == {(45, 100): 3, (45, 160): 3, (135, 100): 3, (135, 160): 3} for v, a in zip(visual.tolist(), auditory.tolist()))
@@ -0,0 +1,32 @@
+import logging
+
+import numpy as np
+import pytest
+
+from experiment.schedule import learning_schedule
+from experiment.sequencing import _ConstrainedOrder, sequence_trials
+
+
+def test_unsatisfiable_constraints_keep_the_best_order(caplog):
+    rng = np.random.default_rng(3)
+    trials = learning_schedule(rng, 0, 0)
+    constraints = {"max_run": {"v_pred": 1}, "min_uex_distance": {"v_pred": 40}, "max_iterations": 300}
+
+    with caplog.at_level(logging.WARNING):
+        ordered, stats = sequence_trials(trials, np.random.default_rng(4), constraints)
+
+    assert not stats["satisfied"]
+    assert stats["violations"]
+    assert "Sequence constraints not met" in caplog.text
+    # the returned order is the best one found, not the last one visited
+    assert _ConstrainedOrder(ordered, constraints).cost() == pytest.approx(stats["cost"], abs=0.01)
+    start = trials[np.random.default_rng(4).permutation(len(trials))]
+    assert stats["cost"] <= _ConstrainedOrder(start, constraints).cost()
+
+
+def test_default_constraints_are_satisfied():
+    rng = np.random.default_rng(5)
+    trials = learning_schedule(rng, 1, 0)
+    ordered, stats = sequence_trials(trials, rng)
+    assert stats["satisfied"] and stats["violations"] == []
+    assert len(ordered) == len(trials)
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+pytest.importorskip("pylink") # imported by the eye tracker module (requirements.txt)
+
+from experiment import phases
+from experiment.frames import monitor_frames
+from experiment.io_worker import drain
+from experiment.records import block_data_path, load_block_records
+from experiment.simulation import Simulation
+from experiment.triggers import get_tracker
+
+
+def test_simulated_learning_block(tmp_path):
+    """One learning block runs headless in virtual time and its data is saved in the simulation folder."""
+    with Simulation(seed=1, data_folder=str(tmp_path)) as simulation:
+        window, participant_data, _, _, full_screen, screen_info, edf_filename = simulation.setup(batch=None)
+        get_tracker(simulation.tracker(window, edf_filename))
+        monitor_frames(window, screen_info)
+        phases.run_phase("learning", 1, window, participant_data, full_screen, screen_info)
+        drain()
+        participant_id = participant_data["participant_id"]
+        path = block_data_path(participant_id, "learning", 1)
+
+    records = load_block_records(path)
+    assert path.startswith(str(tmp_path))
+    assert len(records) == len(participant_data["conditions_learning_1"])
+    assert all(record["flip_trailing"] > record["flip_leading"] for record in records)
+    with open(tmp_path / participant_id / f"{participant_id}_info.json") as f:
+        assert 1 in json.load(f)["completed_blocks"]["learning"]
+    assert simulation.serial.n_writes > 0
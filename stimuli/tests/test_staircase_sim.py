@@ -0,0 +1,27 @@
+from experiment.constants import INITIAL_STAIRCASE, PHASES, STAIRCASE_PARAMS
+from experiment.staircase_sim import TARGETS_PER_BLOCK, check_update_rule, parameter_grid, simulate
+
+PARAMS = {"initial": INITIAL_STAIRCASE, **STAIRCASE_PARAMS}
+
+
+def test_simulation_is_reproducible_with_a_seed():
+    first = simulate(PARAMS, n_observers=500, seed=3, chunk=200)
+    assert first == simulate(PARAMS, n_observers=500, seed=3, chunk=200)
+    assert first != simulate(PARAMS, n_observers=500, seed=4, chunk=200)
+    assert first["n_trials"] == TARGETS_PER_BLOCK * PHASES["test_blocks"] # all test blocks by default
+
+
+def test_update_rule_matches_the_experiment_staircase():
+    assert check_update_rule(n_observers=50, n_trials=200)
+
+
+def test_staircase_tracks_the_observer_threshold():
+    result = simulate(PARAMS, n_observers=2000, seed=0)
+    assert result["converged"] > 0.8
+    assert abs(result["bias_mean"]) < 0.5
+
+
+def test_parameter_grid():
+    sets = parameter_grid([10, 15], [20, 25], [[6, 4, 2, 1]], [[2, 4, 8]])
+    assert len(sets) == 4
+    assert {(s["initial"]["ori_diff"], s["max_diff"]) for s in sets} == {(10, 20), (10, 25), (15, 20), (15, 25)}
@@ -0,0 +1,101 @@
+import pytest
+
+pytest.importorskip("pylink") # imported by the eye tracker module (requirements.txt)
+
+from experiment import frames, timeline
+from experiment.timeline import Screen, Trial, run_trial
+
+
+class FakeWindow:
+    """Window on a virtual clock, logging the draws, waits, flips and triggers in order."""
+    def __init__(self):
+        self.now = 0.0
+        self.events = []
+
+    def wait(self, duration):
+        self.now += duration
+        self.events.append(("wait", round(duration, 6)))
+
+    def flip(self):
+        self.events.append(("flip",))
+
+
+class FakeClock:
+    def __init__(self, window):
+        self.window = window
+        self.start_time = window.now
+
+    def reset(self):
+        self.start_time = self.window.now
+
+    def time(self):
+        return self.window.now - self.start_time
+
+
+class FakeTone:
+    def __init__(self, window, latency):
+        self.window = window
+        self.latency = latency
+        self.planned_onset = None
+        self.estimated_onset = None
+
+    def play_at(self, onset):
+        self.window.events.append(("tone", round(onset, 6)))
+        self.planned_onset = onset
+        self.estimated_onset = onset + self.latency
+        return self.estimated_onset
+
+
+@pytest.fixture
+def window(monkeypatch):
+    window = FakeWindow()
+    monkeypatch.setattr(frames, "FRAMES", None) # screens timed with window.wait
+    monkeypatch.setattr(timeline, "Clock", lambda: FakeClock(window))
+    monkeypatch.setattr(timeline, "mark_first_trial", lambda: None)
+    monkeypatch.setattr(timeline, "next_flip_time", lambda duration: window.now + duration)
+    monkeypatch.setattr(timeline, "send_trigger", lambda trigger, context: window.events.append(("trigger", trigger)))
+    monkeypatch.setattr(timeline, "check_deadline", lambda context, label, planned, slack, prep: window.events.append(("deadline", label)))
+    monkeypatch.setattr(timeline, "collect_garbage", lambda: window.events.append(("collect",)))
+    return window
+
+
+def compile_trial(window, isi_trigger_before_flip=False):
+    draw = lambda name: window.events.append(("draw", name))
+    tone = FakeTone(window, latency=0.002)
+    screens = [
+        Screen("fixation", 1.0, 1, draws=[(draw, ("fixation",), {})], collect=True),
+        Screen("leading", 0.5, 2, draws=[(draw, ("gabor",), {})], tone=tone, tone_label="leading"),
+        Screen("isi", 0.25, 3, draws=[(draw, ("fixation",), {})], trigger_before_flip=isi_trigger_before_flip),
+    ]
+    response = (lambda window, answer: {"response": answer}, ("Z",))
+    return Trial(screens, response, "trial 1", prepare_next=(draw, ("next trial",)))
+
+
+def test_screens_are_drawn_before_the_wait_and_triggered_after_the_flip(window):
+    response, _ = run_trial(window, compile_trial(window))
+    assert response == {"response": "Z"}
+    assert window.events == [
+        ("draw", "fixation"), ("flip",), ("trigger", 1), ("collect",),
+        ("draw", "gabor"), ("tone", 1.0), ("wait", 1.0), ("flip",), ("trigger", 2), ("deadline", "leading"),
+        ("draw", "fixation"), ("wait", 0.5), ("flip",), ("trigger", 3), ("deadline", "isi"),
+        ("wait", 0.25), ("draw", "next trial"),
+    ]
+
+
+def test_timestamps_are_relative_to_the_start_of_the_trial(window):
+    window.now = 100.0
+    _, timestamps = run_trial(window, compile_trial(window))
+    for label, time in {"fixation": 0.0, "leading": 1.0, "isi": 1.5}.items():
+        assert timestamps[f"start_{label}"] == pytest.approx(time)
+        assert timestamps[f"flip_{label}"] == pytest.approx(time)
+    assert timestamps["leading_tone_planned"] == pytest.approx(1.0)
+    assert timestamps["leading_av_offset_ms"] == pytest.approx(2.0)
+    assert timestamps["start_response"] == pytest.approx(1.75)
+    assert timestamps["end_trial"] == pytest.approx(1.75)
+    assert "start_trial_absolute" in timestamps
+
+
+def test_trigger_before_flip_is_sent_after_the_wait(window):
+    run_trial(window, compile_trial(window, isi_trigger_before_flip=True))
+    isi = window.events[window.events.index(("draw", "fixation"), 1):]
+    assert isi[:5] == [("draw", "fixation"), ("wait", 0.5), ("trigger", 3), ("flip",), ("deadline", "isi")]